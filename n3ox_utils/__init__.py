@@ -1,5 +1,17 @@
 # -*- coding: utf-8 -*-
-from . import nfanim
-from . import plot_tools
-from . import pynec_helpers
-from . import tlcalc
\ No newline at end of file
+import importlib
+
+# --- submodules load on first use, so importing the NumPy-only modules
+# (framewriters, framerender, ...) doesn't pull in matplotlib ---
+_submodules = ['diskcache', 'framerender', 'framewriters', 'necsweep', 'nearfield',
+               'nfanim', 'plot_tools', 'pynec_helpers', 'tlcalc']
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Daniel S. Zimmerman, N3OX
+
+'''
+A small content-addressed on-disk cache with size-bounded LRU eviction.
+
+Entries are files named by a hex digest key. File modification times
+track recent use, so the LRU order survives between Python sessions.
+'''
+import os
+import hashlib
+import tempfile
+
+
+def digest(*parts):
+    '''
+    Returns the SHA-256 hex digest of parts, which may be bytes, str,
+    or objects supporting the buffer protocol (like NumPy arrays).
+    Parts are length-prefixed so different splits can't collide.
+    '''
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        part = memoryview(part).cast('B')
+        hasher.update(len(part).to_bytes(8, 'little'))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+class DiskLRUCache(object):
+    '''
+    Stores byte strings in files under directory, keyed by hex digests.
+
+    When the total size exceeds max_bytes, the least recently used
+    entries are deleted. Hit and miss counts are kept in self.hits and
+    self.misses.
+    '''
+
+    def __init__(self, directory, max_bytes=2**30, suffix='.bin'):
+        '''
+         directory: cache directory, created if needed
+
+         max_bytes: total size bound for all entries
+
+         suffix: file name extension for entries
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        # --- index of key: size, built once from the directory listing ---
+        self.index = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(self.suffix):
+                    key = entry.name[:-len(self.suffix)]
+                    self.index[key] = entry.stat().st_size
+
+    def path(self, key):
+        '''
+        File name of the entry for key.
+        '''
+        return os.path.join(self.directory, key + self.suffix)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def total_bytes(self):
+        '''
+        Total size of all entries in bytes.
+        '''
+        return sum(self.index.values())
+
+    def get(self, key):
+        '''
+        Returns the stored bytes for key, or None on a miss.
+        A hit marks the entry as most recently used.
+        '''
+        if key in self.index:
+            try:
+                with open(self.path(key), 'rb') as cachef:
+                    data = cachef.read()
+                os.utime(self.path(key))
+                self.hits += 1
+                return data
+            except FileNotFoundError:  # removed behind our back
+                del self.index[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, data, evict=True):
+        '''
+        Stores data under key. The file is written to a temporary name
+        and renamed, so readers never see partial entries.
+
+        With evict=False, eviction is left for a later evict() call, so
+        entries known to be present stay readable during a long job.
+        '''
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmpf:
+            tmpf.write(data)
+        os.replace(tmpname, self.path(key))
+        self.index[key] = len(data)
+        if evict:
+            self.evict()
+
+    def evict(self):
+        '''
+        Deletes least recently used entries until the total size
+        is at most self.max_bytes.
+        '''
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+
+        def last_used(key):
+            try:
+                return os.stat(self.path(key)).st_mtime
+            except FileNotFoundError:
+                return float('-inf')
+
+        for key in sorted(self.index, key=last_used):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(key)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        '''
+        Deletes every entry.
+        '''
+        for key in list(self.index):
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+        self.index = {}
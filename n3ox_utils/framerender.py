@@ -0,0 +1,881 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Daniel S. Zimmerman, N3OX
+
+'''
+Lazy frame sources and matplotlib-free frame rendering.
+
+The frame sequences (PhasorFrames, PoyntingFrames, TimeDomainFrames),
+the LUT renderers, the frame cache keys and render_parallel() only
+depend on NumPy, the standard library and framewriters, so frames can
+be rendered on headless nodes without matplotlib, ipywidgets or IPython.
+Colorcet colormap names are resolved from colorcet's color lists, and
+matplotlib is only imported for matplotlib colormap names.
+nfanim builds its animation classes on top of this module.
+'''
+import os
+import copy
+import types
+import functools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import n3ox_utils.framewriters as fwr
+import n3ox_utils.diskcache as dkc
+
+
+def _unscaled(x):
+    '''
+    Default scalefunc: returns the normalized field unchanged.
+
+    A module-level function rather than a lambda so that animation
+    objects stay picklable.
+    '''
+    return x
+
+
+def _indexed_frames(frames, fnum):
+    '''
+    frames[fnum] for the lazy frame sequences: one frame for an integer,
+    or for a slice or index array the selected frames stacked along a
+    new last axis, like materialize().
+    '''
+    samples = frames.samples[fnum]
+    if np.ndim(samples) == 0:
+        return frames.frame_at(samples)
+    if len(samples) == 0:
+        return np.zeros(tuple(frames.shape) + (0,))
+    return np.stack([frames.frame_at(sample) for sample in samples], axis=-1)
+
+
+class PhasorFrames(object):
+    '''
+    Lazy sequence of the real, normalized and scaled frames of one
+    period of a complex amplitude field.
+
+    Frame n is
+
+      scalefunc(Re(A*exp(-1j*phase[n]))/max|A|)
+        = scalefunc(Ar*cos(phase[n]) + Ai*sin(phase[n]))
+
+    so only the two real basis arrays Ar = Re(A)/max|A| and
+    Ai = Im(A)/max|A| are stored. Frames are computed on demand by
+    indexing or iteration and memory stays O(nx*ny) for any
+    number of frames.
+    '''
+    # --- basis arrays placed in shared memory for parallel rendering ---
+    _shared_fields = ('Ar', 'Ai')
+    sample_name = 'phase'
+    period = 2*np.pi
+
+    def __init__(self, fieldamp, phase, scalefunc=None):
+        '''
+         fieldamp: complex amplitude field, any shape
+
+         phase: 1D array of frame phases in radians
+
+         scalefunc: optional, function to scale the normalized
+         real part of the field.
+        '''
+        A = np.asarray(fieldamp)
+        self.norm = np.max(np.abs(A))
+        self.Ar = A.real/self.norm
+        self.Ai = A.imag/self.norm
+        self.phase = np.asarray(phase)
+        self.scalefunc = scalefunc if scalefunc else _unscaled
+
+    @property
+    def samples(self):
+        '''
+        The frame sample points (phases in radians) passed to frame_at()
+        '''
+        return self.phase
+
+    @property
+    def shape(self):
+        '''
+        Shape of a single frame.
+        '''
+        return self.Ar.shape
+
+    def frame_at(self, phi):
+        '''
+        Returns the scaled frame at an arbitrary phase phi in radians,
+        not only at the sampled self.phase values.
+        '''
+        return self.scalefunc(self.Ar*np.cos(phi) + self.Ai*np.sin(phi))
+
+    def __len__(self):
+        return len(self.phase)
+
+    def __getitem__(self, fnum):
+        return _indexed_frames(self, fnum)
+
+    def __iter__(self):
+        for phi in self.phase:
+            yield self.frame_at(phi)
+
+    def limits(self):
+        '''
+        Returns [min, max] over all frames, computed one frame
+        at a time.
+        '''
+        fmin = np.inf
+        fmax = -np.inf
+        for frame in self:
+            fmin = min(fmin, np.min(frame))
+            fmax = max(fmax, np.max(frame))
+        return [fmin, fmax]
+
+    def cache_token(self):
+        '''
+        Digest of the field basis and scalefunc, for frame_cache_keys(),
+        or None if scalefunc can't be hashed
+        '''
+        func = _func_token(self.scalefunc)
+        if func is None:
+            return None
+        return dkc.digest(_array_token(self.Ar), _array_token(self.Ai), func)
+
+    def materialize(self):
+        '''
+        Returns all frames stacked along a new last axis, shape
+        self.shape + (len(self),). This builds the full cube, so
+        only use it for small animations.
+        '''
+        return np.stack(list(self), axis=-1)
+
+
+# === Poynting vectors of E and H near fields ===
+
+_vector_components = {'x': 0, 'y': 1, 'z': 2}
+
+
+class PoyntingFrames(object):
+    '''
+    Lazy sequence of instantaneous Poynting vector frames for one period
+    of complex E and H fields, such as PyNEC ne and nh near-field results.
+
+    With the repo's exp(-1j*phase) time convention, the instantaneous
+    Poynting vector is
+
+      S(phase) = Re(E*exp(-1j*phase)) x Re(H*exp(-1j*phase))
+               = Savg + Sr*cos(2*phase) + Si*sin(2*phase)
+
+    where Savg = Re(E x conj(H))/2 is the time average and
+    Sr + 1j*Si = (E x H)/2 oscillates at twice the field frequency.
+    Only these three real (3, ...) arrays are stored, normalized by an
+    upper bound of |S| over all phases, and frames are computed
+    on demand like PhasorFrames.
+    '''
+    _shared_fields = ('Savg', 'Sr', 'Si')
+    sample_name = 'phase'
+    period = 2*np.pi
+
+    def __init__(self, E, H, phase, component='magnitude', scalefunc=None):
+        '''
+         E, H: complex field components stacked as (3, ...) arrays
+         of x, y and z components, any grid shape
+
+         phase: 1D array of frame phases in radians
+
+         component: 'magnitude', 'x', 'y' or 'z', the scalar shown
+         in each frame
+
+         scalefunc: optional, function to scale the normalized frames
+        '''
+        allowed_components = ['magnitude'] + list(_vector_components)
+        if component not in allowed_components:
+            emsg = (f'Invalid component {component}. '
+                    f'Supply one of {allowed_components}')
+            raise UserWarning(emsg)
+
+        E = np.asarray(E)
+        H = np.asarray(H)
+        if E.shape != H.shape or E.shape[0] != 3:
+            raise UserWarning('E and H must both be (3, ...) component arrays')
+
+        Savg = 0.5*np.cross(E, np.conj(H), axis=0).real
+        Sosc = 0.5*np.cross(E, H, axis=0)
+
+        # --- |Sr*cos + Si*sin| <= sqrt(|Sr|^2 + |Si|^2), so this bounds |S| ---
+        bound = (np.sqrt(np.sum(Savg**2, axis=0)) +
+                 np.sqrt(np.sum(np.abs(Sosc)**2, axis=0)))
+        self.norm = np.max(bound)
+        if self.norm == 0:
+            self.norm = 1.0
+        self.Savg = Savg/self.norm
+        self.Sr = Sosc.real/self.norm
+        self.Si = Sosc.imag/self.norm
+        self.phase = np.asarray(phase)
+        self.component = component
+        self.scalefunc = scalefunc if scalefunc else _unscaled
+
+    @property
+    def samples(self):
+        '''
+        The frame sample points (phases in radians) passed to frame_at()
+        '''
+        return self.phase
+
+    @property
+    def shape(self):
+        '''
+        Shape of a single frame.
+        '''
+        return self.Savg.shape[1:]
+
+    def vector_at(self, phi):
+        '''
+        Returns the normalized (3, ...) instantaneous Poynting vector
+        at phase phi in radians.
+        '''
+        return self.Savg + self.Sr*np.cos(2*phi) + self.Si*np.sin(2*phi)
+
+    def _scalar(self, S):
+        '''
+        The frame scalar of a (3, ...) vector array.
+        '''
+        if self.component == 'magnitude':
+            return np.sqrt(np.sum(S**2, axis=0))
+        return S[_vector_components[self.component]]
+
+    def frame_at(self, phi):
+        '''
+        Returns the scaled frame at an arbitrary phase phi in radians.
+        '''
+        return self.scalefunc(self._scalar(self.vector_at(phi)))
+
+    def time_average(self, normalized=True):
+        '''
+        Returns the (3, ...) time-averaged Poynting vector Re(E x conj(H))/2,
+        normalized like the frames, or in the units of E*H if
+        normalized is False.
+        '''
+        if normalized:
+            return self.Savg
+        return self.Savg*self.norm
+
+    def __len__(self):
+        return len(self.phase)
+
+    def __getitem__(self, fnum):
+        return _indexed_frames(self, fnum)
+
+    def __iter__(self):
+        for phi in self.phase:
+            yield self.frame_at(phi)
+
+    def limits(self):
+        '''
+        Returns [min, max] over all frames, computed one frame
+        at a time.
+        '''
+        return PhasorFrames.limits(self)
+
+    def cache_token(self):
+        '''
+        Digest of the Poynting basis, component and scalefunc,
+        for frame_cache_keys(), or None if scalefunc can't be hashed
+        '''
+        func = _func_token(self.scalefunc)
+        if func is None:
+            return None
+        return dkc.digest(_array_token(self.Savg), _array_token(self.Sr),
+                          _array_token(self.Si), self.component, func)
+
+    def materialize(self):
+        '''
+        Returns all frames stacked along a new last axis. This builds
+        the full cube, so only use it for small animations.
+        '''
+        return np.stack(list(self), axis=-1)
+
+
+# === Time-domain superposition of fields at several frequencies ===
+
+class TimeDomainFrames(object):
+    '''
+    Lazy sequence of real-time frames of a superposition of complex
+    amplitude fields at several frequencies, sampled at arbitrary times.
+
+    With amplitudes A_k at frequencies f_k, frame n is
+
+      scalefunc(sum_k Re(A_k*exp(-2j*pi*f_k*times[n]))/norm)
+
+    Blocks of frames are computed as two matrix products,
+    cos(2*pi*f*t).T @ Ar + sin(2*pi*f*t).T @ Ai, with the (nfreq, npoints)
+    basis matrices Ar and Ai and an (nfreq, nblock) phase factor matrix.
+    Blocks are sized to max_block_bytes, so memory stays bounded for
+    hundreds of frequencies and thousands of frames. norm is the largest
+    |frame| over all sampled times, found in one streaming pass.
+    '''
+    _shared_fields = ('Ar', 'Ai')
+    sample_name = 'time'
+    period = None
+
+    def __init__(self, fieldamps, freqs, times, scalefunc=None,
+                 max_block_bytes=2**26):
+        '''
+         fieldamps: complex amplitude fields stacked along the first
+         axis, shape (nfreq, ...), or a list of equal-shape arrays
+
+         freqs: 1D array of the nfreq frequencies
+
+         times: 1D array of frame times, in units reciprocal to freqs
+         (seconds for Hz, microseconds for MHz)
+
+         scalefunc: optional, function to scale the normalized frames
+
+         max_block_bytes: size bound of a block of frames
+        '''
+        A = np.asarray(fieldamps)
+        self.freqs = np.asarray(freqs, dtype=np.float64)
+        if A.shape[0] != len(self.freqs):
+            emsg = (f'Got {A.shape[0]} amplitude fields '
+                    f'for {len(self.freqs)} frequencies')
+            raise UserWarning(emsg)
+
+        self._shape = A.shape[1:]
+        self.Ar = np.ascontiguousarray(A.real.reshape(len(self.freqs), -1),
+                                       dtype=np.float64)
+        self.Ai = np.ascontiguousarray(A.imag.reshape(len(self.freqs), -1),
+                                       dtype=np.float64)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.max_block_bytes = max_block_bytes
+        self.scalefunc = _unscaled
+
+        # --- streaming max |frame| pass over the unscaled frames ---
+        self.norm = 1.0
+        fmax = 0.0
+        for start, block in self.blocks():
+            fmax = max(fmax, np.max(np.abs(block)))
+        self.norm = fmax if fmax > 0 else 1.0
+        self.Ar /= self.norm
+        self.Ai /= self.norm
+        self.scalefunc = scalefunc if scalefunc else _unscaled
+
+    @property
+    def samples(self):
+        '''
+        The frame sample points (times) passed to frame_at()
+        '''
+        return self.times
+
+    @property
+    def shape(self):
+        '''
+        Shape of a single frame.
+        '''
+        return self._shape
+
+    @property
+    def block_size(self):
+        '''
+        Number of frames per block for blocks().
+        '''
+        npoints = max(self.Ar.shape[1], 1)
+        return max(1, self.max_block_bytes//(8*npoints))
+
+    def frame_block(self, times):
+        '''
+        Returns the scaled frames at the 1D array times, stacked along
+        the first axis, shape (len(times),) + self.shape.
+        '''
+        wt = 2*np.pi*np.outer(self.freqs, times)
+        block = np.cos(wt).T @ self.Ar
+        block += np.sin(wt).T @ self.Ai
+        return self.scalefunc(block.reshape((len(wt[0]),) + self._shape))
+
+    def blocks(self):
+        '''
+        Yields (first frame number, block of frames) over all frames,
+        block_size frames at a time.
+        '''
+        for start in range(0, len(self.times), self.block_size):
+            yield start, self.frame_block(self.times[start:start + self.block_size])
+
+    def frame_at(self, t):
+        '''
+        Returns the scaled frame at an arbitrary time t.
+        '''
+        return self.frame_block(np.atleast_1d(t))[0]
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, fnum):
+        times = self.times[fnum]
+        if np.ndim(times) == 0:
+            return self.frame_at(times)
+        return np.moveaxis(self.frame_block(times), 0, -1)
+
+    def __iter__(self):
+        for start, block in self.blocks():
+            yield from block
+
+    def limits(self):
+        '''
+        Returns [min, max] over all frames, computed one block
+        at a time.
+        '''
+        fmin = np.inf
+        fmax = -np.inf
+        for start, block in self.blocks():
+            fmin = min(fmin, np.min(block))
+            fmax = max(fmax, np.max(block))
+        return [fmin, fmax]
+
+    def cache_token(self):
+        '''
+        Digest of the field basis, frequencies and scalefunc,
+        for frame_cache_keys(), or None if scalefunc can't be hashed
+        '''
+        func = _func_token(self.scalefunc)
+        if func is None:
+            return None
+        return dkc.digest(_array_token(self.Ar), _array_token(self.Ai),
+                          _array_token(self.freqs), func)
+
+    def materialize(self):
+        '''
+        Returns all frames stacked along a new last axis. This builds
+        the full cube, so only use it for small animations.
+        '''
+        return np.stack(list(self), axis=-1)
+
+
+# === Rendering frames and the frame cache ===
+
+def _one_period(frames):
+    '''
+    Frame numbers covering exactly one period of a periodic frame source,
+    leaving out a last frame that repeats the first (like phase = 2*pi
+    after phase = 0). Non-periodic sources get every frame.
+    '''
+    nframes = len(frames)
+    period = getattr(frames, 'period', None)
+    samples = frames.samples
+    if period and nframes > 1 and np.isclose(samples[-1] - samples[0], period):
+        return range(nframes - 1)
+    return range(nframes)
+
+
+def _render_items(frames, framelist, make_renderer, cache=None,
+                  cache_keys=None):
+    '''
+    Yields rendered images for save_anim(), or (key, payload) items for
+    a fwr.CachingWriter when a cache is given. Cached frames yield their
+    PNG bytes without rendering, and the renderer is only built once a
+    frame actually needs rendering.
+    '''
+    renderer = None
+    for n, fnum in enumerate(framelist):
+        if cache is not None and cache_keys[n] in cache:
+            data = cache.get(cache_keys[n])
+            if data is not None:
+                yield (cache_keys[n], data)
+                continue
+
+        if renderer is None:
+            renderer = make_renderer()
+        image = _render_frame(renderer, frames, fnum)
+        yield image if cache is None else (cache_keys[n], image)
+
+
+def _render_frame(renderer, frames, fnum):
+    '''
+    Renders frame fnum of frames. Renderers drawing a vector overlay
+    also get the frame's vectors from frames.vector_at().
+    '''
+    if getattr(renderer, 'overlay', None) is not None:
+        vectors = frames.vector_at(frames.samples[fnum])
+        return renderer.render(frames[fnum], vectors=vectors)
+    return renderer.render(frames[fnum])
+
+
+def frame_cache(directory, max_bytes=2**30):
+    '''
+    Returns a size-bounded LRU cache of rendered PNG frames in directory
+    for the save_anim() cache option.
+    '''
+    return dkc.DiskLRUCache(directory, max_bytes=max_bytes, suffix='.png')
+
+
+def frame_cache_keys(frames, framelist, X, Y, clims, render_class,
+                     render_opts):
+    '''
+    Returns content-addressed cache keys for the frames in framelist.
+
+    Each key hashes the frame source (field data and scalefunc, from
+    frames.cache_token()), the frame's sample value (phase), X and Y,
+    clims, the renderer class, and its options, with colormaps hashed by
+    their lookup table. Returns None if the frame source can't be hashed.
+    '''
+    token = frames.cache_token()
+    if token is None:
+        return None
+    parts = [token, _array_token(X), _array_token(Y),
+             np.asarray(clims, dtype=np.float64), render_class.__name__]
+    for name, value in sorted(render_opts.items()):
+        if name == 'cmap':
+            value = colormap_lut(value)
+        if isinstance(value, np.ndarray):
+            value = _array_token(value)
+        parts += [name, repr(value)]
+    token = dkc.digest(*parts)
+    samples = np.asarray(frames.samples, dtype=np.float64)
+    return [dkc.digest(token, samples[fnum]) for fnum in framelist]
+
+
+def _array_token(arr):
+    '''
+    Digest of an array's shape, dtype and contents.
+    '''
+    arr = np.ascontiguousarray(arr)
+    return dkc.digest(repr(arr.shape), arr.dtype.str, arr)
+
+
+def _func_token(func):
+    '''
+    Digest identifying what a function like scalefunc computes: its name,
+    bytecode, constants, and the values of its defaults, closure cells
+    and the globals it refers to, with arrays hashed by content (see
+    _value_token()). functools.partial objects hash their function,
+    args and keywords, and ufuncs and builtins their repr.
+
+    Returns None for opaque callables (like instances with __call__),
+    whose results can't be keyed, so frames using them aren't cached.
+    '''
+    return _value_token(func)
+
+
+def _value_token(value, depth=0):
+    '''
+    Digest or repr string identifying value for _func_token(), or None
+    if it can't be identified by content. Arrays are hashed with
+    _array_token(), since numpy shortens the repr of large arrays.
+    '''
+    if depth > 8:
+        return None
+    if isinstance(value, np.ndarray):
+        return _array_token(value)
+    if isinstance(value, (int, float, complex, str, bytes, bool, type(None),
+                          np.generic, np.ufunc, types.BuiltinFunctionType,
+                          types.ModuleType)):
+        return repr(value)
+    if isinstance(value, (tuple, list)):
+        parts = [_value_token(item, depth + 1) for item in value]
+        return None if None in parts else dkc.digest(type(value).__name__, *parts)
+    if isinstance(value, dict):
+        parts = [_value_token(item, depth + 1) for item in sorted(value.items())]
+        return None if None in parts else dkc.digest('dict', *parts)
+    if isinstance(value, functools.partial):
+        return _value_token(('partial', value.func, value.args,
+                             value.keywords), depth + 1)
+    code = getattr(value, '__code__', None)
+    if not isinstance(value, types.FunctionType) or code is None:
+        return None
+
+    parts = [value.__module__ or '', value.__qualname__, _code_token(code),
+             _value_token(value.__defaults__, depth + 1),
+             _value_token(value.__kwdefaults__, depth + 1)]
+    for cell in value.__closure__ or ():
+        parts.append(_value_token(cell.cell_contents, depth + 1))
+    for name in code.co_names:
+        if name in value.__globals__:
+            glob = value.__globals__[name]
+            token = _value_token(glob, depth + 1)
+            # --- global modules and functions are code, not data ---
+            if token is None and callable(glob):
+                token = repr(glob)
+            parts.append(f'{name}={token}')
+    if None in parts:
+        return None
+    return dkc.digest(*parts)
+
+
+def _code_token(code):
+    '''
+    Digest of a code object's bytecode and constants, recursing into
+    nested code objects whose reprs contain memory addresses.
+    '''
+    consts = [_code_token(c) if hasattr(c, 'co_code') else repr(c)
+              for c in code.co_consts]
+    return dkc.digest(code.co_code, repr(code.co_names), *consts)
+
+
+def colormap_lut(cmap, ncolors=256):
+    '''
+    Returns an (ncolors, 4) uint8 RGBA lookup table for cmap, which can be
+
+     a colorcet palette name (no matplotlib needed),
+     a matplotlib colormap name or Colormap object,
+     or an (N, 3) or (N, 4) array of colors, floats in [0, 1] or uint8,
+     resampled to ncolors entries.
+    '''
+    if isinstance(cmap, str):
+        cmap = _named_colormap(cmap)
+
+    if callable(cmap):
+        colors = cmap(np.linspace(0, 1, ncolors))
+    else:
+        colors = np.asarray(cmap)
+        pick = np.round(np.linspace(0, len(colors)-1, ncolors)).astype(int)
+        colors = colors[pick]
+
+    if colors.dtype != np.uint8:
+        colors = np.round(np.clip(colors, 0, 1)*255).astype(np.uint8)
+    lut = np.full((ncolors, 4), 255, dtype=np.uint8)
+    lut[:, :colors.shape[1]] = colors
+    return lut
+
+
+def _named_colormap(name):
+    '''
+    uint8 (N, 3) colors of a colorcet palette name, from colorcet's
+    color lists, or the matplotlib Colormap of any other name. Only the
+    latter imports matplotlib.
+    '''
+    import colorcet as cc
+    if name in cc.palette:
+        return np.array([[int(hexc[i:i+2], 16) for i in (1, 3, 5)]
+                         for hexc in cc.palette[name]], dtype=np.uint8)
+    import matplotlib as mpl
+    return mpl.colormaps[name]
+
+
+class LUTFrameRenderer(object):
+    '''
+    Renders scalar frames to RGBA image arrays without matplotlib.
+
+    Each frame is quantized against clims into indices of a precomputed
+    color lookup table in one vectorized NumPy pass and nearest-neighbor
+    resampled to the output size, matching what MplFrameRenderer draws
+    for the same width and dpi. Assumes X, Y come from np.meshgrid() of
+    evenly spaced axes.
+    '''
+
+    def __init__(self, X, Y, clims, lut=None, width=8.0, dpi=100):
+        '''
+         X, Y: Cartesian coordinates as from np.meshgrid()
+
+         clims: [min, max] color limits shared by all frames
+
+         lut: (N, 4) uint8 RGBA table from colormap_lut(),
+         defaults to colorcet 'bky'
+
+         width, dpi: image width in inches and dots per inch
+        '''
+        if lut is None:
+            lut = colormap_lut('bky')
+        self.lut = np.asarray(lut)
+        self.clims = clims
+        nlut = len(self.lut)
+        crange = clims[1] - clims[0]
+        self.scale = nlut/crange if crange else 0.0
+
+        # --- output size follows the matplotlib renderer's canvas size ---
+        Xsize = np.max(X)-np.min(X)
+        Ysize = np.max(Y)-np.min(Y)
+        height = Ysize/Xsize * width
+        npx, npy = int(width*dpi), int(height*dpi)
+
+        # --- nearest grid row/column for every output pixel ---
+        ny, nx = np.shape(X)
+        upx = (np.arange(npx) + 0.5)/npx
+        upy = (np.arange(npy) + 0.5)/npy
+        self.cols = np.round(upx*(nx-1)).astype(np.intp)
+        self.rows = np.round(upy*(ny-1)).astype(np.intp)
+
+        # --- image row 0 is the top, at max Y ---
+        X = np.asarray(X)
+        Y = np.asarray(Y)
+        if Y[-1, 0] > Y[0, 0]:
+            self.rows = self.rows[::-1]
+        if X[0, -1] < X[0, 0]:
+            self.cols = self.cols[::-1]
+
+    def quantize(self, frame):
+        '''
+        Returns the LUT indices for frame at grid resolution.
+        '''
+        q = (np.asarray(frame) - self.clims[0])*self.scale
+        np.clip(q, 0, len(self.lut)-1, out=q)
+        return q.astype(np.intp)
+
+    def render(self, frame, out=None):
+        '''
+        Returns frame as a uint8 (height, width, 4) RGBA array, written
+        into out if given.
+        '''
+        q = self.quantize(frame)[np.ix_(self.rows, self.cols)]
+        return np.take(self.lut, q, axis=0, out=out)
+
+
+class IndexedFrameRenderer(LUTFrameRenderer):
+    '''
+    LUTFrameRenderer that returns the uint8 (height, width) lookup table
+    indices of each frame instead of colors, for paletted output like
+    fwr.GIFWriter and fwr.APNGWriter with the table as the palette.
+    '''
+
+    def render(self, frame):
+        '''
+        Returns frame as a uint8 (height, width) array of LUT indices.
+        '''
+        return self.quantize(frame)[np.ix_(self.rows, self.cols)].astype(np.uint8)
+
+
+# === Parallel rendering: worker processes read the frame basis from shared memory ===
+
+_worker_state = {}
+
+
+def render_parallel(frames, X, Y, clims, frame_writer, framelist=None,
+                    processes=None, renderer=None, chunksize=None,
+                    cache=None, cache_keys=None, **render_opts):
+    '''
+    Renders frames on a multiprocessing pool and hands them to frame_writer.
+
+    The frame basis arrays (frames._shared_fields) and X, Y are copied once
+    into a multiprocessing.shared_memory block that every worker attaches
+    to, so tasks only carry frame numbers. Each worker builds its own
+    renderer once.
+
+    A fwr.PNGSequenceWriter is written to directly from the workers, since
+    every frame is its own file. Any other writer receives the images back
+    in the parent, in order, through fwr.stream_frames(). Frame k of
+    framelist is always written as output index k, so file names are
+    deterministic (img00000.png, img00001.png, ...).
+
+     frames: lazy frame sequence such as PhasorFrames
+
+     X, Y, clims: passed to the renderer
+
+     frame_writer: writer with .write(index, image)
+
+     framelist: optional frame numbers, defaults to all frames
+
+     processes: number of worker processes, defaults to os.cpu_count()
+
+     renderer: renderer class taking (X, Y, clims, **render_opts) with
+     a .render(frame) method, defaults to MplFrameRenderer
+
+     cache, cache_keys: optional frame cache and per-frame keys from
+     frame_cache_keys(), with frame_writer a fwr.CachingWriter. Only
+     frames missing from the cache are sent to the workers.
+
+    Returns the number of frames written.
+    '''
+    if framelist is None:
+        framelist = range(len(frames))
+    if renderer is None:
+        from n3ox_utils.nfanim import MplFrameRenderer as renderer
+    if not processes:
+        processes = os.cpu_count()
+    framelist = list(framelist)
+    if chunksize is None:
+        chunksize = max(1, len(framelist)//(4*processes))
+
+    arrays = {name: getattr(frames, name) for name in frames._shared_fields}
+    arrays.update({'X': np.asarray(X), 'Y': np.asarray(Y)})
+    template = copy.copy(frames)
+    for name in frames._shared_fields:
+        setattr(template, name, None)
+
+    tasks = list(enumerate(framelist))
+    cached = [False]*len(framelist)
+    if cache is not None:
+        cached = [key in cache for key in cache_keys]
+        tasks = [task for task, hit in zip(tasks, cached) if not hit]
+    if not tasks:
+        return fwr.stream_frames(_merge_cached(iter(()), cached, cache_keys or [],
+                                               cache), frame_writer)
+
+    direct = isinstance(frame_writer, fwr.PNGSequenceWriter)
+    shm, layout = _share_arrays(arrays)
+    try:
+        initargs = (shm.name, layout, template, renderer, clims,
+                    render_opts, frame_writer if direct else None)
+        with mp.Pool(processes, initializer=_worker_init,
+                     initargs=initargs) as pool:
+            results = pool.imap(_worker_render, tasks, chunksize=chunksize)
+            if direct:
+                nsaved = sum(1 for index in results)
+            elif cache is not None:
+                items = _merge_cached(results, cached, cache_keys, cache)
+                nsaved = fwr.stream_frames(items, frame_writer)
+            else:
+                nsaved = fwr.stream_frames(results, frame_writer)
+    finally:
+        shm.close()
+        shm.unlink()
+    return nsaved
+
+
+def _merge_cached(results, cached, cache_keys, cache):
+    '''
+    Interleaves cached PNG bytes with freshly rendered images, in frame
+    order, as (key, payload) items for a fwr.CachingWriter.
+    '''
+    for hit, key in zip(cached, cache_keys):
+        yield (key, cache.get(key) if hit else next(results))
+
+
+def _share_arrays(arrays):
+    '''
+    Copies a dict of arrays into one new SharedMemory block.
+
+    Returns the block and a layout dict of
+    name: (offset, shape, dtype string) for _attach_arrays().
+    '''
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = (offset, arr.shape, arr.dtype.str)
+        offset += -(-arr.nbytes//8)*8  # keep every array 8-byte aligned
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, view in _attach_arrays(shm, layout).items():
+        view[...] = arrays[name]
+    return shm, layout
+
+
+def _attach_arrays(shm, layout):
+    '''
+    Returns a dict of NumPy views into the SharedMemory block shm.
+    '''
+    return {name: np.ndarray(shape, dtype=np.dtype(dtstr),
+                             buffer=shm.buf, offset=offset)
+            for name, (offset, shape, dtstr) in layout.items()}
+
+
+def _worker_init(shm_name, layout, template, renderer, clims,
+                 render_opts, frame_writer):
+    '''
+    Pool initializer: attaches the shared arrays and builds this worker's
+    frame source and renderer.
+    '''
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = _attach_arrays(shm, layout)
+    for name in template._shared_fields:
+        setattr(template, name, arrays[name])
+    _worker_state.update({'shm': shm,
+                          'frames': template,
+                          'renderer': renderer(arrays['X'], arrays['Y'],
+                                               clims, **render_opts),
+                          'writer': frame_writer})
+
+
+def _worker_render(task):
+    '''
+    Renders one (output index, frame number) task. Writes the image
+    directly if this worker has a writer, otherwise returns it.
+    '''
+    index, fnum = task
+    image = _render_frame(_worker_state['renderer'], _worker_state['frames'],
+                          fnum)
+    if _worker_state['writer'] is None:
+        return image
+    _worker_state['writer'].write(index, image)
+    return index
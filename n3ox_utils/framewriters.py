@@ -0,0 +1,600 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Daniel S. Zimmerman, N3OX
+
+'''
+Streaming image and video writers for animation frames.
+
+Frames are uint8 image arrays of shape (height, width, 3) or
+(height, width, 4). Writers take one frame at a time with
+writer.write(index, image) and are closed with writer.close(), or
+used as context managers, so a whole animation never has to sit
+in memory at once.
+
+This module only depends on NumPy and the standard library.
+'''
+import io
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import zlib
+import numpy as np
+
+
+def write_png(fobj, image, compresslevel=6):
+    '''
+    Writes a uint8 RGB (h, w, 3) or RGBA (h, w, 4) image array
+    to the binary file object fobj as a PNG. A 2D (h, w) array,
+    like palette indices, is written as 8-bit grayscale.
+
+    Pure Python/zlib, no filtering, so it's fast and the zlib
+    compression step releases the GIL.
+    '''
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    height, width, nchan = image.shape
+    colortypes = {1: 0, 3: 2, 4: 6}
+    if nchan not in colortypes:
+        raise UserWarning(f'write_png() needs 1, 3 or 4 channels, not {nchan}')
+
+    ihdr = struct.pack('>IIBBBBB', width, height, 8,
+                       colortypes[nchan], 0, 0, 0)
+    fobj.write(b'\x89PNG\r\n\x1a\n')
+    _write_png_chunk(fobj, b'IHDR', ihdr)
+    _write_png_chunk(fobj, b'IDAT', _png_image_data(image, compresslevel))
+    _write_png_chunk(fobj, b'IEND', b'')
+
+
+def _png_image_data(image, compresslevel=6):
+    '''
+    Returns zlib-compressed, unfiltered PNG scanlines for an
+    (h, w, nchan) uint8 array.
+    '''
+    height, width, nchan = image.shape
+    # --- each scanline starts with a filter-type byte, 0 = no filter ---
+    raw = np.zeros((height, width*nchan + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, width*nchan)
+    return zlib.compress(raw.tobytes(), compresslevel)
+
+
+def encode_png(image, compresslevel=6):
+    '''
+    Returns image encoded as PNG bytes, see write_png().
+    '''
+    buf = io.BytesIO()
+    write_png(buf, image, compresslevel)
+    return buf.getvalue()
+
+
+def read_png(data):
+    '''
+    Decodes PNG bytes written by write_png() back to a uint8 image array.
+
+    Only handles 8-bit gray/RGB/RGBA images without scanline filtering,
+    which is what write_png() produces. Other PNGs raise
+    NotImplementedError. Grayscale images come back as 2D arrays.
+    '''
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise UserWarning('read_png() data is not a PNG')
+
+    pos = 8
+    idat = []
+    header = None
+    while pos < len(data):
+        length, chunktype = struct.unpack('>I4s', data[pos:pos+8])
+        chunk = data[pos+8:pos+8+length]
+        if chunktype == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunktype == b'IDAT':
+            idat.append(chunk)
+        elif chunktype == b'IEND':
+            break
+        pos += length + 12
+
+    width, height, depth, colortype, _, _, interlace = header
+    nchans = {0: 1, 2: 3, 6: 4}
+    if depth != 8 or colortype not in nchans or interlace:
+        emsg = (f'read_png() only reads 8-bit gray/RGB/RGBA PNGs '
+                f'(got depth {depth}, color type {colortype})')
+        raise NotImplementedError(emsg)
+
+    nchan = nchans[colortype]
+    raw = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8)
+    raw = raw.reshape(height, width*nchan + 1)
+    if np.any(raw[:, 0]):
+        raise NotImplementedError('read_png() only reads unfiltered PNGs')
+    if nchan == 1:
+        return raw[:, 1:]
+    return raw[:, 1:].reshape(height, width, nchan)
+
+
+def _write_png_chunk(fobj, chunktype, data):
+    '''
+    Writes one length/type/data/CRC PNG chunk.
+    '''
+    fobj.write(struct.pack('>I', len(data)))
+    fobj.write(chunktype)
+    fobj.write(data)
+    fobj.write(struct.pack('>I', zlib.crc32(chunktype + data) & 0xffffffff))
+
+
+class PNGSequenceWriter(object):
+    '''
+    Writes frames as numbered PNG files in a directory,
+    img00000.png, img00001.png, etc. by default.
+
+    Frames can be stitched together later with, for example,
+
+      ffmpeg -i img%05d.png -c:v libx264 -pix_fmt yuv420p out.mp4
+    '''
+
+    def __init__(self, directory, pattern='img{0:05d}.png', compresslevel=6):
+        '''
+         directory: output directory, created if needed
+
+         pattern: str.format() pattern taking the frame index
+
+         compresslevel: zlib compression level 0-9
+        '''
+        self.directory = directory
+        self.pattern = pattern
+        self.compresslevel = compresslevel
+        os.makedirs(self.directory, exist_ok=True)
+
+    def filename(self, index):
+        '''
+        Full path of the PNG for frame number index.
+        '''
+        return os.path.join(self.directory, self.pattern.format(index))
+
+    def write(self, index, image):
+        '''
+        Writes image to the numbered PNG file for index.
+        '''
+        with open(self.filename(index), 'wb') as pngf:
+            write_png(pngf, image, self.compresslevel)
+
+    def write_png_data(self, index, data):
+        '''
+        Writes already encoded PNG bytes to the numbered file for index.
+        '''
+        with open(self.filename(index), 'wb') as pngf:
+            pngf.write(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FFmpegWriter(object):
+    '''
+    Streams raw RGB frames to an ffmpeg subprocess over a pipe.
+
+    The subprocess is started when the first frame arrives,
+    since that fixes the frame size.
+    '''
+
+    def __init__(self, filename, fps=25, codec='libx264', pix_fmt='yuv420p',
+                 ffmpeg='ffmpeg', extra_args=None):
+        '''
+         filename: output video file, format from its extension
+
+         fps: frames per second
+
+         codec, pix_fmt: ffmpeg -c:v and -pix_fmt output options
+
+         ffmpeg: path to the ffmpeg executable
+
+         extra_args: optional list of additional ffmpeg output arguments
+        '''
+        self.filename = filename
+        self.fps = fps
+        self.codec = codec
+        self.pix_fmt = pix_fmt
+        self.ffmpeg = ffmpeg
+        self.extra_args = extra_args if extra_args else []
+        self.proc = None
+        self.frame_shape = None
+
+    @staticmethod
+    def available(ffmpeg='ffmpeg'):
+        '''
+        True if the ffmpeg executable can be found.
+        '''
+        return shutil.which(ffmpeg) is not None
+
+    def _start(self, frame_shape):
+        '''
+        Launches ffmpeg reading rgb24 frames of frame_shape from stdin.
+        '''
+        height, width = frame_shape[:2]
+        cmd = [self.ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', f'{width}x{height}', '-r', str(self.fps),
+               '-i', '-',
+               # --- yuv420p needs even dimensions ---
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+               '-c:v', self.codec, '-pix_fmt', self.pix_fmt]
+        cmd += list(self.extra_args) + [self.filename]
+        self.frame_shape = tuple(frame_shape[:2])
+        self.errlog = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                     stdout=subprocess.DEVNULL,
+                                     stderr=self.errlog)
+
+    def write(self, index, image):
+        '''
+        Sends one frame to ffmpeg. Frames must arrive in order and
+        all have the same size. Alpha channels are dropped.
+        '''
+        if self.proc is None:
+            self._start(image.shape)
+        if tuple(image.shape[:2]) != self.frame_shape:
+            emsg = (f'FFmpegWriter frame {index} has size {image.shape[:2]}, '
+                    f'expected {self.frame_shape}')
+            raise UserWarning(emsg)
+        rgb = np.ascontiguousarray(image[:, :, :3], dtype=np.uint8)
+        try:
+            self.proc.stdin.write(memoryview(rgb).cast('B'))
+        except BrokenPipeError:
+            self.close()
+
+    def close(self):
+        '''
+        Closes the pipe and waits for ffmpeg to finish encoding.
+        '''
+        if self.proc is None:
+            return
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        retcode = proc.wait()
+        self.errlog.seek(0)
+        errtext = self.errlog.read().decode('utf-8', 'replace')
+        self.errlog.close()
+        if retcode:
+            raise RuntimeError(f'ffmpeg exited with code {retcode}: {errtext}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type and self.proc is not None:
+            self.proc.kill()
+        self.close()
+
+
+# === Shared-palette animated GIF and APNG writers ===
+
+class _PaletteDeltaWriter(object):
+    '''
+    Common parts of GIFWriter and APNGWriter.
+
+    Frames are 2D uint8 arrays of palette indices, so no per-frame color
+    quantization is needed. After the first frame, only the bounding
+    rectangle of pixels that changed since the previous frame is stored,
+    with unchanged pixels inside it set to the transparent index so they
+    show the previous frame through.
+    '''
+
+    def __init__(self, filename, palette, fps=25, loop=0):
+        '''
+         filename: output file name
+
+         palette: (N, 3) or (N, 4) uint8 colors, N <= 255, from the fixed
+         colormap. Index N is reserved for transparency.
+
+         fps: frames per second
+
+         loop: number of times to play, 0 loops forever
+        '''
+        palette = np.asarray(palette, dtype=np.uint8)[:, :3]
+        if len(palette) > 255:
+            emsg = (f'{type(self).__name__} palette has {len(palette)} '
+                    f'colors, at most 255 fit with a transparent index')
+            raise UserWarning(emsg)
+        self.filename = filename
+        self.palette = palette
+        self.transparent = len(palette)
+        self.fps = fps
+        self.loop = loop
+        self.prev = None
+        self.nframes = 0
+        self.fobj = None
+
+    def _delta(self, frame):
+        '''
+        Returns (x0, y0, subimage) for frame relative to the previous one.
+        '''
+        frame = np.asarray(frame, dtype=np.uint8)
+        prev, self.prev = self.prev, frame
+        if prev is None:
+            return 0, 0, frame
+
+        changed = frame != prev
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:  # identical frame, store one transparent pixel
+            return 0, 0, np.full((1, 1), self.transparent, dtype=np.uint8)
+        cols = np.flatnonzero(changed.any(axis=0))
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        sub = frame[y0:y1, x0:x1].copy()
+        sub[~changed[y0:y1, x0:x1]] = self.transparent
+        return x0, y0, sub
+
+    def write(self, index, frame):
+        '''
+        Appends one frame of palette indices. Frames must arrive in
+        order and all have the same size.
+        '''
+        if self.fobj is None:
+            self.fobj = open(self.filename, 'wb')
+            self._write_header(np.shape(frame))
+        elif np.shape(frame) != self.prev.shape:
+            emsg = (f'{type(self).__name__} frame {index} has size '
+                    f'{np.shape(frame)}, expected {self.prev.shape}')
+            raise UserWarning(emsg)
+        x0, y0, sub = self._delta(frame)
+        self._write_frame(x0, y0, sub)
+        self.nframes += 1
+
+    def close(self):
+        if self.fobj is None:
+            return
+        self._write_trailer()
+        self.fobj.close()
+        self.fobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GIFWriter(_PaletteDeltaWriter):
+    '''
+    Streams frames of palette indices to an animated GIF with one global
+    color table, changed-rectangle frames and a NETSCAPE2.0 loop block.
+
+    GIF delays are in hundredths of a second, so fps is rounded to the
+    nearest delay. The LZW coder is pure Python. APNGWriter uses zlib and
+    encodes several times faster.
+    '''
+
+    def _write_header(self, shape):
+        height, width = shape
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(self.palette)] = self.palette
+        self.fobj.write(b'GIF89a')
+        # --- global color table flag, 8 bit color resolution, 256 entries ---
+        self.fobj.write(struct.pack('<HHBBB', width, height, 0xF7, 0, 0))
+        self.fobj.write(table.tobytes())
+        self.fobj.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01')
+        self.fobj.write(struct.pack('<HB', self.loop, 0))
+
+    def _write_frame(self, x0, y0, sub):
+        height, width = sub.shape
+        delay = max(1, int(round(100/self.fps)))
+        # --- graphic control: leave frame in place, transparency on ---
+        self.fobj.write(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, 0x05,
+                                    delay, self.transparent, 0))
+        self.fobj.write(struct.pack('<BHHHHB', 0x2C, x0, y0,
+                                    width, height, 0))
+        self.fobj.write(b'\x08')  # LZW minimum code size
+        data = _lzw_encode(sub.tobytes())
+        for start in range(0, len(data), 255):
+            block = data[start:start+255]
+            self.fobj.write(bytes([len(block)]))
+            self.fobj.write(block)
+        self.fobj.write(b'\x00')
+
+    def _write_trailer(self):
+        self.fobj.write(b'\x3b')
+
+
+def _lzw_encode(data, min_code_size=8):
+    '''
+    GIF variable-length LZW encoding of a byte string of palette indices.
+    '''
+    clear = 1 << min_code_size
+    end = clear + 1
+    out = bytearray()
+    bitbuf = 0
+    nbits = 0
+    code_size = min_code_size + 1
+    next_code = end + 1
+    table = {}
+
+    # --- codes are packed least significant bit first ---
+    bitbuf |= clear << nbits
+    nbits += code_size
+    prefix = data[0]
+    for byte in data[1:]:
+        key = (prefix << 8) | byte
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        bitbuf |= prefix << nbits
+        nbits += code_size
+        while nbits >= 8:
+            out.append(bitbuf & 0xff)
+            bitbuf >>= 8
+            nbits -= 8
+
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:  # table full, start over
+            bitbuf |= clear << nbits
+            nbits += code_size
+            table = {}
+            code_size = min_code_size + 1
+            next_code = end + 1
+        prefix = byte
+
+    for code in (prefix, end):
+        bitbuf |= code << nbits
+        nbits += code_size
+    while nbits > 0:
+        out.append(bitbuf & 0xff)
+        bitbuf >>= 8
+        nbits -= 8
+    return bytes(out)
+
+
+class APNGWriter(_PaletteDeltaWriter):
+    '''
+    Streams frames of palette indices to an animated PNG with a PLTE
+    palette, a tRNS transparent index and changed-rectangle frames
+    blended over the previous frame.
+
+    The frame count in the acTL chunk is patched in by close(), so the
+    output file must be seekable.
+    '''
+
+    def _write_header(self, shape):
+        height, width = shape
+        self.seq = 0
+        self.fobj.write(b'\x89PNG\r\n\x1a\n')
+        _write_png_chunk(self.fobj, b'IHDR',
+                         struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+        self.actl_pos = self.fobj.tell()
+        _write_png_chunk(self.fobj, b'acTL', struct.pack('>II', 0, self.loop))
+        plte = np.vstack([self.palette, np.zeros((1, 3), dtype=np.uint8)])
+        _write_png_chunk(self.fobj, b'PLTE', plte.tobytes())
+        trns = np.full(len(plte), 255, dtype=np.uint8)
+        trns[self.transparent] = 0
+        _write_png_chunk(self.fobj, b'tRNS', trns.tobytes())
+
+    def _write_frame(self, x0, y0, sub):
+        height, width = sub.shape
+        first = self.nframes == 0
+        # --- delay in ms, dispose none, blend source first then over ---
+        delay = max(1, int(round(1000/self.fps)))
+        fctl = struct.pack('>IIIIIHHBB', self.seq, width, height, x0, y0,
+                           delay, 1000, 0, 0 if first else 1)
+        _write_png_chunk(self.fobj, b'fcTL', fctl)
+        self.seq += 1
+        data = _png_image_data(sub[:, :, np.newaxis])
+        if first:
+            _write_png_chunk(self.fobj, b'IDAT', data)
+        else:
+            _write_png_chunk(self.fobj, b'fdAT',
+                             struct.pack('>I', self.seq) + data)
+            self.seq += 1
+
+    def _write_trailer(self):
+        _write_png_chunk(self.fobj, b'IEND', b'')
+        self.fobj.seek(self.actl_pos)
+        _write_png_chunk(self.fobj, b'acTL',
+                         struct.pack('>II', self.nframes, self.loop))
+
+
+class CachingWriter(object):
+    '''
+    Wraps a frame writer so every frame passes through a content-addressed
+    PNG cache, a diskcache.DiskLRUCache.
+
+    write(index, item) takes item = (key, payload), where payload is
+    either an image array, which is PNG-encoded and stored under key, or
+    PNG bytes already fetched from the cache. Writers with a
+    write_png_data() method receive the PNG bytes, others the image.
+
+    Eviction is deferred until close(), so entries found in the cache when
+    an export starts stay readable until it finishes.
+    '''
+
+    def __init__(self, writer, cache, compresslevel=6):
+        self.writer = writer
+        self.cache = cache
+        self.compresslevel = compresslevel
+
+    def write(self, index, item):
+        key, payload = item
+        if isinstance(payload, bytes):
+            data, image = payload, None
+        else:
+            data, image = encode_png(payload, self.compresslevel), payload
+        if key not in self.cache:
+            self.cache.put(key, data, evict=False)
+
+        if hasattr(self.writer, 'write_png_data'):
+            self.writer.write_png_data(index, data)
+        else:
+            self.writer.write(index, read_png(data) if image is None else image)
+
+    def close(self):
+        self.cache.evict()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.writer.__exit__(*exc_info)
+        self.cache.evict()
+
+
+_DONE = object()
+
+
+def stream_frames(images, writer, queue_depth=4):
+    '''
+    Writes an iterable of image arrays to writer, one at a time.
+
+    images are produced (rendered) in the calling thread and handed to
+    writer.write(index, image) in a background thread through a queue
+    holding at most queue_depth frames, so rendering and encoding
+    overlap and memory is bounded regardless of the number of frames.
+
+    Returns the number of frames written. Errors raised by the writer
+    are re-raised in the calling thread.
+    '''
+    frameq = queue.Queue(maxsize=queue_depth)
+    errors = []
+
+    def encode():
+        while True:
+            item = frameq.get()
+            if item is _DONE:
+                return
+            if errors:
+                continue  # keep draining so the producer never blocks
+            try:
+                writer.write(*item)
+            except BaseException as err:
+                errors.append(err)
+
+    encoder = threading.Thread(target=encode, daemon=True)
+    encoder.start()
+    nwritten = 0
+    try:
+        for index, image in enumerate(images):
+            if errors:
+                break
+            frameq.put((index, image))
+            nwritten += 1
+    finally:
+        frameq.put(_DONE)
+        encoder.join()
+
+    if errors:
+        raise errors[0]
+    return nwritten
@@ -0,0 +1,664 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Daniel S. Zimmerman, N3OX
+
+'''
+Near-field grids of NEC models for nfanim animations.
+
+A large NE/NH grid request is split into tiles, each its own NE/NH
+card, evaluated on a process pool by necsweep backends that have
+already solved the model. The tiles are assembled into complex
+(3, ...) E and H arrays shaped like np.meshgrid coordinate grids,
+ready for CartesianFieldAnimation or PoyntingFieldAnimation.
+'''
+import itertools
+import multiprocessing as mp
+import numpy as np
+import n3ox_utils.pynec_helpers as pnh
+import n3ox_utils.necsweep as nsw
+import n3ox_utils.diskcache as dkc
+
+_eta0 = 376.730313668
+
+# --- NE card fields and coordinate names for each coordinate system ---
+_grid_names = {'rectangular': (['nx', 'ny', 'nz'], ['x0', 'y0', 'z0'],
+                               ['delx', 'dely', 'delz'], ['x', 'y', 'z']),
+               'spherical': (['nr', 'nphi', 'ntheta'], ['r0', 'phi0', 'theta0'],
+                             ['delr', 'delphi', 'deltheta'], ['r', 'phi', 'theta'])}
+
+
+def nearfield_points(nearfield_args):
+    '''
+    (npoints, 3) Cartesian points of a pack_nearfield_card_args() card,
+    in NEC order: the first coordinate (x or r) fastest, then y or phi,
+    then z or theta. Spherical angles are in degrees.
+    '''
+    flag = int(nearfield_args[0])
+    counts = [int(n) for n in nearfield_args[1:4]]
+    axes = [start + step*np.arange(n) for n, start, step
+            in zip(counts, nearfield_args[4:7], nearfield_args[7:10])]
+    C, B, A = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')
+    A, B, C = A.ravel(), B.ravel(), C.ravel()
+    if flag == 0:
+        return np.column_stack([A, B, C])
+    phi, theta = np.deg2rad(B), np.deg2rad(C)
+    return np.column_stack([A*np.sin(theta)*np.cos(phi),
+                            A*np.sin(theta)*np.sin(phi), A*np.cos(theta)])
+
+
+# === Native near-field engine: fields of known segment currents ===
+
+def _dipole_kernels(points, centers, lengths, k, radii=None):
+    '''
+    Coupling matrices (3, npoints, nsources) from unit-current Hertzian
+    dipoles to E and H at points. With radii, distances are the thin-wire
+    reduced kernel's sqrt(r^2 + a^2), so points on a wire stay finite.
+
+    Per unit moment dl, with g = exp(-jkr)/(4 pi r) and u = 1/(jkr):
+      E = A (dl.rhat) rhat + B ((dl.rhat) rhat - dl)
+      A = 2 eta g (1 + u)/r,  B = j eta k g (1 + u + u^2)
+      H = j k g (1 + u) (dl x rhat)
+    The coefficients are expanded into real and imaginary parts, which
+    keeps the work on float arrays.
+    '''
+    # --- (npoints, nsources) planes of each offset component ---
+    d = [points[:, c, np.newaxis] - centers[np.newaxis, :, c] for c in range(3)]
+    r2 = d[0]*d[0] + d[1]*d[1] + d[2]*d[2]
+    if radii is not None:
+        r2 += radii[np.newaxis, :]**2
+    r = np.sqrt(r2)
+    kr = k*r
+    cs, sn = np.cos(kr), np.sin(kr)
+    inv_kr = 1/kr
+    g = 1/(4*np.pi*r)
+    cs_kr, sn_kr = cs*inv_kr, sn*inv_kr
+
+    # --- B, then (A + B)(dl.R)/r^2, and C/r for H = (C/r)(dl x R) ---
+    t = 1 - inv_kr*inv_kr
+    etakg = _eta0*k*g
+    B_re = etakg*(cs_kr + t*sn)
+    B_im = etakg*(t*cs - sn_kr)
+    two_eta_g_r = 2*_eta0*g/r
+    dl_R = (lengths[:, 0]*d[0] + lengths[:, 1]*d[1] + lengths[:, 2]*d[2])/r2
+    AB_re = (two_eta_g_r*(cs - sn_kr) + B_re)*dl_R
+    AB_im = (B_im - two_eta_g_r*(sn + cs_kr))*dl_R
+    kg_r = k*g/r
+    C_re = kg_r*(cs_kr + sn)
+    C_im = kg_r*(cs - sn_kr)
+
+    KE = np.empty((3,) + r.shape, dtype=complex)
+    KH = np.empty_like(KE)
+    for c in range(3):
+        l_c = lengths[:, c]
+        np.subtract(AB_re*d[c], B_re*l_c, out=KE[c].real)
+        np.subtract(AB_im*d[c], B_im*l_c, out=KE[c].imag)
+        cross = lengths[:, (c + 1) % 3]*d[(c + 2) % 3] - lengths[:, (c + 2) % 3]*d[(c + 1) % 3]
+        np.multiply(C_re, cross, out=KH[c].real)
+        np.multiply(C_im, cross, out=KH[c].imag)
+    return KE, KH
+
+
+def dipole_fields(points, centers, lengths, currents, k, radii=None,
+                  max_bytes=2**22):
+    '''
+    E and H, complex (3, npoints) arrays, at points from Hertzian dipoles
+    at centers with vector lengths (dl) and complex currents, in free
+    space at wavenumber k (NEC's exp(jwt) convention, volts and amperes
+    per meter). currents may be (nsources, m) for m current solutions at
+    once, giving (3, npoints, m) arrays.
+
+    Points are evaluated in chunks whose temporaries fit in about
+    max_bytes (small enough to stay in cache), and each chunk costs one
+    matrix product per component.
+    '''
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    currents = np.asarray(currents)
+    nsrc = len(centers)
+    # --- about 30 float (npoints, nsources) temporaries per chunk ---
+    chunk = max(1, int(max_bytes//(30*8*max(nsrc, 1))))
+    E = np.empty((3, len(points)) + currents.shape[1:], dtype=complex)
+    H = np.empty_like(E)
+    for first in range(0, len(points), chunk):
+        sl = slice(first, first + chunk)
+        KE, KH = _dipole_kernels(points[sl], centers, lengths, k, radii)
+        E[:, sl] = KE @ currents
+        H[:, sl] = KH @ currents
+    return E, H
+
+
+def _wire_interpolation(segments):
+    '''
+    Sub-segment current interpolation for the 'segment' kernel: for
+    positions t in (0, 1) along each segment, returns a function giving
+    the indices and weights of the two segment centers (on the same
+    wire) to interpolate linearly between. Past the first and last
+    centers of a wire the line through the two end centers is
+    extrapolated, and one-segment wires are held constant.
+    '''
+    wire = segments['wire']
+    nseg = len(wire)
+    first = np.r_[True, wire[1:] != wire[:-1]]
+    last = np.r_[wire[1:] != wire[:-1], True]
+    half = segments['length']/2
+
+    def weights(t):
+        j = np.arange(nseg)[:, np.newaxis]*np.ones_like(t, dtype=int)
+        before = t < 0.5
+        edge = np.where(before, first[:, np.newaxis], last[:, np.newaxis])
+        # --- at a wire end, use the neighbor on the other side instead ---
+        other = np.where(before != edge, j - 1, j + 1)
+        single = first[:, np.newaxis] & last[:, np.newaxis]
+        other = np.where(single, j, np.clip(other, 0, nseg - 1))
+        # --- distance from this center, over the distance between centers ---
+        dist = np.abs(t - 0.5)*2*half[:, np.newaxis]
+        span = half[:, np.newaxis] + half[other]
+        w_other = np.where(single, 0.0, np.where(edge, -1.0, 1.0)*dist/span)
+        return j, other, 1 - w_other, w_other
+    return weights
+
+
+def segment_fields(points, segments, currents, k, kernel='segment', nsub=4,
+                   ground=False, max_bytes=2**22):
+    '''
+    E and H, complex (3, npoints) arrays, at points from solved NEC
+    segment currents, as a superposition of dipole fields.
+
+     segments: WireTable.segments() dict, or a WireTable, in NEC segment
+     order (the order of structure currents from PyNEC)
+
+     currents: complex segment currents, (nsegments,) or (nsegments, m)
+
+     k: free-space wavenumber 2*pi/wavelength in 1/m
+
+     kernel: 'hertzian' puts one dipole at each segment center. 'segment'
+     integrates along each segment with nsub Gauss-Legendre dipoles,
+     currents interpolated linearly between segment centers along the
+     wire, and the thin-wire reduced distance sqrt(r^2 + a^2).
+
+     ground: True adds the image in a perfect ground plane at z = 0, like
+     GE 1 with pack_gn_card_args(ground_type='perfect'). Points below
+     ground aren't meaningful then.
+
+    Accuracy: against the exact fields of a sinusoidal current (a thin
+    half-wave dipole in 21 segments), the 'segment' kernel is within
+    0.5% from one segment length away from the wire, and the 'hertzian'
+    kernel within 1% beyond two segment lengths. With PyNEC currents,
+    expect NEC NE/NH output to agree at the same level away from wires;
+    within a segment length, NEC's own current expansion and the reduced
+    kernel differ by up to tens of percent.
+    '''
+    if not isinstance(segments, dict):
+        segments = segments.segments()
+    currents = np.asarray(currents)
+    start, end = segments['start'], segments['end']
+    dl = end - start
+    if kernel == 'hertzian':
+        centers = (start + end)/2
+        lengths = dl
+        radii = None
+        sub_currents = currents
+    elif kernel == 'segment':
+        nodes, gweights = np.polynomial.legendre.leggauss(nsub)
+        t = np.broadcast_to((nodes + 1)/2, (len(start), nsub))
+        centers = (start[:, np.newaxis, :] + t[..., np.newaxis]*dl[:, np.newaxis, :]).reshape(-1, 3)
+        lengths = (gweights[np.newaxis, :, np.newaxis]/2*dl[:, np.newaxis, :]).reshape(-1, 3)
+        radii = np.repeat(segments['radius'], nsub)
+        j, other, w_j, w_other = _wire_interpolation(segments)(t)
+        shape = (-1,) + currents.shape[1:]
+        w_j = w_j.reshape(-1, *([1]*(currents.ndim - 1)))
+        w_other = w_other.reshape(-1, *([1]*(currents.ndim - 1)))
+        sub_currents = (w_j*currents[j.ravel()] + w_other*currents[other.ravel()]).reshape(shape)
+    else:
+        raise UserWarning(f"kernel must be 'hertzian' or 'segment', not {kernel}")
+
+    if ground:
+        # --- image: mirrored positions, horizontal currents reversed ---
+        mirror = np.array([1.0, 1.0, -1.0])
+        centers = np.concatenate([centers, centers*mirror])
+        lengths = np.concatenate([lengths, -lengths*mirror])
+        radii = np.concatenate([radii, radii]) if radii is not None else None
+        sub_currents = np.concatenate([sub_currents, sub_currents])
+    return dipole_fields(points, centers, lengths, sub_currents, k, radii=radii,
+                         max_bytes=max_bytes)
+
+
+# === Tiled near-field grids on a process pool ===
+
+def nearfield_tiles(tile_points=40000, **nearfield_kwargs):
+    '''
+    Splits a pack_nearfield_card_args() grid into tiles of at most
+    tile_points points by halving the largest tile dimension.
+
+    Returns a list of (slices, tile_kwargs) with slices indexing the
+    tile in an (n3, n2, n1) array of the whole grid (first coordinate
+    last, like the NEC point order) and tile_kwargs the keyword
+    arguments of the tile's own NE/NH card.
+    '''
+    counts_names, start_names, step_names, _ = _grid_names[nearfield_kwargs['coord_system']]
+    counts = [int(nearfield_kwargs[name]) for name in counts_names]
+    size = list(counts)
+    while np.prod(size) > tile_points and max(size) > 1:
+        biggest = int(np.argmax(size))
+        size[biggest] = -(-size[biggest]//2)
+
+    tiles = []
+    offsets = [range(0, n, s) for n, s in zip(counts, size)]
+    for origin in itertools.product(*offsets):
+        tile = dict(nearfield_kwargs)
+        ranges = []
+        for axis, first in enumerate(origin):
+            n = min(size[axis], counts[axis] - first)
+            tile[counts_names[axis]] = n
+            tile[start_names[axis]] = (nearfield_kwargs[start_names[axis]] +
+                                       first*nearfield_kwargs[step_names[axis]])
+            ranges.append(slice(first, first + n))
+        tiles.append((tuple(ranges[::-1]), tile))
+    return tiles
+
+
+_nearfield_worker_state = {}
+
+
+def _nearfield_worker_init(backend, model, freq_mhz):
+    '''
+    Pool initializer: builds this worker's backend and solves the model
+    once, so every tile only costs its NE/NH card.
+    '''
+    solver = backend()
+    solver.load(model)
+    solver.solve(freq_mhz)
+    _nearfield_worker_state['backend'] = solver
+
+
+def _nearfield_task(task):
+    '''
+    Evaluates one (tile number, field, tile kwargs) task on this worker.
+    '''
+    tnum, field, tile = task
+    args = pnh.pack_nearfield_card_args(**tile)
+    return tnum, field, _nearfield_worker_state['backend'].near_field(field, args)
+
+
+def _perfect_ground(model):
+    '''
+    True for a model over perfect ground (GE 1 and a perfect or no GN
+    card), raises UserWarning for real grounds the native engine can't do.
+    '''
+    if not model.get('gpflag', 0):
+        return False
+    gn = nsw._packed(model.get('gn'), pnh.pack_gn_card_args)
+    if gn and gn[0][0] != 1:
+        raise UserWarning("engine='native' only supports free space and perfect ground")
+    return True
+
+
+def native_evaluator(model, freq_mhz, backend=nsw.PyNECBackend,
+                     kernel='segment', max_bytes=2**22):
+    '''
+    Solves model once with backend and returns (evaluate, segments):
+    evaluate(points) gives complex (3, npoints) E and H arrays at
+    (npoints, 3) points from segment_fields(), including the perfect
+    ground image when the model has one.
+    '''
+    solver = backend()
+    solver.load(model)
+    currents = solver.solve(freq_mhz)['currents']
+    k = 2*np.pi*freq_mhz*1e6/nsw._c_mps
+    segments = nsw.model_wires(model).segments()
+    ground = _perfect_ground(model)
+
+    def evaluate(points):
+        return segment_fields(points, segments, currents, k, kernel=kernel,
+                              ground=ground, max_bytes=max_bytes)
+    return evaluate, segments
+
+
+def native_near_field(model, freq_mhz, points, backend=nsw.PyNECBackend,
+                      kernel='segment', max_bytes=2**22):
+    '''
+    Solves model once with backend and evaluates E and H at (npoints, 3)
+    points with segment_fields(), including the perfect ground image when
+    the model has one. Returns complex (3, npoints) E and H arrays.
+    '''
+    evaluate, segments = native_evaluator(model, freq_mhz, backend, kernel, max_bytes)
+    return evaluate(points)
+
+
+def near_field_grid(model, freq_mhz, fields='EH', backend=nsw.PyNECBackend,
+                    processes=None, tile_points=40000, cache=None,
+                    engine='nec', kernel='segment', **nearfield_kwargs):
+    '''
+    Evaluates the near field of model at freq_mhz on the grid of one
+    pack_nearfield_card_args() request, split into NE/NH tiles by
+    nearfield_tiles().
+
+    With processes, each worker process solves the model once and then
+    evaluates tiles, so big grids scale with the number of cores.
+
+    With engine='native', the model is solved once and the whole grid is
+    evaluated from the segment currents by native_near_field() with the
+    given kernel, without NE/NH cards or a pool.
+
+     model: necsweep model dict (wires plus card dicts)
+
+     fields: 'E', 'H' or 'EH'
+
+     backend: necsweep backend class
+
+     cache: optional directory or necsweep.result_cache(); a hit skips
+     the solver entirely
+
+    Returns a dict with the coordinate grids ('x', 'y', 'z' or 'r',
+    'phi', 'theta') and complex (3, ...) 'E' and/or 'H' arrays. Grid
+    axes with one point are dropped, so a ny=1 plane gives (nz, nx)
+    arrays like X, Z = np.meshgrid(x, z).
+    '''
+    pnh.pack_nearfield_card_args(**nearfield_kwargs)  # --- checks the request ---
+    counts_names, start_names, step_names, coord_names = _grid_names[
+        nearfield_kwargs['coord_system']]
+    counts = [int(nearfield_kwargs[name]) for name in counts_names]
+    grid_shape = tuple(counts[::-1])
+    squeezed = tuple(n for n in grid_shape if n > 1)
+
+    axes = [nearfield_kwargs[start] + nearfield_kwargs[step]*np.arange(n)
+            for n, start, step in zip(counts, start_names, step_names)]
+    grids = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')[::-1]
+    result = {name: grid.reshape(squeezed) for name, grid in zip(coord_names, grids)}
+
+    if cache is not None and not isinstance(cache, dkc.DiskLRUCache):
+        cache = nsw.result_cache(cache)
+    if cache is not None:
+        key = dkc.digest('nearfield', fields, engine, kernel if engine == 'native' else '',
+                         nsw.model_key(dict(model, ne=[nearfield_kwargs]), freq_mhz, backend))
+        data = cache.get(key)
+        if data is not None:
+            result.update(nsw.unpack_results(data))
+            return result
+
+    if engine == 'native':
+        points = nearfield_points(pnh.pack_nearfield_card_args(**nearfield_kwargs))
+        E, H = native_near_field(model, freq_mhz, points, backend=backend, kernel=kernel)
+        fieldarrays = {field: values.reshape((3,) + squeezed)
+                       for field, values in zip('EH', [E, H]) if field in fields}
+        if cache is not None:
+            cache.put(key, nsw.pack_results(**fieldarrays))
+        result.update(fieldarrays)
+        return result
+
+    tiles = nearfield_tiles(tile_points, **nearfield_kwargs)
+    out = {field: np.empty((3,) + grid_shape, dtype=complex) for field in fields}
+    tasks = [(tnum, field, tile) for tnum, (slices, tile) in enumerate(tiles)
+             for field in fields]
+
+    def store(tnum, field, values):
+        slices = tiles[tnum][0]
+        tile_shape = tuple(sl.stop - sl.start for sl in slices)
+        out[field][(slice(None),) + slices] = values.reshape((3,) + tile_shape)
+
+    if processes and processes > 1:
+        with mp.Pool(processes, initializer=_nearfield_worker_init,
+                     initargs=(backend, model, freq_mhz)) as pool:
+            for result_tile in pool.imap_unordered(_nearfield_task, tasks):
+                store(*result_tile)
+    else:
+        _nearfield_worker_init(backend, model, freq_mhz)
+        for task in tasks:
+            store(*_nearfield_task(task))
+        _nearfield_worker_state.clear()
+
+    fieldarrays = {field: values.reshape((3,) + squeezed) for field, values in out.items()}
+    if cache is not None:
+        cache.put(key, nsw.pack_results(**fieldarrays))
+    result.update(fieldarrays)
+    return result
+
+
+# === Adaptive quadtree sampling of near-field planes ===
+
+def wire_distances(points, starts, ends, max_bytes=2**22):
+    '''
+    Distance from each of (npoints, 3) points to the nearest of the
+    segments from starts to ends, (nsegments, 3) arrays, in chunks.
+    '''
+    D = ends - starts
+    DD = np.maximum(np.einsum('sc,sc->s', D, D), 1e-300)
+    out = np.empty(len(points))
+    chunk = max(1, int(max_bytes//(8*8*max(len(D), 1))))
+    for first in range(0, len(points), chunk):
+        P = points[first:first + chunk, np.newaxis, :] - starts[np.newaxis]
+        t = np.clip(np.einsum('psc,sc->ps', P, D)/DD, 0.0, 1.0)
+        closest = P - t[..., np.newaxis]*D
+        out[first:first + chunk] = np.sqrt(np.min(np.einsum('psc,psc->ps', closest, closest),
+                                                  axis=1))
+    return out
+
+
+class QuadtreeSampler(object):
+    '''
+    Adaptive samples of vector fields on a plane, refined on a quadtree.
+
+    The plane is a lattice of nodes origin + a*du*u_axis + b*dv*v_axis
+    for integers a, b. Coarse cells span 2**levels lattice steps, and
+    each level halves them, so the finest cells are single steps.
+    A cell is split when the fields at its center differ from the
+    bilinear prediction from its corners by more than tol, relative to
+    the largest corner magnitude plus floor times the largest coarse
+    grid magnitude, or when it lies within wire_factor cell diagonals
+    of a wire segment. Each level evaluates all its new nodes in one
+    call of evaluate.
+
+    resample() bilinearly interpolates the leaf cells back onto the
+    lattice. Cells next to finer neighbors aren't forced to match them
+    along shared edges, so fields can jump by up to about tol there.
+    '''
+
+    def __init__(self, evaluate, origin, u_axis, v_axis, du, dv, nu, nv,
+                 levels=4, tol=0.01, floor=1e-3, segments=None, wire_factor=1.0):
+        '''
+         evaluate: function of (npoints, 3) points returning a tuple of
+         complex (3, npoints) field arrays, like native_evaluator()
+
+         origin, u_axis, v_axis: plane origin and unit direction vectors
+
+         du, dv, nu, nv: lattice steps and the number of lattice nodes
+         to cover along u and v (the output grid)
+
+         levels: refinement levels below the coarse cells
+
+         tol, floor: relative interpolation error tolerance and the
+         magnitude floor, see above
+
+         segments: optional WireTable.segments() dict guiding refinement
+         near wires, with wire_factor
+        '''
+        self.evaluate = evaluate
+        self.origin = np.asarray(origin, dtype=float)
+        self.u_axis = np.asarray(u_axis, dtype=float)
+        self.v_axis = np.asarray(v_axis, dtype=float)
+        self.du, self.dv = du, dv
+        self.nu, self.nv = nu, nv
+        self.levels = levels
+        self.tol = tol
+        self.floor = floor
+        self.segments = segments
+        self.wire_factor = wire_factor
+
+        step = 2**levels
+        self.ncells = (max(1, -(-(nu - 1)//step)), max(1, -(-(nv - 1)//step)))
+        self.nb = self.ncells[1]*step + 1
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = None
+        self.leaves = []  # --- one array of leaf cell keys per level ---
+        self.refine()
+
+    @property
+    def nevaluated(self):
+        '''
+        Number of field evaluation points so far.
+        '''
+        return len(self.keys)
+
+    def points(self, a, b):
+        '''
+        (n, 3) points of lattice nodes a, b.
+        '''
+        return (self.origin + (a*self.du)[:, np.newaxis]*self.u_axis +
+                (b*self.dv)[:, np.newaxis]*self.v_axis)
+
+    def _add_nodes(self, a, b):
+        '''
+        Evaluates the lattice nodes a, b that are new, in one batch.
+        '''
+        keys = np.unique(a.astype(np.int64)*self.nb + b)
+        if len(self.keys):
+            keys = keys[~np.isin(keys, self.keys, assume_unique=True)]
+        if len(keys) == 0:
+            return
+        new = self.evaluate(self.points(keys//self.nb, keys % self.nb))
+        allkeys = np.concatenate([self.keys, keys])
+        order = np.argsort(allkeys, kind='stable')
+        self.keys = allkeys[order]
+        if self.values is None:
+            self.values = [np.asarray(v)[:, order] for v in new]
+        else:
+            self.values = [np.concatenate([old, np.asarray(v)], axis=1)[:, order]
+                           for old, v in zip(self.values, new)]
+
+    def lookup(self, a, b):
+        '''
+        Field values at evaluated lattice nodes a, b: a list of (3, ...) arrays.
+        '''
+        index = np.searchsorted(self.keys, a.astype(np.int64)*self.nb + b)
+        return [v[:, index] for v in self.values]
+
+    def _corner_values(self, a0, b0, size):
+        '''
+        Field values at the four corners of cells with lower corner a0, b0.
+        '''
+        return [self.lookup(a0 + da, b0 + db) for da, db in
+                [(0, 0), (size, 0), (0, size), (size, size)]]
+
+    def refine(self):
+        '''
+        Builds the quadtree from the coarse cells down.
+        '''
+        ci, cj = np.meshgrid(np.arange(self.ncells[0]), np.arange(self.ncells[1]),
+                             indexing='ij')
+        ci, cj = ci.ravel(), cj.ravel()
+        step = 2**self.levels
+        a = np.arange(self.ncells[0] + 1)*step
+        b = np.arange(self.ncells[1] + 1)*step
+        A, B = np.meshgrid(a, b, indexing='ij')
+        self._add_nodes(A.ravel(), B.ravel())
+        scales = [np.max(np.linalg.norm(v, axis=0)) for v in self.values]
+
+        for level in range(self.levels + 1):
+            size = 2**(self.levels - level)
+            a0, b0 = ci*size, cj*size
+            if level == self.levels or len(ci) == 0:
+                self.leaves.append(np.sort(ci.astype(np.int64)*self.nb + cj))
+                continue
+
+            # --- center check: bilinear error, relative to the corner magnitude ---
+            half = size//2
+            self._add_nodes(a0 + half, b0 + half)
+            corners = self._corner_values(a0, b0, size)
+            centers = self.lookup(a0 + half, b0 + half)
+            error = np.zeros(len(ci))
+            for f, scale in enumerate(scales):
+                predicted = sum(corner[f] for corner in corners)/4
+                magnitude = np.max([np.linalg.norm(corner[f], axis=0) for corner in corners],
+                                   axis=0)
+                error = np.maximum(error, np.linalg.norm(centers[f] - predicted, axis=0) /
+                                   (magnitude + self.floor*scale))
+            split = error > self.tol
+
+            if self.segments is not None:
+                cell_centers = self.points(a0 + size/2, b0 + size/2)
+                diag = size*np.hypot(self.du, self.dv)
+                near = wire_distances(cell_centers, self.segments['start'],
+                                      self.segments['end']) < self.wire_factor*diag
+                split |= near
+
+            self.leaves.append(np.sort(ci[~split].astype(np.int64)*self.nb + cj[~split]))
+            a0, b0 = a0[split], b0[split]
+            self._add_nodes(np.concatenate([a0 + half, a0 + half, a0, a0 + size]),
+                            np.concatenate([b0, b0 + size, b0 + half, b0 + half]))
+            ci = np.concatenate([2*ci[split] + di for di in [0, 1, 0, 1]])
+            cj = np.concatenate([2*cj[split] + dj for dj in [0, 0, 1, 1]])
+
+    def resample(self, a=None, b=None):
+        '''
+        Interpolates the fields onto lattice nodes a, b (1D index arrays,
+        default the nu by nv output grid). Returns a list of complex
+        (3, len(b), len(a)) arrays, like np.meshgrid(u, v) grids.
+        '''
+        a = np.arange(self.nu) if a is None else np.asarray(a)
+        b = np.arange(self.nv) if b is None else np.asarray(b)
+        A, B = np.meshgrid(a, b)
+        A, B = A.ravel(), B.ravel()
+        cell_a = np.zeros(len(A), dtype=np.int64)
+        cell_b = np.zeros(len(A), dtype=np.int64)
+        cell_size = np.zeros(len(A), dtype=np.int64)
+        found = np.zeros(len(A), dtype=bool)
+        for level, leaves in enumerate(self.leaves):
+            if not len(leaves):
+                continue
+            size = 2**(self.levels - level)
+            ci = np.minimum(A//size, self.ncells[0]*2**level - 1)
+            cj = np.minimum(B//size, self.ncells[1]*2**level - 1)
+            keys = ci*self.nb + cj
+            index = np.minimum(np.searchsorted(leaves, keys), len(leaves) - 1)
+            hit = ~found & (leaves[index] == keys)
+            cell_a[hit], cell_b[hit], cell_size[hit] = ci[hit]*size, cj[hit]*size, size
+            found |= hit
+
+        fa = (A - cell_a)/cell_size
+        fb = (B - cell_b)/cell_size
+        weights = [(1 - fa)*(1 - fb), fa*(1 - fb), (1 - fa)*fb, fa*fb]
+        out = [np.zeros((3, len(A)), dtype=complex) for v in self.values]
+        for w, corner in zip(weights, self._corner_values(cell_a, cell_b, cell_size)):
+            for f, values in enumerate(corner):
+                out[f] += w*values
+        return [field.reshape((3, len(b), len(a))) for field in out]
+
+
+def adaptive_near_field_grid(model, freq_mhz, backend=nsw.PyNECBackend,
+                             kernel='segment', levels=4, tol=0.01, floor=1e-3,
+                             wire_factor=1.0, **nearfield_kwargs):
+    '''
+    Like near_field_grid(..., engine='native') for a rectangular plane
+    (one of nx, ny, nz equal to 1), but evaluates the fields adaptively
+    with a QuadtreeSampler and resamples them onto the requested grid.
+
+    Smooth regions are covered by coarse cells of 2**levels grid steps,
+    refined near wires and wherever the fields aren't bilinear to within
+    tol. The returned dict also has 'nevaluated' (points evaluated) and
+    'sampler' (the QuadtreeSampler).
+    '''
+    pnh.pack_nearfield_card_args(**nearfield_kwargs)
+    counts_names, start_names, step_names, coord_names = _grid_names[
+        nearfield_kwargs['coord_system']]
+    counts = [int(nearfield_kwargs[name]) for name in counts_names]
+    plane_axes = [axis for axis, n in enumerate(counts) if n > 1]
+    if nearfield_kwargs['coord_system'] != 'rectangular' or len(plane_axes) != 2:
+        raise UserWarning('adaptive_near_field_grid() needs a rectangular plane '
+                          'with exactly one of nx, ny, nz equal to 1')
+
+    u, v = plane_axes
+    origin = np.array([nearfield_kwargs[name] for name in start_names], dtype=float)
+    evaluate, segments = native_evaluator(model, freq_mhz, backend, kernel)
+    sampler = QuadtreeSampler(evaluate, origin, np.eye(3)[u], np.eye(3)[v],
+                              nearfield_kwargs[step_names[u]], nearfield_kwargs[step_names[v]],
+                              counts[u], counts[v], levels=levels, tol=tol, floor=floor,
+                              segments=segments, wire_factor=wire_factor)
+    E, H = sampler.resample()
+
+    axes = [nearfield_kwargs[start] + nearfield_kwargs[step]*np.arange(n)
+            for n, start, step in zip(counts, start_names, step_names)]
+    grids = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')[::-1]
+    squeezed = (counts[v], counts[u])
+    result = {name: grid.reshape(squeezed) for name, grid in zip(coord_names, grids)}
+    result.update({'E': E, 'H': H, 'nevaluated': sampler.nevaluated,
+                   'sampler': sampler})
+    return result
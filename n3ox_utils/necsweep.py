@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Daniel S. Zimmerman, N3OX
+
+'''
+Frequency and parameter sweeps of NEC models on a process pool.
+
+A model is a dict like the ones pynec_helpers.read_NEC_deck() returns:
+'wires' (a WireTable or list of wire dicts), 'gpflag', and the keyword
+dicts (or packed argument lists) for the 'gn', 'ex', 'ld' and 'rp'
+cards. The frequency comes from the sweep.
+
+The solver sits behind the SweepBackend interface. PyNECBackend drives
+PyNEC, and ShortDipoleBackend is a closed-form stand-in that runs the
+whole pipeline without PyNEC installed.
+'''
+import io
+import copy
+import itertools
+import multiprocessing as mp
+import numpy as np
+import n3ox_utils.pynec_helpers as pnh
+import n3ox_utils.diskcache as dkc
+
+_c_mps = 299792458.0
+
+
+def _packed(cards, packer):
+    '''
+    List of packed argument lists from one or several keyword dicts or
+    packed lists, like write_NEC_deck() takes.
+    '''
+    return pnh._card_list(cards, packer)
+
+
+def model_wires(model):
+    '''
+    The model's wires as a WireTable.
+    '''
+    return pnh._as_wire_table(model['wires'])
+
+
+def pattern_shape(model):
+    '''
+    (n_theta, n_phi) of the model's first RP card, or (0, 0) without one.
+    '''
+    rp = _packed(model.get('rp'), pnh.pack_rp_card_args)
+    return (int(rp[0][1]), int(rp[0][2])) if rp else (0, 0)
+
+
+def pattern_angles(model):
+    '''
+    Theta and phi angles in degrees of the first RP card's pattern.
+    '''
+    rp = _packed(model.get('rp'), pnh.pack_rp_card_args)
+    if not rp:
+        return np.zeros(0), np.zeros(0)
+    rp = rp[0]
+    return (rp[7] + rp[9]*np.arange(int(rp[1])),
+            rp[8] + rp[10]*np.arange(int(rp[2])))
+
+
+# === Solver backends ===
+
+class SweepBackend(object):
+    '''
+    Interface for the solvers behind run_sweep().
+
+    Each worker process builds one backend and calls load(model) once per
+    model, then solve(freq_mhz) for every frequency of the sweep, so
+    backends can keep an expensive solver context between frequencies.
+    '''
+
+    def load(self, model):
+        '''
+        Sets up the geometry and every card of model except FR.
+        '''
+        raise NotImplementedError
+
+    def solve(self, freq_mhz):
+        '''
+        Solves the loaded model at freq_mhz. Returns a dict of
+
+         impedance: complex array, one input impedance per EX source
+
+         currents: complex array, one current per segment
+
+         gain: (n_theta, n_phi) gain array in dBi for the first RP card,
+         or None without one
+        '''
+        raise NotImplementedError
+
+    def near_field(self, field, nearfield_args):
+        '''
+        Evaluates the near field of the last solve() on the points of one
+        NE/NH card. field is 'E' or 'H', nearfield_args the output of
+        pnh.pack_nearfield_card_args(). Returns a complex (3, npoints)
+        array of x, y, z components, points in NEC order (first
+        coordinate fastest).
+        '''
+        raise NotImplementedError
+
+
+class PyNECBackend(SweepBackend):
+    '''
+    Solves models with PyNEC. Loading a model builds a new nec_context,
+    which is reused for all the frequencies of that model.
+    '''
+
+    def __init__(self):
+        import PyNEC
+        self.PyNEC = PyNEC
+        self.context = None
+
+    def load(self, model):
+        context = self.PyNEC.nec_context()
+        model_wires(model).to_pynec(context.get_geometry())
+        context.geometry_complete(model.get('gpflag', 0))
+        for args in _packed(model.get('gn'), pnh.pack_gn_card_args):
+            context.gn_card(*args)
+        for args in _packed(model.get('ld'), pnh.pack_ld_card_args):
+            context.ld_card(*args)
+        for args in _packed(model.get('ex'), pnh.pack_ex_card_args):
+            context.ex_card(*args)
+        rp = _packed(model.get('rp'), pnh.pack_rp_card_args)
+        self.rp_args = rp[0] if rp else None
+        self.context = context
+        self.nsolved = 0
+        self.nfields = 0
+
+    def solve(self, freq_mhz):
+        context = self.context
+        context.fr_card(0, 1, freq_mhz, 0)
+        if self.rp_args is not None:
+            context.rp_card(*self.rp_args)
+        else:
+            context.xq_card(0)
+        # --- every frequency adds a result set to the context ---
+        index = self.nsolved
+        self.nsolved += 1
+        results = {'impedance': np.atleast_1d(
+                       context.get_input_parameters(index).get_impedance()),
+                   'currents': np.asarray(
+                       context.get_structure_currents(index).get_current()),
+                   'gain': None}
+        if self.rp_args is not None:
+            gain = context.get_radiation_pattern(index).get_gain()
+            results['gain'] = np.reshape(gain, (self.rp_args[1], self.rp_args[2]))
+        return results
+
+    def near_field(self, field, nearfield_args):
+        card = self.context.ne_card if field == 'E' else self.context.nh_card
+        card(*nearfield_args)
+        # --- NE and NH cards add near field patterns in order ---
+        pattern = self.context.get_near_field_pattern(self.nfields)
+        self.nfields += 1
+        return np.array([pattern.get_field_x(), pattern.get_field_y(),
+                         pattern.get_field_z()])
+
+
+class ShortDipoleBackend(SweepBackend):
+    '''
+    Closed-form stand-in solver for tests and pipeline checks.
+
+    Every voltage source sees the wires sharing its tag as one short
+    center-fed dipole of length L and radius a:
+
+      R = 20 (kL)^2,  X = -120 (ln(L/2a) - 1)/tan(kL/2)
+
+    plus any series_RLC_lump or load_Z load on the source segment.
+    Currents are triangular on source wires and zero elsewhere, and the
+    pattern is a z-directed short dipole's 1.5 sin^2(theta). Near
+    fields sum the Hertzian dipole fields of the segment currents.
+    Ground and coupling between wires are ignored.
+    '''
+
+    def load(self, model):
+        table = model_wires(model)
+        self.nsegments = int(np.sum(table['segment_count']))
+        self.theta, self.phi = pattern_angles(model)
+
+        # --- segment positions along their wire, 0 to 1, in NEC order ---
+        seg = table.segments()
+        self.seg_start, self.seg_end = seg['start'], seg['end']
+        self.seg_wire = seg['wire']
+        self.seg_frac = (seg['index'] + 0.5)/table['segment_count'][seg['wire']]
+
+        loads = _packed(model.get('ld'), pnh.pack_ld_card_args)
+        self.sources = []
+        for args in _packed(model.get('ex'), pnh.pack_ex_card_args):
+            tag, segnum = args[1], args[2]
+            on_tag = table['tag_id'] == tag
+            length = np.sum(table.lengths[on_tag])
+            radius = table['rad'][on_tag][0]
+            rlc = [ld for ld in loads if ld[0] in [0, 4] and ld[1] in [0, tag]
+                   and ld[2] <= segnum <= max(ld[3], ld[2])]
+            self.sources.append({'voltage': args[4] + 1j*args[5],
+                                 'length': length, 'radius': radius,
+                                 'wires': np.flatnonzero(on_tag), 'loads': rlc})
+
+    def solve(self, freq_mhz):
+        k = 2*np.pi*freq_mhz*1e6/_c_mps
+        omega = 2*np.pi*freq_mhz*1e6
+        impedance = np.zeros(len(self.sources), dtype=complex)
+        currents = np.zeros(self.nsegments, dtype=complex)
+        for n, src in enumerate(self.sources):
+            kl = k*src['length']
+            Z = 20*kl**2 - 120j*(np.log(src['length']/(2*src['radius'])) - 1)/np.tan(kl/2)
+            for ld in src['loads']:
+                if ld[0] == 4:
+                    Z += ld[4] + 1j*ld[5]
+                else:
+                    Z += ld[4] + 1j*omega*ld[5] + (1/(1j*omega*ld[6]) if ld[6] else 0)
+            impedance[n] = Z
+            on_source = np.isin(self.seg_wire, src['wires'])
+            currents[on_source] += (src['voltage']/Z *
+                                    (1 - np.abs(2*self.seg_frac[on_source] - 1)))
+        gain = None
+        if len(self.theta):
+            sin2 = np.sin(np.deg2rad(self.theta))**2
+            with np.errstate(divide='ignore'):
+                gdb = np.where(sin2 > 1e-12, 10*np.log10(1.5*sin2), -999.99)
+            gain = np.repeat(gdb[:, np.newaxis], len(self.phi), axis=1)
+        self.k, self.currents = k, currents
+        return {'impedance': impedance, 'currents': currents, 'gain': gain}
+
+    def near_field(self, field, nearfield_args):
+        import n3ox_utils.nearfield as nfd
+        points = nfd.nearfield_points(nearfield_args)
+        E, H = nfd.dipole_fields(points, (self.seg_start + self.seg_end)/2,
+                                 self.seg_end - self.seg_start, self.currents, self.k)
+        return E if field == 'E' else H
+
+
+# === Canonical model hashing and the result cache ===
+
+def canonical_floats(values, digits=12):
+    '''
+    Exact int64 (mantissa, exponent) pairs for values rounded to digits
+    significant digits, so values that differ only by float round-off
+    (0.1 + 0.2 and 0.3) or sign of zero get the same bytes.
+    '''
+    x = np.asarray(values, dtype=np.float64).ravel()
+    nonzero = np.isfinite(x) & (x != 0)
+    exponent = np.zeros(x.shape, dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(np.abs(x[nonzero]))).astype(np.int64) - (digits - 1)
+    mantissa = np.zeros(x.shape, dtype=np.int64)
+    mantissa[nonzero] = np.round(x[nonzero]/10.0**exponent[nonzero]).astype(np.int64)
+    return np.stack([mantissa, exponent], axis=-1)
+
+
+def canonical_model(model):
+    '''
+    Canonical byte strings of a model: the wire columns (from a WireTable
+    or WireInput.return_wire_dicts() dicts alike) and the packed GE, GN,
+    EX, LD, NE, NH and RP card arguments, with floats normalized by
+    canonical_floats(). Card dicts and packed lists give the same bytes.
+    '''
+    table = model_wires(model)
+    parts = [canonical_floats(np.column_stack([table[name] for name in table.columns]))]
+    cards = [('ge', [[model.get('gpflag', 0)]]),
+             ('gn', _packed(model.get('gn'), pnh.pack_gn_card_args)),
+             ('ex', _packed(model.get('ex'), pnh.pack_ex_card_args)),
+             ('ld', _packed(model.get('ld'), pnh.pack_ld_card_args)),
+             ('ne', _packed(model.get('ne'), pnh.pack_nearfield_card_args)),
+             ('nh', _packed(model.get('nh'), pnh.pack_nearfield_card_args)),
+             ('rp', _packed(model.get('rp'), pnh.pack_rp_card_args))]
+    for name, args in cards:
+        parts.append(name)
+        parts.extend(canonical_floats(card) for card in args)
+    return parts
+
+
+def model_key(model, freq_mhz, backend=None, canonical=None):
+    '''
+    Hex digest key for the results of model at freq_mhz from backend
+    (a SweepBackend class). canonical may pass a precomputed
+    canonical_model(model).
+    '''
+    if canonical is None:
+        canonical = canonical_model(model)
+    name = f'{backend.__module__}.{backend.__qualname__}' if backend else ''
+    return dkc.digest('necsweep-1', name, canonical_floats([freq_mhz]), *canonical)
+
+
+def result_cache(directory, max_bytes=2**30):
+    '''
+    Returns a size-bounded LRU cache of solver results in directory,
+    one compressed .npz entry per model and frequency. The cache's
+    hits and misses attributes count lookups.
+    '''
+    return dkc.DiskLRUCache(directory, max_bytes=max_bytes, suffix='.npz')
+
+
+def pack_results(**arrays):
+    '''
+    Compressed .npz bytes of named arrays; None values are left out.
+    '''
+    npzbuf = io.BytesIO()
+    np.savez_compressed(npzbuf, **{name: arr for name, arr in arrays.items()
+                                   if arr is not None})
+    return npzbuf.getvalue()
+
+
+def unpack_results(data):
+    '''
+    Dict of arrays from pack_results() bytes.
+    '''
+    with np.load(io.BytesIO(data)) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+# === Sweep grids and the process pool ===
+
+def set_model_param(model, name, value):
+    '''
+    Sets a dotted parameter path in a model dict in place, like
+    'ld.1.C' (C of the second LD card dict), 'gn.epsilon' or
+    'wires.zw2.3' (end 2 height of the fourth wire).
+    '''
+    keys = name.split('.')
+    obj = model
+    for key in keys[:-1]:
+        obj = obj[int(key) if key.lstrip('-').isdigit() else key]
+    last = keys[-1]
+    obj[int(last) if last.lstrip('-').isdigit() else last] = value
+
+
+def sweep_models(model, params=None):
+    '''
+    Yields one model dict per point of the grid of params, in C order.
+
+     model: a model dict, or a function called as model(**point) that
+     returns one
+
+     params: dict of parameter name: 1D array of values. For a model dict
+     the names are set_model_param() paths.
+    '''
+    params = params or {}
+    names = list(params)
+    for values in itertools.product(*[params[name] for name in names]):
+        point = dict(zip(names, values))
+        if callable(model):
+            yield model(**point)
+            continue
+        new_model = copy.deepcopy({key: value for key, value in model.items()
+                                   if key != 'wires'})
+        new_model['wires'] = model_wires(model).copy()
+        for name, value in point.items():
+            set_model_param(new_model, name, value)
+        yield new_model
+
+
+_sweep_worker_state = {}
+
+
+def _sweep_worker_init(backend):
+    '''
+    Pool initializer: builds this worker's backend once.
+    '''
+    _sweep_worker_state['backend'] = backend()
+
+
+def _solve_model(backend, model, freqs_mhz):
+    '''
+    Loads model once and solves it at every frequency. Returns
+    impedance (nfreq, nsources), currents (nfreq, nsegments) and
+    gain (nfreq, n_theta, n_phi) arrays, gain None without an RP card.
+    '''
+    backend.load(model)
+    solved = [backend.solve(freq) for freq in freqs_mhz]
+    gain = (np.array([res['gain'] for res in solved])
+            if solved and solved[0]['gain'] is not None else None)
+    return (np.array([res['impedance'] for res in solved]),
+            np.array([res['currents'] for res in solved]), gain)
+
+
+def _sweep_task(task):
+    '''
+    Solves one (grid index, model, frequencies, frequency indices) task
+    on this worker.
+    '''
+    index, model, freqs_mhz, freq_index = task
+    return (index, freq_index) + _solve_model(_sweep_worker_state['backend'],
+                                              model, freqs_mhz)
+
+
+def run_sweep(model, freqs_mhz, params=None, backend=PyNECBackend,
+              processes=None, chunksize=1, cache=None):
+    '''
+    Solves model over a grid of parameters and frequencies.
+
+    Every grid point is one task: a worker loads the model into its
+    backend once and solves all the frequencies. Results are collected
+    into arrays allocated up front.
+
+     model, params: see sweep_models()
+
+     freqs_mhz: 1D array of frequencies in MHz
+
+     backend: SweepBackend class, built once per worker process
+
+     processes: number of worker processes, or None to solve in this
+     process
+
+     cache: optional directory or result_cache() of earlier results,
+     keyed by model_key(). Cached frequencies aren't solved again, and
+     grid points with every frequency cached skip the solver entirely.
+
+    Returns a dict of
+     freqs_mhz, params (name: values) and shape (the params grid shape),
+     impedance: complex (*shape, nfreq, nsources)
+     currents: complex (*shape, nfreq, max segments), NaN padded for
+     grid points with fewer segments
+     gain: (*shape, nfreq, n_theta, n_phi) in dBi, None without RP cards
+     theta, phi: pattern angles in degrees
+     cache_hits, cache_misses: result cache lookups in this sweep
+    '''
+    params = {name: np.atleast_1d(values) for name, values in (params or {}).items()}
+    freqs_mhz = np.atleast_1d(np.asarray(freqs_mhz, dtype=float))
+    shape = tuple(len(values) for values in params.values())
+    models = list(sweep_models(model, params))
+    if cache is not None and not isinstance(cache, dkc.DiskLRUCache):
+        cache = result_cache(cache)
+
+    nsources = max(len(_packed(m.get('ex'), pnh.pack_ex_card_args)) for m in models)
+    nsegments = max(int(np.sum(model_wires(m)['segment_count'])) for m in models)
+    npattern = pattern_shape(models[0])
+    theta, phi = pattern_angles(models[0])
+
+    npoints = len(models)
+    nfreq = len(freqs_mhz)
+    impedance = np.full((npoints, nfreq, nsources), np.nan, dtype=complex)
+    currents = np.full((npoints, nfreq, nsegments), np.nan, dtype=complex)
+    gain = (np.full((npoints, nfreq) + npattern, np.nan)
+            if npattern != (0, 0) else None)
+
+    def store(index, freq_index, Z, I, G):
+        impedance[index, freq_index, :Z.shape[1]] = Z
+        currents[index, freq_index, :I.shape[1]] = I
+        if gain is not None and G is not None:
+            gain[index, freq_index] = G
+
+    # --- fill in cached results, and make tasks of what's left ---
+    tasks = []
+    keys = {}
+    nhits = 0
+    for index, m in enumerate(models):
+        freq_index = np.arange(nfreq)
+        if cache is not None:
+            canonical = canonical_model(m)
+            keys[index] = [model_key(m, freq, backend, canonical) for freq in freqs_mhz]
+            missing = []
+            for fnum, key in enumerate(keys[index]):
+                data = cache.get(key)
+                if data is None:
+                    missing.append(fnum)
+                    continue
+                nhits += 1
+                res = unpack_results(data)
+                store(index, [fnum], res['impedance'][np.newaxis],
+                      res['currents'][np.newaxis],
+                      res['gain'][np.newaxis] if 'gain' in res else None)
+            freq_index = np.array(missing, dtype=int)
+        if len(freq_index):
+            tasks.append((index, m, freqs_mhz[freq_index], freq_index))
+
+    def collect(index, freq_index, Z, I, G):
+        store(index, freq_index, Z, I, G)
+        if cache is None:
+            return
+        for n, fnum in enumerate(freq_index):
+            cache.put(keys[index][fnum],
+                      pack_results(impedance=Z[n], currents=I[n],
+                                   gain=G[n] if G is not None else None))
+
+    if processes and processes > 1 and tasks:
+        with mp.Pool(processes, initializer=_sweep_worker_init,
+                     initargs=(backend,)) as pool:
+            for result in pool.imap_unordered(_sweep_task, tasks, chunksize=chunksize):
+                collect(*result)
+    elif tasks:
+        solver = backend()
+        for index, m, freqs, freq_index in tasks:
+            collect(index, freq_index, *_solve_model(solver, m, freqs))
+
+    return {'freqs_mhz': freqs_mhz, 'params': params, 'shape': shape,
+            'impedance': impedance.reshape(shape + impedance.shape[1:]),
+            'currents': currents.reshape(shape + currents.shape[1:]),
+            'gain': gain.reshape(shape + gain.shape[1:]) if gain is not None else None,
+            'theta': theta, 'phi': phi,
+            'cache_hits': nhits,
+            'cache_misses': nfreq*npoints - nhits if cache is not None else 0}
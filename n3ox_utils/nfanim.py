@@ -20,18 +20,35 @@
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER 
 # DEALINGS IN THE SOFTWARE.
 
+import os
+import time
+import asyncio
 import numpy as np
 #import PyNEC
 import json
+import matplotlib as mpl
 import matplotlib.pyplot as mplt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import n3ox_utils.plot_tools as pltools
+import n3ox_utils.framewriters as fwr
+import n3ox_utils.diskcache as dkc
 import colorcet as cc
+# --- frame sources and LUT rendering live in the matplotlib-free framerender ---
+from n3ox_utils.framerender import (PhasorFrames, PoyntingFrames, TimeDomainFrames,
+                                    LUTFrameRenderer, IndexedFrameRenderer,
+                                    colormap_lut, frame_cache, frame_cache_keys,
+                                    render_parallel, _unscaled, _vector_components,
+                                    _one_period, _render_items)
 
 
 class CartesianFieldAnimation(object):
     '''
     Class to generate animated movies of one period of a complex
     amplitude field defined on a cartesian grid.
+
+    Frames are synthesized on demand by self.frames, a PhasorFrames
+    object, so the full (ny, nx, nframes) cube is never stored.
     '''
 
     def __init__(self, X, Y, fieldamp,
@@ -57,24 +74,46 @@ class CartesianFieldAnimation(object):
         if scalefunc:
             self.scalefunc = scalefunc
         else:
-            self.scalefunc = lambda x: x
+            self.scalefunc = _unscaled
 
         self.X = X
         self.Y = Y
         self.A = fieldamp
         self.nf = nframes
         self.phase = np.linspace(0, 2*np.pi, self.nf)
-        self.Ff = self.A[:, :, np.newaxis]*np.exp(-1j*self.phase)
-        self.sCf = self.scalefunc(self.Ff.real/np.max(np.abs(self.Ff)))
-        self.clims = [np.min(self.sCf), np.max(self.sCf)]
+        self.frames = PhasorFrames(self.A, self.phase, self.scalefunc)
+        self.clims = self.frames.limits()
+        self._init_pyplot(pyplot_plt)
 
+    def _init_pyplot(self, pyplot_plt):
+        '''
+        Sets self.plt to pyplot_plt, or to pyplot with the
+        n3ox_utils.plot_tools defaults if it's None.
+        '''
         if not pyplot_plt:
             self.plt = mplt
             pltools.init_pyplot_defaults(self.plt)
         else:
             self.plt = pyplot_plt
 
-    def plot_preview_frames(self, framelist=None, **pcolor_options):
+    @property
+    def Ff(self):
+        '''
+        Full complex (ny, nx, nframes) field cube. Built on every access,
+        kept for backward compatibility. Use self.frames instead.
+        '''
+        return self.A[:, :, np.newaxis]*np.exp(-1j*self.phase)
+
+    @property
+    def sCf(self):
+        '''
+        Full scaled real (ny, nx, nframes) frame cube. Built on every access,
+        kept for backward compatibility. Use self.frames instead.
+        '''
+        return self.frames.materialize()
+
+    def plot_preview_frames(self, framelist=None, fast=True, decimate=True,
+                            rasterized=False, **pcolor_options):
         '''
         Plots a grid of pcolor preview frames matching the frame list. 
 
@@ -92,19 +131,19 @@ class CartesianFieldAnimation(object):
          Otherwise, a colormap from https://colorcet.pyviz.org/
          matching colorcet_cmap_name will be used, defaulting to 'bky'.
 
-        '''
+         fast: if True (default), evenly spaced np.meshgrid() grids are
+         drawn with imshow() and anything else with pcolormesh(), all
+         sharing one Normalize. Options imshow() doesn't take send regular
+         grids to pcolormesh() too. fast=False uses the original pcolor().
 
-        if not 'cmap' in pcolor_options.keys():
-            print(f'Using colorcet cmap "bky"')
-            pcolor_options.update({'cmap': cc.cm['bky']})
-        else:
+         decimate: if True, frames are strided down to about the
+         display resolution of each axes before plotting.
 
-            cmname = pcolor_options['cmap']
-            try:
-                pcolor_options.update({'cmap': cc.cm[cmname]})
-                print(f'Using colorcet colormap "{cmname}"')
-            except:
-                print(f'Trying "{cmname}" as a matplotlib colormap name.')
+         rasterized: rasterize the frame artists in vector output.
+
+        '''
+
+        _resolve_cmap(pcolor_options)
 
         nplots = len(framelist)
         # --- compute a figure size that matches the plots' aspect ratios ---
@@ -121,20 +160,697 @@ class CartesianFieldAnimation(object):
                                         nrows=nrows,
                                         ncols=ncols,
                                         figsize=(width, height))
+
+        # --- stride frames down to roughly the pixels available per axes ---
+        rows = cols = slice(None)
+        if decimate:
+            dpi = fig.get_dpi()
+            ny, nx = np.shape(self.X)
+            xstride = max(1, int(nx//(width*dpi/ncols)))
+            ystride = max(1, int(ny//(height*dpi/nrows)))
+            rows, cols = slice(None, None, ystride), slice(None, None, xstride)
+        X = np.asarray(self.X)[rows, cols]
+        Y = np.asarray(self.Y)[rows, cols]
+
+        extent = _regular_grid_extent(X, Y)
+        use_imshow = (fast and extent is not None and
+                      set(pcolor_options).issubset(_imshow_options))
+        norm = mpl.colors.Normalize(vmin=self.clims[0], vmax=self.clims[1])
+
         # --- plot frames ---
         for fnum, ax in zip(framelist, fig.axes):
-            p = ax.pcolor(self.X, self.Y,
-                          self.sCf[:, :, fnum],
-                          **pcolor_options)
+            frame = self.frames[fnum][rows, cols]
+            if use_imshow:
+                p = ax.imshow(frame, extent=extent, origin='lower',
+                              interpolation='nearest', norm=norm,
+                              rasterized=rasterized, **pcolor_options)
+            elif fast:
+                meshopts = dict({'shading': 'nearest'}, **pcolor_options)
+                p = ax.pcolormesh(X, Y, frame, norm=norm,
+                                  rasterized=rasterized, **meshopts)
+            else:
+                p = ax.pcolor(X, Y, frame, rasterized=rasterized,
+                              **pcolor_options)
+                p.set_clim(self.clims)
             ax.axis('equal')
             ax.axis('off')
-            p.set_clim(self.clims)
 
         return fig
 
-    def save_anim(self, nframes):
+    def phase_scrubber(self, **scrubber_options):
+        '''
+        Returns a PhaseScrubber widget for this animation. Call its
+        .show() method to display it in a Jupyter notebook.
+
+        Accepts PhaseScrubber keyword options.
+        '''
+        return PhaseScrubber(self, **scrubber_options)
+
+    def save_anim(self, filename, framelist=None, fps=25, writer='auto',
+                  width=8.0, dpi=100, processes=None, renderer='mpl',
+                  cache=None, **pcolor_options):
+        '''
+        Renders frames and streams them to a video or PNG sequence
+        one at a time, never holding the whole animation in memory.
+        Rendering runs in this thread while encoding runs in a
+        background thread, so the two stages overlap.
+
+         filename: output video file (.mp4, .mkv, .mov, .webm, .avi) or
+         a directory for a PNG sequence img00000.png, img00001.png, ...
+
+         framelist: optional frame numbers to save, defaults to all frames
+
+         fps: frames per second for video output
+
+         writer: 'auto', 'ffmpeg', 'png', 'gif' or 'apng'. 'auto' picks
+         gif/apng from .gif/.apng file names, uses ffmpeg for video file
+         names when ffmpeg is installed, and otherwise falls back to a PNG
+         sequence in a directory named after the file.
+
+         GIF and APNG output shares one palette built from the colormap and
+         clims, stores only the changed rectangle of each frame, and by
+         default drops a final frame that repeats the first one, so the
+         loop is seamless. These formats always use LUT rendering.
+
+         width, dpi: frame width in inches and dots per inch, the height
+         follows the aspect ratio of X and Y
+
+         processes: optional number of worker processes for parallel
+         rendering, see render_parallel(). None or 1 renders in this
+         process. Under the 'spawn' start method scalefunc must be
+         picklable (a module-level function, not a lambda).
+
+         renderer: 'mpl' renders with a matplotlib pcolormesh, 'lut'
+         colormaps frames directly with LUTFrameRenderer, which is much
+         faster but only honors the cmap option
+
+         cache: optional frame cache directory or diskcache.DiskLRUCache.
+         Each rendered frame is stored as a PNG keyed by a hash of the field
+         data, phase, scalefunc, colormap, clims and render settings, and
+         frames already in the cache are not rendered again.
+
+         Accepts matplotlib pcolormesh kwarg options and handles cmap
+         the same way as plot_preview_frames().
+
+        Returns the output file or directory name.
+        '''
+        kind, outname = _resolve_writer(filename, writer)
+        paletted = kind in ['gif', 'apng']
+        if framelist is None:
+            framelist = range(len(self.frames))
+            if paletted:
+                framelist = _one_period(self.frames)
+        framelist = list(framelist)
+
+        allowed_renderers = ['mpl', 'lut']
+        if renderer not in allowed_renderers:
+            emsg = (f'Invalid renderer {renderer}. '
+                    f'Supply one of {allowed_renderers}')
+            raise UserWarning(emsg)
+
+        lut = None
+        if renderer == 'lut' or paletted:
+            # --- paletted output keeps the last index for transparency ---
+            ncolors = 255 if paletted else 256
+            render_class = IndexedFrameRenderer if paletted else LUTFrameRenderer
+            lut = colormap_lut(pcolor_options.pop('cmap', 'bky'), ncolors=ncolors)
+            if pcolor_options:
+                print(f'LUT renderer ignores options {list(pcolor_options)}')
+            render_opts = dict(width=width, dpi=dpi, lut=lut)
+        else:
+            _resolve_cmap(pcolor_options)
+            render_class = MplFrameRenderer
+            render_opts = dict(width=width, dpi=dpi, **pcolor_options)
+
+        frame_writer = _make_writer(kind, outname, fps, palette=lut)
+        cache_keys = None
+        if cache is not None:
+            cache_keys = frame_cache_keys(self.frames, framelist, self.X,
+                                          self.Y, self.clims, render_class,
+                                          render_opts)
+            if cache_keys is None:
+                print('Frame source (scalefunc) can\'t be hashed, not using the cache')
+                cache = None
+        if cache is not None:
+            if not isinstance(cache, dkc.DiskLRUCache):
+                cache = frame_cache(cache)
+            frame_writer = fwr.CachingWriter(frame_writer, cache)
+            hits0 = cache.hits
+
+        with frame_writer:
+            if processes and processes > 1:
+                nsaved = render_parallel(self.frames, self.X, self.Y,
+                                         self.clims, frame_writer,
+                                         framelist=framelist,
+                                         processes=processes,
+                                         renderer=render_class,
+                                         cache=cache, cache_keys=cache_keys,
+                                         **render_opts)
+            else:
+                def make_renderer():
+                    return render_class(self.X, self.Y, self.clims,
+                                        **render_opts)
+                items = _render_items(self.frames, framelist, make_renderer,
+                                      cache, cache_keys)
+                nsaved = fwr.stream_frames(items, frame_writer)
+
+        print(f'Saved {nsaved} frames to "{outname}"')
+        if cache is not None:
+            print(f'{cache.hits - hits0} of {nsaved} frames from cache')
+        return outname
+
+
+# === Poynting vector animation of E and H near fields ===
+
+
+class PoyntingFieldAnimation(CartesianFieldAnimation):
+    '''
+    Animates power flow: the instantaneous Poynting vector of complex
+    E and H fields on a cartesian grid over one period.
+
+    Frames show the magnitude (or one component) of S, computed on
+    demand by self.frames, a PoyntingFrames object. Previews and
+    exports can add a decimated quiver or streamline overlay of the
+    two vector components lying in the plot plane.
+    '''
+
+    def __init__(self, X, Y, E, H, nframes=100, component='magnitude',
+                 plane='xy', pyplot_plt=None, scalefunc=None):
+        '''
+        Initializes an animation object with
+
+         X, Y: Cartesian plot plane coordinates as from np.meshgrid()
+
+         E, H: complex field components as sequences (Ex, Ey, Ez) and
+         (Hx, Hy, Hz) of arrays shaped like X, for instance reshaped
+         PyNEC near-field results
+
+         nframes: Number of phase frames to compute.
+
+         component: 'magnitude', 'x', 'y' or 'z'
+
+         plane: the two field components along the X and Y plot axes,
+         like 'xz' for a vertical plane through the x axis
+
+         pyplot_plt: optional, configured matplotlib.pyplot instance
+
+         scalefunc: optional, function to scale the normalized frames.
+        '''
+        if (len(plane) != 2 or
+                not set(plane).issubset(_vector_components)):
+            emsg = f'Invalid plane {plane}. Supply two of "xyz", like "xz"'
+            raise UserWarning(emsg)
+
+        self.scalefunc = scalefunc if scalefunc else _unscaled
+        self.X = X
+        self.Y = Y
+        self.E = np.asarray(E)
+        self.H = np.asarray(H)
+        self.plane_components = tuple(_vector_components[c] for c in plane)
+        self.nf = nframes
+        self.phase = np.linspace(0, 2*np.pi, self.nf)
+        self.frames = PoyntingFrames(self.E, self.H, self.phase,
+                                     component=component,
+                                     scalefunc=self.scalefunc)
+        self.clims = self.frames.limits()
+        self._init_pyplot(pyplot_plt)
+
+    @property
+    def Ff(self):
+        raise AttributeError('PoyntingFieldAnimation has no phasor cube, '
+                             'use self.frames.vector_at()')
+
+    def _overlay_options(self, overlay, overlay_options):
+        '''
+        VectorOverlay options for the overlay kind.
+        '''
+        return dict(overlay_options or {}, kind=overlay,
+                    components=self.plane_components)
+
+    def plot_preview_frames(self, framelist=None, overlay='quiver',
+                            overlay_options=None, **preview_options):
+        '''
+        Plots a grid of preview frames like
+        CartesianFieldAnimation.plot_preview_frames() with a vector
+        overlay on each frame.
+
+         overlay: 'quiver', 'stream' or None
+
+         overlay_options: optional dict of VectorOverlay options
+        '''
+        fig = super().plot_preview_frames(framelist, **preview_options)
+        if overlay:
+            opts = self._overlay_options(overlay, overlay_options)
+            for fnum, ax in zip(framelist, fig.axes):
+                VectorOverlay(ax, self.X, self.Y, **opts).draw(
+                    self.frames.vector_at(self.phase[fnum]))
+        return fig
+
+    def plot_time_average(self, overlay='stream', overlay_options=None,
+                          width=8.0, **pcolor_options):
+        '''
+        Plots the time-averaged Poynting vector, showing the same
+        component as the frames, with a vector overlay.
+
+        Returns the figure.
+        '''
+        _resolve_cmap(pcolor_options)
+        Savg = self.frames.time_average()
+        Xsize = np.max(self.X)-np.min(self.X)
+        Ysize = np.max(self.Y)-np.min(self.Y)
+        fig = self.plt.figure(figsize=(width, Ysize/Xsize * width))
+        ax = fig.add_axes([0, 0, 1, 1])
+        meshopts = dict({'shading': 'nearest'}, **pcolor_options)
+        ax.pcolormesh(self.X, self.Y, self.frames._scalar(Savg), **meshopts)
+        if overlay:
+            opts = self._overlay_options(overlay, overlay_options)
+            VectorOverlay(ax, self.X, self.Y, **opts).draw(Savg)
+        ax.axis('equal')
+        ax.axis('off')
+        return fig
+
+    def save_anim(self, filename, framelist=None, overlay=None,
+                  overlay_options=None, **save_options):
+        '''
+        Saves the animation like CartesianFieldAnimation.save_anim().
+
+         overlay: optional 'quiver' or 'stream' vector overlay, drawn
+         by the default renderer='mpl' only
+
+         overlay_options: optional dict of VectorOverlay options
+        '''
+        if overlay:
+            save_options['overlay'] = self._overlay_options(overlay,
+                                                            overlay_options)
+        return super().save_anim(filename, framelist, **save_options)
+
+
+class VectorOverlay(object):
+    '''
+    Quiver arrows or streamlines of two components of a vector field,
+    decimated to a coarse grid, drawn on existing axes. Redrawing with
+    new vectors updates the quiver in place.
+    '''
+
+    def __init__(self, ax, X, Y, kind='quiver', components=(0, 1),
+                 stride=None, narrows=24, **overlay_options):
+        '''
+         ax: matplotlib axes
+
+         X, Y: Cartesian coordinates as from np.meshgrid()
+
+         kind: 'quiver' or 'stream'. Streamlines need an evenly spaced grid.
+
+         components: indices of the vector components along X and Y
+
+         stride: grid decimation, defaults to about narrows arrows
+         along the longer axis
+
+         Accepts matplotlib quiver or streamplot kwarg options.
+        '''
+        allowed_kinds = ['quiver', 'stream']
+        if kind not in allowed_kinds:
+            emsg = f'Invalid overlay {kind}. Supply one of {allowed_kinds}'
+            raise UserWarning(emsg)
+
+        X = np.asarray(X)
+        Y = np.asarray(Y)
+        if stride is None:
+            stride = max(1, max(X.shape)//narrows)
+        self.ax = ax
+        self.kind = kind
+        self.components = components
+        self.cells = (slice(None, None, stride), slice(None, None, stride))
+        self.X = X[self.cells]
+        self.Y = Y[self.cells]
+        self.options = overlay_options
+        self.artist = None
+
+        if kind == 'stream':
+            if _regular_grid_extent(X, Y) is None:
+                raise UserWarning('Streamline overlays need an evenly '
+                                  'spaced np.meshgrid() grid')
+            overlay_options.setdefault('color', 'w')
+            overlay_options.setdefault('linewidth', 0.8)
+        else:
+            # --- unit normalized vectors span stride grid cells ---
+            ny, nx = X.shape
+            cell = stride*(np.max(X)-np.min(X))/max(nx-1, 1)
+            overlay_options.setdefault('color', 'w')
+            overlay_options.setdefault('angles', 'xy')
+            overlay_options.setdefault('scale_units', 'xy')
+            overlay_options.setdefault('scale', 1/cell)
+            zeros = np.zeros(self.X.shape)
+            self.artist = ax.quiver(self.X, self.Y, zeros, zeros,
+                                    **overlay_options)
+
+    def draw(self, vectors):
+        '''
+        Draws the overlay for a (3, ny, nx) vector array.
+        '''
+        U = np.asarray(vectors[self.components[0]])[self.cells]
+        V = np.asarray(vectors[self.components[1]])[self.cells]
+        if self.kind == 'quiver':
+            self.artist.set_UVC(U, V)
+            return
+
+        # --- streamlines can't be updated in place ---
+        if self.artist is not None:
+            self.artist.lines.remove()
+            self.artist.arrows.remove()
+        self.artist = self.ax.streamplot(self.X[0, :], self.Y[:, 0], U, V,
+                                         **self.options)
+
+
+# === Time-domain superposition of fields at several frequencies ===
+
+
+class TimeDomainFieldAnimation(CartesianFieldAnimation):
+    '''
+    Animates the real-time sum of complex amplitude fields at several
+    frequencies, for broadband or multi-transmitter setups, over an
+    arbitrary time window.
+
+    Frames are computed on demand in blocks by self.frames,
+    a TimeDomainFrames object.
+    '''
+
+    def __init__(self, X, Y, fieldamps, freqs, times=None, nframes=100,
+                 pyplot_plt=None, scalefunc=None):
+        '''
+        Initializes an animation object with
+
+         X, Y: Cartesian coordinates as from np.meshgrid()
+
+         fieldamps: complex amplitude fields from PyNEC simulations,
+         one per frequency, stacked as (nfreq, ny, nx)
+
+         freqs: the frequency of each field
+
+         times: optional 1D array of frame times in units reciprocal
+         to freqs. Defaults to nframes times over one period of the
+         lowest nonzero frequency.
+
+         nframes: Number of frames when times isn't given.
+
+         pyplot_plt: optional, configured matplotlib.pyplot instance
+
+         scalefunc: optional, function to scale the normalized frames.
+        '''
+        self.scalefunc = scalefunc if scalefunc else _unscaled
+        self.X = X
+        self.Y = Y
+        self.freqs = np.asarray(freqs, dtype=np.float64)
+        if times is None:
+            fmin = np.min(np.abs(self.freqs[self.freqs != 0]))
+            times = np.linspace(0, 1/fmin, nframes)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.nf = len(self.times)
+        self.frames = TimeDomainFrames(fieldamps, self.freqs, self.times,
+                                       scalefunc=self.scalefunc)
+        self.clims = self.frames.limits()
+        self._init_pyplot(pyplot_plt)
+
+    @property
+    def Ff(self):
+        raise AttributeError('TimeDomainFieldAnimation has no phasor cube, '
+                             'use self.frames.frame_block()')
+
+
+class PhaseScrubber(object):
+    '''
+    A Jupyter notebook slider for scrubbing through the phase (or other
+    frame sample coordinate) of a field animation.
+
+    The image artist is created once and each slider move only replaces
+    its data with anim.frames.frame_at(value), so any phase can be viewed,
+    not just the precomputed samples. Updates are throttled to at most one
+    redraw per min_interval seconds, and the last slider value is always
+    drawn.
+
+    With an interactive widget backend (%matplotlib widget) the figure
+    canvas is redrawn in place, otherwise the figure is re-displayed in an
+    ipywidgets.Output.
+    '''
+
+    def __init__(self, anim, min_interval=0.03, width=8.0, nsteps=360,
+                 **pcolor_options):
+        '''
+         anim: CartesianFieldAnimation or another object with
+         .frames, .X, .Y, .clims and .plt
+
+         min_interval: minimum time between redraws in seconds
+
+         width: figure width in inches
+
+         nsteps: number of slider steps across the frame samples
+
+         Accepts matplotlib imshow/pcolormesh kwarg options and handles
+         cmap the same way as plot_preview_frames().
+        '''
+        import ipywidgets
+        self.ipywidgets = ipywidgets
+        self.anim = anim
+        self.frames = anim.frames
+        self.min_interval = min_interval
+        self._pending = None
+        self._scheduled = False
+        self._last_draw = -np.inf
+        _resolve_cmap(pcolor_options)
+
+        samples = self.frames.samples
+        lo, hi = float(samples[0]), float(samples[-1])
+        self.slider = ipywidgets.FloatSlider(value=lo, min=lo, max=hi,
+                                             step=(hi-lo)/nsteps,
+                                             description=self.frames.sample_name,
+                                             continuous_update=True,
+                                             readout_format='.3f',
+                                             layout=ipywidgets.Layout(width='80%'))
+        self.slider.observe(self.on_value_change, names='value')
+        self.output = ipywidgets.Output()
+
+        # --- create the figure and its one artist ---
+        Xsize = np.max(anim.X)-np.min(anim.X)
+        Ysize = np.max(anim.Y)-np.min(anim.Y)
+        self.fig = anim.plt.figure(figsize=(width, Ysize/Xsize * width))
+        self.ax = self.fig.add_axes([0, 0, 1, 1])
+        self.ax.axis('off')
+        norm = mpl.colors.Normalize(vmin=anim.clims[0], vmax=anim.clims[1])
+        frame = self.frames.frame_at(lo)
+        extent = _regular_grid_extent(anim.X, anim.Y)
+        if extent is not None and set(pcolor_options).issubset(_imshow_options):
+            self.artist = self.ax.imshow(frame, extent=extent, origin='lower',
+                                         interpolation='nearest', norm=norm,
+                                         **pcolor_options)
+            self._set_frame = self.artist.set_data
+        else:
+            meshopts = dict({'shading': 'nearest'}, **pcolor_options)
+            self.artist = self.ax.pcolormesh(anim.X, anim.Y, frame,
+                                             norm=norm, **meshopts)
+            self._set_frame = lambda frame: self.artist.set_array(frame.ravel())
+        self.live_canvas = isinstance(self.fig.canvas, ipywidgets.DOMWidget)
+
+    def on_value_change(self, change):
+        '''
+        Slider observer callback.
+        '''
+        self.request_update(change['new'])
+
+    def request_update(self, value):
+        '''
+        Draws the frame at value now, or schedules it on the notebook's
+        event loop if the last redraw was less than min_interval ago.
+        Newer requests replace older pending ones.
+        '''
+        self._pending = value
+        wait = self._last_draw + self.min_interval - time.monotonic()
+        if wait <= 0:
+            self._flush()
+            return
+
+        if not self._scheduled:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:  # no event loop outside a notebook kernel
+                self._flush()
+                return
+            self._scheduled = True
+            loop.call_later(wait, self._flush)
+
+    def _flush(self):
+        '''
+        Draws the most recently requested value, if any.
+        '''
+        self._scheduled = False
+        value, self._pending = self._pending, None
+        if value is not None:
+            self._last_draw = time.monotonic()
+            self.update(value)
+
+    def update(self, value):
+        '''
+        Replaces the artist data with the frame at value and redraws.
+        '''
+        self._set_frame(self.frames.frame_at(value))
+        if self.live_canvas:
+            self.fig.canvas.draw_idle()
+        else:
+            from IPython.display import display, clear_output
+            with self.output:
+                clear_output(wait=True)
+                display(self.fig)
+
+    def show(self):
+        '''
+        Displays the slider and figure.
+        '''
+        from IPython.display import display
+        view = self.fig.canvas if self.live_canvas else self.output
+        display(self.ipywidgets.VBox([self.slider, view]))
+        self.update(self.slider.value)
+
+
+_video_exts = ['.mp4', '.mkv', '.mov', '.webm', '.avi']
+_imshow_options = ['cmap', 'alpha', 'interpolation', 'zorder']
+
+
+def _regular_grid_extent(X, Y, rtol=1e-6):
+    '''
+    Checks whether X, Y are an np.meshgrid() of evenly spaced axes.
+
+    Returns the imshow() extent [left, right, bottom, top] for plotting
+    with origin='lower' so cells are centered on the grid points,
+    or None if the grid isn't regular.
+    '''
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    if X.ndim != 2 or min(X.shape) < 2:
+        return None
+    x = X[0, :]
+    y = Y[:, 0]
+    dx = np.diff(x)
+    dy = np.diff(y)
+    xtol = rtol*np.max(np.abs(x))
+    ytol = rtol*np.max(np.abs(y))
+    regular = (np.all(np.abs(X - x) <= xtol) and
+               np.all(np.abs(Y - y[:, np.newaxis]) <= ytol) and
+               np.all(np.abs(dx - dx[0]) <= xtol) and
+               np.all(np.abs(dy - dy[0]) <= ytol) and
+               dx[0] != 0 and dy[0] != 0)
+    if not regular:
+        return None
+    return [x[0] - dx[0]/2, x[-1] + dx[0]/2,
+            y[0] - dy[0]/2, y[-1] + dy[0]/2]
+
+
+def _resolve_writer(filename, writer):
+    '''
+    Picks the kind of frame writer for save_anim() and returns it along
+    with the output file or directory name.
+    '''
+    allowed_writers = ['auto', 'ffmpeg', 'png', 'gif', 'apng']
+    if writer not in allowed_writers:
+        emsg = f'Invalid writer {writer}. Supply one of {allowed_writers}'
+        raise UserWarning(emsg)
+
+    stem, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    is_video = ext in _video_exts
+    if writer == 'auto':
+        if ext in ['.gif', '.apng']:
+            writer = ext[1:]
+        elif is_video and fwr.FFmpegWriter.available():
+            writer = 'ffmpeg'
+        else:
+            writer = 'png'
+            if is_video:
+                print(f'ffmpeg not found, writing PNG frames to "{stem}"')
+                filename = stem
+    return writer, filename
+
+
+def _make_writer(kind, filename, fps, palette=None):
+    '''
+    Builds the frame writer chosen by _resolve_writer().
+    '''
+    if kind == 'ffmpeg':
+        return fwr.FFmpegWriter(filename, fps=fps)
+    if kind == 'gif':
+        return fwr.GIFWriter(filename, palette, fps=fps)
+    if kind == 'apng':
+        return fwr.APNGWriter(filename, palette, fps=fps)
+    return fwr.PNGSequenceWriter(filename)
+
+
+def _resolve_cmap(pcolor_options):
+    '''
+    Replaces pcolor_options['cmap'] in place with a colorcet colormap
+    if the name matches one, defaulting to colorcet 'bky'. Otherwise
+    the cmap is left for matplotlib to interpret.
+    '''
+    if not 'cmap' in pcolor_options.keys():
+        print(f'Using colorcet cmap "bky"')
+        pcolor_options.update({'cmap': cc.cm['bky']})
+    else:
+
+        cmname = pcolor_options['cmap']
+        try:
+            pcolor_options.update({'cmap': cc.cm[cmname]})
+            print(f'Using colorcet colormap "{cmname}"')
+        except:
+            print(f'Trying "{cmname}" as a matplotlib colormap name.')
+    return pcolor_options
+
+
+class MplFrameRenderer(object):
+    '''
+    Renders scalar frames to RGB image arrays with matplotlib.
+
+    The Agg figure and its pcolormesh artist are created once, and each
+    frame only replaces the artist's data array, so no pyplot figures
+    pile up during long exports.
+    '''
+
+    def __init__(self, X, Y, clims, width=8.0, dpi=100, overlay=None,
+                 **pcolor_options):
+        '''
+         X, Y: Cartesian coordinates as from np.meshgrid()
+
+         clims: [min, max] color limits shared by all frames
+
+         width, dpi: image width in inches and dots per inch
+
+         overlay: optional dict of VectorOverlay options. Frames are then
+         drawn with a vector overlay of frames.vector_at() at each
+         frame's sample, see _render_frame().
+
+         Accepts matplotlib pcolormesh kwarg options.
+        '''
+        Xsize = np.max(X)-np.min(X)
+        Ysize = np.max(Y)-np.min(Y)
+        height = Ysize/Xsize * width
+        self.fig = Figure(figsize=(width, height), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.fig.add_axes([0, 0, 1, 1])
+        ax.axis('off')
+        pcolor_options.setdefault('shading', 'nearest')
+        self.mesh = ax.pcolormesh(X, Y, np.zeros(np.shape(X)),
+                                  **pcolor_options)
+        self.mesh.set_clim(clims)
+        self.overlay = None
+        if overlay:
+            self.overlay = VectorOverlay(ax, X, Y, **overlay)
+        ax.set_xlim(np.min(X), np.max(X))
+        ax.set_ylim(np.min(Y), np.max(Y))
+
+    def render(self, frame, vectors=None):
         '''
+        Returns frame rendered as a uint8 (height, width, 3) RGB array.
 
+         vectors: (3, ny, nx) vector field for the overlay, if any
         '''
-        print('save_anim() not implemented yet')
-        pass
+        self.mesh.set_array(np.asarray(frame).ravel())
+        if self.overlay is not None and vectors is not None:
+            self.overlay.draw(vectors)
+        self.canvas.draw()
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
@@ -12,10 +12,20 @@
 This module is a collection of PyNEC helper utilities, mostly to provide a 
 named-variable interface to the most common PyNEC things I use.
 '''
+import re
+import io
+import json
+import contextlib
+import time
+import threading
+import concurrent.futures
+import http.client
+import urllib.parse as urlparse
 import ipywidgets
 from IPython.display import display
 import urllib.request as urlrq
 import numpy as np
+import n3ox_utils.diskcache as dkc
 
 
 def pack_ex_card_args(**kwargs):
@@ -360,6 +370,37 @@ def pack_nearfield_card_args(coord_system=None, **kwargs):
     return args
 
 
+def pack_rp_card_args(**kwargs):
+    '''
+    Takes named radiation pattern parameters as keyword args and returns
+    a list of arguments for the .rp_card() method of a PyNEC NEC context.
+
+    https://www.nec2.org/part_3/cards/rp.html
+
+    Required:
+      n_theta, n_phi, theta0, phi0, delta_theta, delta_phi
+
+    Optional, zero by default:
+      calc_mode, output_format, normalization, D, A,
+      radial_distance, gain_norm
+    '''
+    thisfunc = 'pack_rp_card_args()'
+    reqd_keys = ['n_theta', 'n_phi', 'theta0', 'phi0',
+                 'delta_theta', 'delta_phi']
+    rpargs = ['calc_mode', 'n_theta', 'n_phi', 'output_format',
+              'normalization', 'D', 'A', 'theta0', 'phi0',
+              'delta_theta', 'delta_phi', 'radial_distance', 'gain_norm']
+    _check_kwarg_keys(thisfunc, reqd_keys, kwargs, 'keyword arguments')
+
+    illegal_kwargs = [arg for arg in kwargs.keys() if not arg in rpargs]
+    if illegal_kwargs:
+        emsg = f'Invalid argument(s) {illegal_kwargs} for {thisfunc}. Valid args: {rpargs}'
+        raise UserWarning(emsg)
+
+    args = [kwargs.get(var, 0) for var in rpargs]
+    return args
+
+
 def _check_kwarg_keys(caller, required_keys, kwargs, where):
     '''
     Checks for required argument names in kwargs.keys()
@@ -391,21 +432,314 @@ def _check_minimum_keys(caller, possible_keys, kwargs, why):
     return present_keys
 
 
+# === Columnar wire table: the wire model behind WireInput ===
+
+class WireTable(object):
+    '''
+    Columnar NumPy model of a set of NEC wires.
+
+    Each PyNEC wire argument is a column: int64 tag_id and segment_count,
+    float64 xw1, yw1, zw1, xw2, yw2, zw2, rad, rdel and rrad. Columns are
+    allocated with spare capacity, so appending is amortized O(1), and
+    geometry operations run on whole columns at once.
+
+    table['xw1'] returns a view of a column, table.endpoints an (N, 2, 3)
+    array of wire end points.
+    '''
+    columns = ['tag_id', 'segment_count', 'xw1', 'yw1', 'zw1',
+               'xw2', 'yw2', 'zw2', 'rad', 'rdel', 'rrad']
+    int_columns = ['tag_id', 'segment_count']
+    point_columns = [['xw1', 'yw1', 'zw1'], ['xw2', 'yw2', 'zw2']]
+    defaults = {'segment_count': 5, 'rad': 0.001, 'rdel': 1.0, 'rrad': 1.0}
+
+    def __init__(self, capacity=16):
+        '''
+        Creates an empty table with room for capacity wires.
+        '''
+        self.nwires = 0
+        self._data = {name: np.zeros(capacity, dtype=self.dtype(name))
+                      for name in self.columns}
+
+    @classmethod
+    def dtype(cls, name):
+        '''
+        NumPy dtype of column name.
+        '''
+        return np.int64 if name in cls.int_columns else np.float64
+
+    @classmethod
+    def from_columns(cls, **columns):
+        '''
+        Builds a table from equal-length column arrays or scalars keyed by
+        column name. Missing columns get the defaults (0 for coordinates),
+        and tag_id defaults to 1, 2, 3, ...
+        '''
+        arrays = {name: np.atleast_1d(values)
+                  for name, values in columns.items() if name in cls.columns}
+        nwires = max([len(values) for values in arrays.values()], default=0)
+        table = cls(capacity=max(nwires, 1))
+        table.nwires = nwires
+        for name in cls.columns:
+            column = table._data[name][:nwires]
+            if name in arrays:
+                column[...] = arrays[name]
+            elif name == 'tag_id':
+                column[...] = np.arange(1, nwires + 1)
+            else:
+                column[...] = cls.defaults.get(name, 0)
+        return table
+
+    @classmethod
+    def from_wire_dicts(cls, wiredicts):
+        '''
+        Builds a table from a list of PyNEC wire dicts, like the ones from
+        WireInput.return_wire_dicts(). Extra keys are ignored.
+        '''
+        wiredicts = list(wiredicts)
+        columns = {}
+        for name in cls.columns:
+            if any(name in wd for wd in wiredicts):
+                default = cls.defaults.get(name, 0)
+                columns[name] = np.array([wd.get(name, default)
+                                          for wd in wiredicts],
+                                         dtype=cls.dtype(name))
+        if 'tag_id' not in columns:
+            columns['tag_id'] = np.arange(1, len(wiredicts) + 1)
+        return cls.from_columns(**columns)
+
+    @classmethod
+    def from_endpoints(cls, endpoints, **columns):
+        '''
+        Builds a table from an (N, 2, 3) array of wire end points,
+        with other columns as arrays or scalars.
+        '''
+        endpoints = np.asarray(endpoints, dtype=np.float64)
+        for end, names in enumerate(cls.point_columns):
+            for axis, name in enumerate(names):
+                columns[name] = endpoints[:, end, axis]
+        nwires = len(endpoints)
+        columns = {name: np.broadcast_to(values, (nwires,))
+                   for name, values in columns.items()}
+        return cls.from_columns(**columns)
+
+    def __len__(self):
+        return self.nwires
+
+    def __getitem__(self, name):
+        '''
+        Returns a writable view of column name.
+        '''
+        return self._data[name][:self.nwires]
+
+    def __setitem__(self, name, values):
+        self._data[name][:self.nwires] = values
+
+    def copy(self):
+        '''
+        Returns an independent copy of the table.
+        '''
+        return WireTable.from_columns(**{name: self[name].copy()
+                                         for name in self.columns})
+
+    @property
+    def endpoints(self):
+        '''
+        (N, 2, 3) array of wire end points [[xw1, yw1, zw1], [xw2, yw2, zw2]]
+        '''
+        return np.stack([np.stack([self[name] for name in names], axis=-1)
+                         for names in self.point_columns], axis=1)
+
+    @endpoints.setter
+    def endpoints(self, endpoints):
+        endpoints = np.asarray(endpoints)
+        for end, names in enumerate(self.point_columns):
+            for axis, name in enumerate(names):
+                self[name] = endpoints[:, end, axis]
+
+    @property
+    def lengths(self):
+        '''
+        Length of each wire.
+        '''
+        P = self.endpoints
+        return np.linalg.norm(P[:, 1] - P[:, 0], axis=-1)
+
+    def segments(self):
+        '''
+        Splits every wire into its NEC segments, honoring the rdel
+        length and rrad radius taper ratios.
+
+        Returns a dict of arrays with one entry per segment:
+         start, end: (M, 3) segment end points
+         wire: row index of the segment's wire
+         index: 0-based segment number along the wire
+         length, radius: segment length and radius
+        '''
+        nsegs = self['segment_count']
+        wire = np.repeat(np.arange(self.nwires), nsegs)
+        index = np.arange(nsegs.sum()) - np.repeat(np.cumsum(nsegs) - nsegs, nsegs)
+        n = nsegs[wire]
+        rdel = self['rdel'][wire]
+
+        # --- segment k of n starts at (1 - rdel^k)/(1 - rdel^n) of the wire ---
+        tapered = np.abs(rdel - 1) > 1e-12
+        rsafe = np.where(tapered, rdel, 2.0)
+
+        def fraction(k):
+            return np.where(tapered, (1 - rsafe**k)/(1 - rsafe**n), k/n)
+
+        P = self.endpoints[wire]
+        span = P[:, 1] - P[:, 0]
+        start = P[:, 0] + fraction(index)[:, np.newaxis]*span
+        end = P[:, 0] + fraction(index + 1)[:, np.newaxis]*span
+        return {'start': start, 'end': end, 'wire': wire, 'index': index,
+                'length': np.linalg.norm(end - start, axis=-1),
+                'radius': self['rad'][wire]*self['rrad'][wire]**index}
+
+    def _reserve(self, nwires):
+        '''
+        Grows the column storage to hold at least nwires wires.
+        '''
+        capacity = len(self._data['tag_id'])
+        if nwires <= capacity:
+            return
+        capacity = max(nwires, 2*capacity)
+        for name, column in self._data.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.nwires] = column[:self.nwires]
+            self._data[name] = grown
+
+    def append(self, wiredict=None, **values):
+        '''
+        Appends one wire from a wire dict and/or keyword values.
+        Missing values get the defaults, with segment_count copied from
+        the previous wire and tag_id one past the largest tag.
+
+        Returns the new wire's row index.
+        '''
+        values = dict(wiredict or {}, **values)
+        row = self.nwires
+        self._reserve(row + 1)
+        self.nwires += 1
+        for name in self.columns:
+            self._data[name][row] = values.get(name, self._default(name, row))
+        return row
+
+    def _default(self, name, row):
+        '''
+        Default value of column name for a new wire at row.
+        '''
+        if name == 'tag_id':
+            return np.max(self['tag_id'][:row], initial=0) + 1
+        if name == 'segment_count' and row > 0:
+            return self._data[name][row - 1]
+        return self.defaults.get(name, 0)
+
+    def extend(self, other):
+        '''
+        Appends all the wires of another WireTable.
+        '''
+        start = self.nwires
+        self._reserve(start + len(other))
+        self.nwires += len(other)
+        for name in self.columns:
+            self._data[name][start:self.nwires] = other[name]
+
+    def delete(self, rows, renumber=True):
+        '''
+        Deletes the wires at row index or indices rows. With renumber,
+        tags are reassigned as 1, 2, 3, ... like the WireInput GUI does.
+        '''
+        keep = np.ones(self.nwires, dtype=bool)
+        keep[rows] = False
+        nkeep = np.count_nonzero(keep)
+        for name, column in self._data.items():
+            column[:nkeep] = column[:self.nwires][keep]
+        self.nwires = nkeep
+        if renumber:
+            self.renumber()
+
+    def clear(self):
+        '''
+        Deletes every wire.
+        '''
+        self.nwires = 0
+
+    def renumber(self):
+        '''
+        Sets tag_id to 1, 2, 3, ... in row order.
+        '''
+        self['tag_id'] = np.arange(1, self.nwires + 1)
+
+    def row(self, index):
+        '''
+        Returns wire index as a PyNEC wire dict.
+        '''
+        return {name: self._data[name][index].item() for name in self.columns}
+
+    def translate(self, amount, axis):
+        '''
+        Translates every wire a distance amount along axis 'x', 'y' or 'z'
+        '''
+        if not axis in ['x', 'y', 'z']:
+            raise UserWarning("Invalid value for 'axis'. Valid directions are 'x', 'y', and 'z'")
+        self[axis + 'w1'] += amount
+        self[axis + 'w2'] += amount
+
+    def transform(self, M):
+        '''
+        Applies a 4x4 transform, as from rotation_matrix(), to every
+        wire's end points in place. Wire radii are unchanged.
+        '''
+        self.endpoints = apply_transform(self.endpoints, M)
+
+    def to_wire_dicts(self):
+        '''
+        Returns the wires as a list of dicts suitable for ** unpacking
+        into PyNEC wire geometry's wire()
+        '''
+        values = zip(*(self[name].tolist() for name in self.columns))
+        return [dict(zip(self.columns, row)) for row in values]
+
+    def to_arrays(self):
+        '''
+        Returns a dict of copies of every column.
+        '''
+        return {name: self[name].copy() for name in self.columns}
+
+    def to_pynec(self, geometry):
+        '''
+        Adds every wire to a PyNEC geometry, as from
+        nec_context().get_geometry(). Call geometry_complete() afterwards.
+        '''
+        for row in zip(*(self[name].tolist() for name in self.columns)):
+            geometry.wire(*row)
+
+
 class WireInput(object):
     '''
     A Jupyter notebook wire input GUI for PyNEC
 
+    The wires live in self.table, a WireTable, and the GUI is a paged
+    view over it: a fixed pool of page_size widget rows shows one page of
+    wires at a time. Editing a cell writes through to the table, and
+    adding, deleting, importing or translating wires works on the table
+    and then refreshes the pooled rows, so the GUI stays responsive for
+    models with thousands of wires.
+
     https://ipywidgets.readthedocs.io/en/latest/examples/Widget%20Styling.html
     https://github.com/tmolteno/python-necpp/tree/master/PyNEC
 
 
     '''
 
-    def __init__(self):
+    def __init__(self, page_size=20):
         '''
         Sets up the initial UI layout with labels and a single wire. 
 
         Defines list of wire arguments and units.
+
+         page_size: number of wire rows shown per page
         '''
 
         # --- PyNEC/NEC-2 wire geometry arguments and labels ---
@@ -473,118 +807,116 @@ class WireInput(object):
         self.translation_amount_box = ipywidgets.FloatText(value=0.0,
                                                            tooltip='Translation amount.',
                                                            layout=self.boxlayout)
-        self.wires = []
+        self.table = WireTable()
 
         self.controls = ipywidgets.HBox([self.wirebutton, self.delbutton,
                                          self.taperbutton, self.translatebutton,
                                          self.translation_amount_box, self.translate_direction_selector],
                                         layout=self.hb_layout)
 
-        self.frame = ipywidgets.VBox([self.controls],
+        # --- pooled wire rows and page controls ---
+        self.page_size = page_size
+        self.offset = 0  # table index of the first wire on the page
+        self._syncing = False
+        self.rows = [self._make_row(slot) for slot in range(page_size)]
+
+        self.prevbutton = ipywidgets.Button(description='< Prev',
+                                            button_style='info')
+        self.prevbutton.step = -1
+        self.prevbutton.on_click(self.on_page)
+        self.nextbutton = ipywidgets.Button(description='Next >',
+                                            button_style='info')
+        self.nextbutton.step = 1
+        self.nextbutton.on_click(self.on_page)
+        self.pagelabel = ipywidgets.Label()
+        self.pager = ipywidgets.HBox([self.prevbutton, self.pagelabel,
+                                      self.nextbutton], layout=self.hb_layout)
+
+        self.frame = ipywidgets.VBox([self.controls, self.header] + self.rows
+                                     + [self.pager],
                                      layout=self.frame_layout)  # the "frame" is a collection of rows
-        self.nwires = 0
         self.add_wire_row()
+        self.refresh()
         # self.show() # this doesn't always work, so let's make it manual for now
 
+    @property
+    def nwires(self):
+        '''
+        Number of wires in the model.
+        '''
+        return len(self.table)
+
+    @property
+    def wires(self):
+        '''
+        The widget rows (HBoxes of the delete button and wire cells)
+        showing wires on the current page, read-only.
+
+        Rows are pooled, so this only covers the page that is shown;
+        use self.table or return_wire_dicts() for the whole model.
+        '''
+        return self.rows[:min(self.page_size, self.nwires-self.offset)]
+
     def get_EZNEC_wirestr(self, round=None):
         '''
         Writes out a string that can be imported into EZNEC.
+        See write_EZNEC_wires() to stream to a file instead.
         '''
-        wirefields = [f'{c}w1' for c in 'xyz']+[f'{c}w2' for c in 'xyz']+['diam']
-        row_fmt_str = ', '.join(['{'+f'{wf}:14.12f'+'}' for wf in wirefields])
-        ezwstr = 'm mm\n'
-        wiredicts = self.return_wire_dicts()
-        for wd in wiredicts:
-            wd['diam'] = 2000*wd['rad']
-            ezwstr += row_fmt_str.format(**wd)
-            ezwstr += '\n'
-        return ezwstr
+        ezwbuf = io.StringIO()
+        write_EZNEC_wires(ezwbuf, self.table)
+        return ezwbuf.getvalue()
 
-    def import_EZNEC_wires_from_URL(self, ezurl, round=None):
+    def import_EZNEC_wires_from_URL(self, ezurl, round=None, cache=None):
         '''
         Uses urllib.request (as urlrq) to open a wire description output from EZNEC.
 
-        Parses the units line and converts to meters.
-        '''
-        # --- Check the file for units line and select number of header lines ---
+        Parses the units line and converts to meters, see read_EZNEC_wires().
 
+         cache: optional download cache directory, see fetch_urls()
+        '''
+        if cache is not None:
+            self.import_EZNEC_wires(fetch_urls([ezurl], cache=cache)[0], round=round)
+            return
         with urlrq.urlopen(ezurl) as urf:
-            bytesdata = urf.readlines()
-
-        desc = [line.decode('UTF-8') for line in bytesdata]
-        self.EZNEC_import = desc
-        EZNEC_in_line = [line.count('EZNEC') for line in desc]
-        NH = EZNEC_in_line.index(True)+8
-        if not NH == 8:
-            uestr = 'import_EZNEC_wires_from_URL() found units line "{0}" as first line. Not yet implemented.'
-            raise NotImplementedError(uestr.format(desc[0]))
-
-        pipesepdata = ['|'.join(line.split()).replace(',|', ',')  # EZNEC files have mix of variable spacing and comma seperated, replace with pipes
-                       for line in desc[NH:] if not line.isspace()]
-        wiredata = []
-        # --- The wire coordinates are still comma separated, split those up too ---
-        for entry in pipesepdata:
-            # drop wire connectivity like W1E2, GND etc
-            #print(entry.split('|'))
-            wire_line_temp = [d.split(',')
-                              for d in entry.split('|') if not (d.count('W') or d.count('G'))]
-            #print("\t->", wire_line_temp)
-            wire_entry_unpacked = []
-            for wdlist in wire_line_temp:  # unpack the wire coordinates and other data into individual entries in wdlist
-                wire_entry_unpacked.extend(wdlist)
-            wiredata.append(wire_entry_unpacked)
-
-        self.EZNEC_entry_map = ['tag_id', 'xw1', 'yw1', 'zw1', 'xw2',
-                                'yw2', 'zw2', 'rad', 'segment_count',
-                                'dielc', 'dielthk']
-        # --- TODO: change transformers based on wire units --- probably make a dict of transformers ---
-        if round:
-            floatfn = lambda s: np.round(float(s), decimals=round)
-        else:
-            floatfn = float
-        self.EZNEC_xformers = [int]+[floatfn]*6 + [lambda num: floatfn(num)/2000]
-        self.EZNEC_xformers += [int, floatfn, lambda num: floatfn(num)/1000]
-
-        # --- Use transformations to build a wire dictionary from EZNEC input data ---
-        wiredicts = []
-        for wire_entry in wiredata:  # wiredata is a list of lists, one per wire
-            wiredict = {key: xformer(value) for key, xformer, value in
-                        zip(self.EZNEC_entry_map, self.EZNEC_xformers, wire_entry)}
-            wiredicts.append(wiredict)
-
-        self.EZNEC_wires = wiredicts
-        # --- Delete existing wires and add new wires with imported data ---
-        self.delete_all_wires()
-        for wiredict in self.EZNEC_wires:
-            row = self.add_wire_row()
-            self.populate_row(row=row,
-                              wiredict=wiredict)
+            self.import_EZNEC_wires(urf.read(), round=round)
 
-        if self.out:
-            self.refresh()  # refresh if .show() has been called, otherwise don't refresh
+    def import_EZNEC_wires(self, source, round=None, wavelength=None):
+        '''
+        Replaces the wires with those parsed from an EZNEC wire file path,
+        file object or bytes by read_EZNEC_wires().
+        '''
+        table = read_EZNEC_wires(source, wavelength=wavelength, round=round)
+        self.EZNEC_wires = table.to_wire_dicts()
+        self.load_table(table)
 
     def populate_row(self, row=None, wiredict=None):
         '''
-        Iterates through children of a wire row returned from add_wire_row() 
-        and fills in appropriate values from a dict of wires.
+        Fills in wire number row (a table row index, as returned from
+        add_wire_row()) with values from a wire dict.
 
         Matches keys so extraneous keys (Dielectric properties from EZNEC, 
         for example) are ignored.
-
-        Note that the "row" is a list of widgets, 
-        but isn't contained in the row's HBox
         '''
         for k, v in wiredict.items():
-            for box in row:
-                if box.argid == k:
-                    box.value = v
+            if k in self.wireargs:
+                self.table[k][row] = v
+        self.refresh()
 
     def delete_all_wires(self):
         '''
-        Sets the wire list to an empty list and self.nwires to 0
+        Empties the wire table and goes back to the first page
         '''
-        self.wires = []
-        self.nwires = 0
+        self.table.clear()
+        self.offset = 0
+
+    def load_table(self, table):
+        '''
+        Replaces the model with a copy of a WireTable and shows
+        its first page.
+        '''
+        self.delete_all_wires()
+        self.table.extend(table)
+        self.refresh()
 
     def on_add_wire(self, button):
         '''
@@ -595,17 +927,12 @@ class WireInput(object):
 
     def on_del_wire(self, button):
         '''
-        Deletes a wire input row from the GUI.
+        Deletes the wire shown in the delete button's row.
         Renumbers the wire tag_id's appropriately.
         '''
-        self.wires.pop(button.tag_id-1)
-        self.nwires -= 1
-        for n, wire in enumerate(self.wires):
-            tagix = self.cellnames.index('tag_id')
-
-            wire.children[tagix].value = str(n+1)  # 1-indexed
-            wire.children[0].tag_id = n+1  # this is the wire delete button
-
+        index = self.offset + button.slot
+        if index < len(self.table):
+            self.table.delete(index)
         self.refresh()
 
     def on_del_all(self, button):
@@ -615,6 +942,21 @@ class WireInput(object):
         self.delete_all_wires()
         self.refresh()
 
+    def on_page(self, button):
+        '''
+        Callback for the page buttons.
+        '''
+        self.show_page(self.offset//self.page_size + button.step)
+
+    def show_page(self, page):
+        '''
+        Shows page number page (from 0) of the wire table,
+        clamped to the pages that exist.
+        '''
+        npages = max(1, -(-len(self.table)//self.page_size))
+        self.offset = min(max(page, 0), npages-1)*self.page_size
+        self.refresh()
+
     def on_translate_wires(self, button):
         '''
         Translates all the wire coords in the GUI according to direction
@@ -631,24 +973,49 @@ class WireInput(object):
         if not direction_string in ['x', 'y', 'z']:
             raise UserWarning("Invalid value for 'direction_string'. Valid directions are 'x', 'y', and 'z'")
 
-        tags = [direction_string+'w1',direction_string+'w2']
-        for wire in self.wires:
-            for child in wire.children:
-                if child.argid in tags:
-                    child.value += amount
+        self.table.translate(amount, direction_string)
+        self.refresh()
 
-    def add_wire_row(self):
+    def _on_cell_change(self, change):
         '''
-        Adds a wire input row to the GUI.
+        Widget observer: writes an edited cell through to the table.
+        '''
+        if self._syncing:
+            return
+        cell = change['owner']
+        index = self.offset + cell.slot
+        if index < len(self.table):
+            self.table[cell.argid][index] = change['new']
+
+    def add_wire_row(self, wiredict=None):
+        '''
+        Adds a wire to the table, from an optional wire dict, and pages
+        to it. New wires default to the previous wire's segmentation
+        and a 1 mm radius.
+
+        Returns the new wire's table row index.
+        '''
+        if wiredict is None:
+            wiredict = {}
+        wiredict = dict(wiredict, tag_id=self.nwires+1)
+        index = self.table.append(wiredict)
+        self.offset = index//self.page_size*self.page_size
+        return index
+
+    def _make_row(self, slot):
+        '''
+        Builds the pooled widget row in position slot of the page.
         '''
-        self.nwires += 1
-        tag_id = self.nwires
         row = [ipywidgets.IntText(layout=clay) if n < 2
                else ipywidgets.FloatText(layout=clay, step=None)
                for n, clay in enumerate(self.wire_cell_layouts)]
 
         for widget, wirearg in zip(row, self.wireargs):
             widget.argid = wirearg
+            widget.slot = slot
+            widget.observe(self._on_cell_change, names='value')
+            if wirearg == 'tag_id':
+                widget.disabled = True  # tag_id is read-only and handled in the background
 
         # --- add a wire delete button at the beginning of the row ---
         del_lay = ipywidgets.Layout(width='2%', border='1px solid black')
@@ -656,35 +1023,12 @@ class WireInput(object):
                                       layout=del_lay,
                                       button_style='danger',
                                       font_weight='bold')
-        delbutton.tag_id = tag_id
+        delbutton.slot = slot
         delbutton.on_click(self.on_del_wire)
         delbutton.argid = None
         row = [delbutton] + row
 
-        # --- fill in default values for new wires ---
-
-        for n, c in enumerate(row):
-            if c.argid == 'tag_id':
-                c.value = tag_id
-                c.disabled = True  # tag_id is read-only and handled in the background
-
-            elif c.argid == 'segment_count':  # default to previous wire's segmentation, or 5 if no previous wire
-                try:
-                    c.value = self.wires[-1].children[n].value
-                except:
-                    c.value = 5
-
-            elif c.argid == 'rad':  # default to one mm
-                c.value = 0.001
-
-            elif c.argid in ['rdel', 'rrad']:
-                c.value = 1.0
-
-            else:
-                c.value = 0.000
-
-        self.wires.append(ipywidgets.HBox(row, layout=self.hb_layout))
-        return row
+        return ipywidgets.HBox(row, layout=ipywidgets.Layout())
 
     def taperbutton_handler(self, change):
         '''
@@ -700,57 +1044,377 @@ class WireInput(object):
         else:
             setval = 'hidden'
 
+        # default for rrad and rdel is 1.0
+        self.table['rdel'] = 1.0
+        self.table['rrad'] = 1.0
+        self._set_taper_visibility(setval)
+        self.refresh()
+
+    def _set_taper_visibility(self, setval):
+        '''
+        Shows or hides the rdel and rrad columns.
+        '''
         for colname in ['rdel', 'rrad']:
             n = self.cellnames.index(colname)
             self.headercells[n].layout.visibility = setval
-            for wire in self.wires:
-                wire.children[n].layout.visibility = setval
-                # default for rrad and rdel is 1.0
-                wire.children[n].value = 1.0
-
-        self.refresh()
+            for row in self.rows:
+                row.children[n].layout.visibility = setval
 
     def refresh(self):
         '''
-        Update the outermost VBox self.frame with added or deleted wires
+        Shows the current page of the wire table in the pooled rows.
+
+        Only the page_size pooled widgets are updated, so this costs the
+        same for any number of wires. Each row's layout and cells are held
+        by hold_sync() until the whole row is set, and traits that don't
+        change send nothing, so paging sends at most one message per
+        changed widget.
         '''
-        # this automatically re-displays changes, nothing else needed
-        # possibly needs display_id = True in display?
-        self.frame.children = [self.controls, self.header] + self.wires
+        nwires = len(self.table)
+        if self.offset >= nwires:
+            self.offset = max(0, nwires-1)//self.page_size*self.page_size
+        stop = min(self.offset+self.page_size, nwires)
+        values = {name: self.table[name][self.offset:stop].tolist()
+                  for name in self.wireargs}
+
+        self._syncing = True
+        try:
+            for slot, row in enumerate(self.rows):
+                visible = self.offset+slot < stop
+                cells = row.children[1:] if visible else []
+                with contextlib.ExitStack() as held:
+                    for widget in [row.layout] + list(cells):
+                        held.enter_context(widget.hold_sync())
+                    row.layout.display = None if visible else 'none'
+                    for cell in cells:
+                        cell.value = values[cell.argid][slot]
+        finally:
+            self._syncing = False
+
+        if nwires:
+            self.pagelabel.value = f'wires {self.offset+1}-{stop} of {nwires}'
+        else:
+            self.pagelabel.value = 'no wires'
+        self.prevbutton.disabled = self.offset == 0
+        self.nextbutton.disabled = stop >= nwires
 
     def show(self):
         '''
         Initialize and display the collection of widgets.
         '''
-
-        self.frame.children = [self.controls, self.header] + self.wires
-
-        for colname in ['rdel', 'rrad']:
-            n = self.cellnames.index(colname)
-            self.headercells[n].layout.visibility = 'hidden'
-            for wire in self.wires:
-                wire.children[n].layout.visibility = 'hidden'
-                wire.children[n].layout.visibility = 'hidden'
-
+        self._set_taper_visibility('hidden')
+        self.refresh()
         self.out = display(self.frame, display_id=True)
 
+    def connectivity(self, **graph_options):
+        '''
+        Returns the wire_graph() of the current wires.
+        '''
+        return wire_graph(self.table, **graph_options)
+
     def return_wire_dicts(self):
         '''
         Return the current wire params as a list of dicts
         suitable for ** unpacking into PyNEC wire geometry's 
         add_wire()
         '''
-        wiredicts = []
-        for wire in self.wires:
-            wiredict = {child.argid: child.value
-                        for child in wire.children if child.argid}
-            wiredicts.append(wiredict)
+        return self.table.to_wire_dicts()
 
-        return wiredicts
 
 # === Below we collect some functions for manipulating the geometry of wire dictionaries. ===
 
 
+# === Batch affine transforms of wire end points ===
+# Transforms are 4x4 homogeneous matrices acting on column vectors, so
+# they compose by matrix products and a whole (N, 2, 3) end point array
+# is transformed with one matmul. Functions taking an array of angles or
+# offsets return a stack of matrices (K, 4, 4) for array_instances().
+
+_unit_axes = {'x': (1.0, 0.0, 0.0), 'y': (0.0, 1.0, 0.0), 'z': (0.0, 0.0, 1.0)}
+
+
+def _axis_vector(axis):
+    '''
+    Unit vector for axis 'x', 'y', 'z' or any nonzero 3-vector.
+    '''
+    if isinstance(axis, str):
+        if not axis in _unit_axes:
+            raise UserWarning(f"Invalid axis {axis}. Valid axes are 'x', 'y', 'z' or a 3-vector")
+        return np.array(_unit_axes[axis])
+    axis = np.asarray(axis, dtype=np.float64)
+    norm = np.linalg.norm(axis)
+    if axis.shape != (3,) or norm == 0:
+        raise UserWarning(f'Invalid axis {axis}. Supply a nonzero 3-vector')
+    return axis/norm
+
+
+def _about_point(M, point):
+    '''
+    Conjugates transform(s) M so they act about point instead of the origin.
+    '''
+    if point is None:
+        return M
+    point = np.asarray(point, dtype=np.float64)
+    return translation_matrix(point) @ M @ translation_matrix(-point)
+
+
+def translation_matrix(offset):
+    '''
+    4x4 translation by offset (dx, dy, dz), or a (K, 4, 4) stack
+    for a (K, 3) array of offsets.
+    '''
+    offset = np.asarray(offset, dtype=np.float64)
+    M = np.zeros(offset.shape[:-1] + (4, 4))
+    M[..., :, :] = np.eye(4)
+    M[..., :3, 3] = offset
+    return M
+
+
+def rotation_matrix(thetadeg, axis='z', point=None):
+    '''
+    4x4 rotation through thetadeg degrees about axis ('x', 'y', 'z' or a
+    3-vector direction) through point (default the origin), right-handed
+    like rotate_wiredict(). An array of angles gives a (K, 4, 4) stack.
+
+    https://en.wikipedia.org/wiki/Rodrigues%27_rotation_formula
+    '''
+    k = _axis_vector(axis)
+    theta = np.deg2rad(np.asarray(thetadeg, dtype=np.float64))[..., np.newaxis, np.newaxis]
+    K = np.array([[0, -k[2], k[1]],
+                  [k[2], 0, -k[0]],
+                  [-k[1], k[0], 0]])
+    R = np.eye(3) + np.sin(theta)*K + (1 - np.cos(theta))*(K @ K)
+    M = np.zeros(R.shape[:-2] + (4, 4))
+    M[..., :3, :3] = R
+    M[..., 3, 3] = 1.0
+    return _about_point(M, point)
+
+
+def scaling_matrix(factors, point=None):
+    '''
+    4x4 scaling by factors (a scalar or (sx, sy, sz)) about point,
+    default the origin. Wire radii are not scaled.
+    '''
+    M = np.diag(np.append(np.broadcast_to(np.asarray(factors, dtype=np.float64), (3,)), 1.0))
+    return _about_point(M, point)
+
+
+def mirror_matrix(normal='z', point=None):
+    '''
+    4x4 reflection through the plane with normal ('x', 'y', 'z' or a
+    3-vector) through point, default the origin. mirror_matrix('x')
+    maps x to -x.
+    '''
+    n = _axis_vector(normal)
+    M = np.eye(4)
+    M[:3, :3] -= 2*np.outer(n, n)
+    return _about_point(M, point)
+
+
+def compose_transforms(*matrices):
+    '''
+    Composes transforms applied in the order given, so
+    compose_transforms(A, B) applies A first, then B.
+    '''
+    M = np.eye(4)
+    for m in matrices:
+        M = np.asarray(m) @ M
+    return M
+
+
+def apply_transform(endpoints, M):
+    '''
+    Applies 4x4 transform M to an (N, 2, 3) array of wire end points
+    (or any (..., 3) array of points) and returns the new array.
+    '''
+    M = np.asarray(M)
+    P = np.asarray(endpoints, dtype=np.float64)
+    # --- one (3N, 3) x (3, 3) product, then the translation in place ---
+    out = P.reshape(-1, 3) @ M[:3, :3].T
+    out += M[:3, 3]
+    return out.reshape(P.shape)
+
+
+def array_instances(wires, matrices):
+    '''
+    Makes one copy of wires per transform in a (K, 4, 4) stack, like
+    radials from rotation_matrix(np.arange(0, 360, 30), 'z') or an
+    array from translation_matrix(offsets).
+
+    wires is an (N, 2, 3) end point array, giving a (K*N, 2, 3) array,
+    or a WireTable, giving a new WireTable with the other columns
+    repeated and tags renumbered 1, 2, 3, ...
+    '''
+    matrices = np.asarray(matrices).reshape(-1, 4, 4)
+    table = wires if isinstance(wires, WireTable) else None
+    P = table.endpoints if table is not None else np.asarray(wires)
+
+    # --- (K, 1, 1, 3, 3) rotations against (N, 2, 3, 1) points, one batched matmul ---
+    out = (matrices[:, np.newaxis, np.newaxis, :3, :3] @ P[..., np.newaxis])[..., 0]
+    out += matrices[:, np.newaxis, np.newaxis, :3, 3]
+    out = out.reshape((-1,) + P.shape[1:])
+    if table is None:
+        return out
+
+    columns = {name: np.tile(table[name], len(matrices))
+               for name in WireTable.columns if name != 'tag_id'}
+    return WireTable.from_endpoints(out, **columns)
+
+
+def transform_wiredicts(wiredicts, M):
+    '''
+    Returns copies of a list of wire dicts with transform M applied
+    to their end points. Other keys are kept.
+    '''
+    P = apply_transform(WireTable.from_wire_dicts(wiredicts).endpoints, M)
+    names = WireTable.point_columns
+    out = []
+    for wd, ends in zip(wiredicts, P.tolist()):
+        wd = wd.copy()
+        for end, point in zip(names, ends):
+            wd.update(zip(end, point))
+        out.append(wd)
+    return out
+
+
+# === Parametric wire generators ===
+# Each generator builds the whole wire set as arrays and returns a
+# WireTable with tags 1, 2, 3, ... (offset by first_tag), ready for
+# WireTable.to_pynec(), WireInput.load_table() or WireTable.extend().
+
+def _segment_counts(lengths, segment_count=None, max_seg_length=None):
+    '''
+    segment_count if given, else enough segments per wire to keep them
+    no longer than max_seg_length, else the WireTable default.
+    '''
+    if segment_count is not None:
+        return segment_count
+    if max_seg_length is not None:
+        return np.maximum(1, np.ceil(lengths/max_seg_length)).astype(np.int64)
+    return WireTable.defaults['segment_count']
+
+
+def _generated_table(endpoints, first_tag, segment_count, max_seg_length,
+                     **columns):
+    '''
+    WireTable from generated end points with automatic tags and segments.
+    '''
+    lengths = np.linalg.norm(endpoints[:, 1] - endpoints[:, 0], axis=-1)
+    columns['segment_count'] = _segment_counts(lengths, segment_count,
+                                               max_seg_length)
+    columns['tag_id'] = np.arange(first_tag, first_tag + len(endpoints))
+    return WireTable.from_endpoints(endpoints, **columns)
+
+
+def _align_z(normal):
+    '''
+    4x4 rotation taking the z axis to the direction normal.
+    '''
+    n = _axis_vector(normal)
+    axis = np.cross([0.0, 0.0, 1.0], n)
+    if np.linalg.norm(axis) < 1e-12:
+        # --- half turn about x for -z: a mirror would flip the winding sense ---
+        return np.eye(4) if n[2] > 0 else rotation_matrix(180.0, 'x')
+    return rotation_matrix(np.rad2deg(np.arccos(np.clip(n[2], -1, 1))), axis)
+
+
+def radial_wires(count, length, center=(0.0, 0.0, 0.0), start_radius=0.0,
+                 angle0deg=0.0, droop_deg=0.0, rad=0.001, segment_count=None,
+                 max_seg_length=None, first_tag=1):
+    '''
+    Returns count evenly spaced horizontal radials as a WireTable.
+
+     count, length: number of radials and their length in meters
+
+     center: hub point the radials spread out from
+
+     start_radius: radial distance of each radial's inner end
+
+     angle0deg: azimuth of the first radial, counterclockwise from x
+
+     droop_deg: downward slope of each radial (elevated radials)
+
+     rad: wire radius
+
+     segment_count: segments per wire, or None to use max_seg_length
+    '''
+    az = np.deg2rad(angle0deg + 360.0*np.arange(count)/count)
+    droop = np.deg2rad(droop_deg)
+    direction = np.stack([np.cos(az)*np.cos(droop), np.sin(az)*np.cos(droop),
+                          np.full(count, -np.sin(droop))], axis=-1)
+    inner = np.asarray(center, dtype=np.float64) + start_radius*direction
+    endpoints = np.stack([inner, inner + length*direction], axis=1)
+    return _generated_table(endpoints, first_tag, segment_count,
+                            max_seg_length, rad=rad)
+
+
+def helix_wires(turns, radius, pitch, wires_per_turn=16, center=(0.0, 0.0, 0.0),
+                axis='z', right_handed=True, rad=0.001, segment_count=1,
+                max_seg_length=None, first_tag=1):
+    '''
+    Returns a helix of straight wires as a WireTable, one wire per
+    1/wires_per_turn of a turn. For axis 'z' it starts on the +x side;
+    other axes rotate that helix so z points along axis.
+
+     turns: number of turns (can be fractional)
+
+     radius, pitch: helix radius and the axial advance per turn
+
+     center: the point on the axis where the helix starts
+
+     axis: helix axis 'x', 'y', 'z' or a 3-vector
+
+     right_handed: winding sense about axis
+
+     segment_count: segments per wire, default 1
+    '''
+    nwires = max(1, int(np.ceil(turns*wires_per_turn)))
+    phi = np.linspace(0.0, 2*np.pi*turns, nwires + 1)
+    sense = 1.0 if right_handed else -1.0
+    points = np.stack([radius*np.cos(phi), sense*radius*np.sin(phi),
+                       pitch*phi/(2*np.pi)], axis=-1)
+    M = compose_transforms(_align_z(axis), translation_matrix(center))
+    points = apply_transform(points, M)
+    endpoints = np.stack([points[:-1], points[1:]], axis=1)
+    return _generated_table(endpoints, first_tag, segment_count,
+                            max_seg_length, rad=rad)
+
+
+def polygon_loop(sides, radius, center=(0.0, 0.0, 0.0), normal='z',
+                 angle0deg=0.0, rad=0.001, segment_count=None,
+                 max_seg_length=None, first_tag=1):
+    '''
+    Returns a closed regular polygon loop as a WireTable, with corners
+    on a circle of radius around center in the plane with the given
+    normal. Adjacent sides share exact corner points.
+
+     sides: number of sides, like 4 for a square or 3 for a delta loop
+
+     angle0deg: angle of the first corner in the loop's plane
+    '''
+    az = np.deg2rad(angle0deg + 360.0*np.arange(sides + 1)/sides)
+    az[-1] = az[0]  # close the loop exactly
+    corners = np.stack([radius*np.cos(az), radius*np.sin(az),
+                        np.zeros(sides + 1)], axis=-1)
+    M = compose_transforms(_align_z(normal), translation_matrix(center))
+    corners = apply_transform(corners, M)
+    endpoints = np.stack([corners[:-1], corners[1:]], axis=1)
+    return _generated_table(endpoints, first_tag, segment_count,
+                            max_seg_length, rad=rad)
+
+
+def linear_array(wires, count, spacing, axis='x', first_tag=1):
+    '''
+    Returns count copies of a WireTable (one array element, like a dipole
+    or a whole Yagi) spaced a distance spacing along axis, as a new
+    WireTable with tags renumbered from first_tag.
+    '''
+    offsets = spacing*np.arange(count)[:, np.newaxis]*_axis_vector(axis)
+    table = array_instances(wires, translation_matrix(offsets))
+    table['tag_id'] = np.arange(first_tag, first_tag + len(table))
+    return table
+
+
 def rotate_wiredict(wd, thetadeg, axis, inplace=False):
     """
     Rotates a dictionary wd with points
@@ -761,20 +1425,11 @@ def rotate_wiredict(wd, thetadeg, axis, inplace=False):
     If inplace is set to False, a copy is returned.
 
     https://en.wikipedia.org/wiki/Rotation_matrix#In_three_dimensions
+
+    For many wires, use rotation_matrix() with apply_transform() or
+    WireTable.transform() instead.
     """
-    theta = np.pi/180.0*thetadeg
-    if axis == 'x':
-        R = np.array([[1, 0, 0],
-                      [0, np.cos(theta), -np.sin(theta)],
-                      [0, np.sin(theta), np.cos(theta)]])
-    elif axis == 'y':
-        R = np.array([[np.cos(theta), 0, np.sin(theta)],
-                      [0, 1, 0],
-                      [-np.sin(theta), 0, np.cos(theta)]])
-    elif axis == 'z':
-        R = np.array([[np.cos(theta), -np.sin(theta), 0],
-                      [np.sin(theta), np.cos(theta), 0],
-                      [0, 0, 1]])
+    R = rotation_matrix(thetadeg, axis)[:3, :3]
 
     if not inplace:
         wd = wd.copy()
@@ -821,3 +1476,1293 @@ def get_wire_points(wd):
     p1 = np.asarray([wd['xw1'], wd['yw1'], wd['zw1']])
     p2 = np.asarray([wd['xw2'], wd['yw2'], wd['zw2']])
     return p1, p2
+
+
+# === Geometry checks: endpoint snapping and model validation ===
+
+def _as_wire_table(wires):
+    '''
+    WireTable from a WireTable, a list of wire dicts or an (N, 2, 3)
+    end point array.
+    '''
+    if isinstance(wires, WireTable):
+        return wires
+    if isinstance(wires, np.ndarray):
+        return WireTable.from_endpoints(wires)
+    wires = list(wires)
+    if wires and not isinstance(wires[0], dict):
+        return WireTable.from_endpoints(wires)
+    return WireTable.from_wire_dicts(wires)
+
+
+def _default_tol(points):
+    '''
+    Snapping tolerance: 1e-6 of the model's bounding box diagonal.
+    '''
+    if len(points) == 0:
+        return 1e-9
+    points = np.asarray(points).reshape(-1, 3)
+    extent = np.linalg.norm(points.max(axis=0) - points.min(axis=0))
+    return max(1e-6*extent, 1e-9)
+
+
+def _component_labels(nnodes, a, b):
+    '''
+    Connected component labels of a graph with nnodes nodes and edges
+    (a[k], b[k]), by hooking roots and pointer jumping. Every label is
+    the smallest node number in its component.
+    '''
+    labels = np.arange(nnodes)
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    while True:
+        la = labels[a]
+        lb = labels[b]
+        hook = la != lb
+        if not np.any(hook):
+            return labels
+        # --- hang the larger root under the smaller one, then flatten ---
+        np.minimum.at(labels, np.maximum(la, lb)[hook], np.minimum(la, lb)[hook])
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+
+def snap_points(points, tol=None):
+    '''
+    Merges points closer than tol into shared nodes. Points are taken in
+    order, and each one joins the first earlier node point within tol,
+    or starts a new node. So every point is within tol of its node's
+    point, node points are more than tol apart, and a row of points
+    spaced just under tol doesn't chain into one node.
+
+    Candidate pairs come from a hashed grid of tol-sized cells and
+    leaders are assigned in one pass over them, so the cost stays near
+    linear, also for long rows of close points.
+
+     points: (..., 3) array of points
+
+     tol: snapping distance, defaults to 1e-6 of the model size
+
+    Returns (node_ids, node_points): the node number of each point,
+    shaped like points without the last axis, and a (K, 3) array with
+    the first point snapped to each node.
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    flat = points.reshape(-1, 3)
+    if tol is None:
+        tol = _default_tol(flat)
+    if len(flat) == 0:
+        return np.zeros(points.shape[:-1], dtype=np.int64), np.zeros((0, 3))
+
+    keys, strides = _cell_keys(np.floor(flat/tol).astype(np.int64), pad=1)
+    if keys is None:
+        raise UserWarning(f'Snapping tolerance {tol} is too small for '
+                          f'a model this size')
+    first, i, j = _close_point_pairs(flat, keys, strides, tol)
+
+    # --- one pass over the close pairs in point order: a point joins the
+    # first earlier point that still leads. Pairs are few once exact
+    # duplicates are merged, and a chain costs one step per link. ---
+    leader = np.arange(len(flat))
+    leads = first == leader
+    paired, pair_index = np.unique(np.concatenate([i, j]), return_inverse=True)
+    pa, pb = pair_index[:len(i)], pair_index[len(i):]
+    order = np.lexsort((pa, pb))
+    pleads = leads[paired].tolist()
+    pleader = paired.tolist()
+    for a, b in zip(pa[order].tolist(), pb[order].tolist()):
+        if pleads[a] and pleads[b]:
+            pleads[b] = False
+            pleader[b] = pleader[a]
+    leads[paired] = pleads
+    leader[paired] = pleader
+    leaders = np.flatnonzero(leads)
+    node_ids = np.searchsorted(leaders, leader)[first]
+    return node_ids.reshape(points.shape[:-1]), flat[leaders]
+
+
+def _close_point_pairs(points, keys, strides, tol):
+    '''
+    Close pairs of points, given their _cell_keys() on a grid of
+    tol-sized cells. Returns (first, i, j): the index of the first exact
+    copy of every point, and index pairs i < j of distinct (first copy)
+    points within tol of each other.
+    '''
+    n = len(points)
+    order = np.argsort(keys, kind='stable')
+    skeys = keys[order]
+    starts = np.flatnonzero(np.r_[True, skeys[1:] != skeys[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    cells = skeys[starts]
+
+    # --- exact duplicates share a cell ---
+    first = np.arange(n)
+    shared = np.repeat(counts > 1, counts)
+    if np.any(shared):
+        idx = order[shared]
+        P = points[idx]
+        idx = idx[np.lexsort((idx, P[:, 2], P[:, 1], P[:, 0]))]
+        new = np.r_[True, np.any(points[idx[1:]] != points[idx[:-1]], axis=1)]
+        first[idx] = idx[np.flatnonzero(new)][np.cumsum(new) - 1]
+
+    # --- distinct points against the same and 13 neighbor cells ---
+    distinct = first[order] == order
+    order = order[distinct]
+    skeys = skeys[distinct]
+    starts = np.flatnonzero(np.r_[True, skeys[1:] != skeys[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    cells = skeys[starts]
+    offsets = [(0, 0, 0)] + [(a, b, c) for a in (-1, 0, 1) for b in (-1, 0, 1)
+                             for c in (-1, 0, 1) if (a, b, c) > (0, 0, 0)]
+    pair_i = []
+    pair_j = []
+    for offset in offsets:
+        target = cells + np.dot(offset, strides)
+        other = np.minimum(np.searchsorted(cells, target), len(cells) - 1)
+        found = np.flatnonzero(cells[other] == target)
+        ca, cb = found, other[found]
+        npairs = counts[ca]*counts[cb]
+        cell_pair = np.repeat(np.arange(len(ca)), npairs)
+        local = np.arange(npairs.sum()) - np.repeat(np.cumsum(npairs) - npairs, npairs)
+        a = order[starts[ca][cell_pair] + local//counts[cb][cell_pair]]
+        b = order[starts[cb][cell_pair] + local % counts[cb][cell_pair]]
+        keep = np.linalg.norm(points[a] - points[b], axis=-1) <= tol
+        if offset == (0, 0, 0):
+            keep &= a < b
+        pair_i.append(np.minimum(a, b)[keep])
+        pair_j.append(np.maximum(a, b)[keep])
+    return first, np.concatenate(pair_i), np.concatenate(pair_j)
+
+
+def _cell_keys(cells, pad=0):
+    '''
+    Exact int64 keys for integer grid cells (M, 3), with room for
+    neighbors pad cells outside the occupied range.
+
+    Returns (keys, strides) so that cell + offset has key
+    key + offset @ strides, or (None, None) if the grid is too big
+    for int64 keys.
+    '''
+    if len(cells) == 0:
+        return np.zeros(0, dtype=np.int64), np.array([1, 1, 1])
+    cmin = cells.min(axis=0) - pad
+    dims = cells.max(axis=0) + pad - cmin + 1
+    if np.prod(dims.astype(np.float64)) >= 2.0**62:
+        return None, None
+    strides = np.array([dims[1]*dims[2], dims[2], 1], dtype=np.int64)
+    return (cells - cmin) @ strides, strides
+
+
+def segment_distances(p0, p1, q0, q1):
+    '''
+    Shortest distances between segments p0-p1 and q0-q1, for (M, 3)
+    arrays of segment end points.
+
+    See Ericson, Real-Time Collision Detection, 5.1.9
+    '''
+    d1 = p1 - p0
+    d2 = q1 - q0
+    r = p0 - q0
+    a = np.einsum('ij,ij->i', d1, d1)
+    e = np.einsum('ij,ij->i', d2, d2)
+    f = np.einsum('ij,ij->i', d2, r)
+    c = np.einsum('ij,ij->i', d1, r)
+    b = np.einsum('ij,ij->i', d1, d2)
+    tiny = 1e-300
+    denom = a*e - b*b
+
+    # --- closest point parameters s on p, t on q, clamped to the segments ---
+    s = np.where(denom > 1e-12*a*e, np.clip((b*f - c*e)/np.maximum(denom, tiny), 0, 1), 0.0)
+    t = (b*s + f)/np.maximum(e, tiny)
+    s = np.where(t < 0, np.clip(-c/np.maximum(a, tiny), 0, 1), s)
+    s = np.where(t > 1, np.clip((b - c)/np.maximum(a, tiny), 0, 1), s)
+    t = np.clip(t, 0, 1)
+
+    # --- zero length segments degenerate to points ---
+    q_point = e <= 1e-24*np.maximum(a, tiny)
+    p_point = a <= 1e-24*np.maximum(e, tiny)
+    s = np.where(q_point, np.clip(-c/np.maximum(a, tiny), 0, 1), s)
+    t = np.where(q_point, 0.0, t)
+    t = np.where(p_point, np.clip(f/np.maximum(e, tiny), 0, 1), t)
+    s = np.where(p_point, 0.0, s)
+    return np.linalg.norm(p0 + d1*s[:, np.newaxis] - q0 - d2*t[:, np.newaxis], axis=-1)
+
+
+def _grid_candidate_pairs(lo, hi, cell, owner=None, accept=None):
+    '''
+    Index pairs (i, j), i < j, of boxes [lo, hi] that share a cell of a
+    uniform grid with spacing cell. Every pair of overlapping boxes is
+    included. With owner, boxes are pieces of larger objects and the
+    pairs are of owner[box] values.
+
+    accept: optional function of index arrays (i, j) returning a mask of
+    pairs to keep, applied before duplicate pairs are removed
+    '''
+    if owner is None:
+        owner = np.arange(len(lo))
+    nowners = owner.max() + 1 if len(owner) else 0
+    ilo = np.floor(lo/cell).astype(np.int64)
+    dims = np.floor(hi/cell).astype(np.int64) - ilo + 1
+    counts = np.prod(dims, axis=1)
+
+    # --- one entry per (box, covered cell) ---
+    box = np.repeat(np.arange(len(lo)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    bdims = dims[box]
+    cells = ilo[box] + np.stack([local % bdims[:, 0],
+                                 local//bdims[:, 0] % bdims[:, 1],
+                                 local//(bdims[:, 0]*bdims[:, 1])], axis=-1)
+    keys = _cell_keys(cells)[0]
+    if keys is None:
+        keys = np.unique(cells, axis=0, return_inverse=True)[1].ravel()
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    obj = owner[box[order]]
+
+    # --- all pairs within each cell ---
+    n = len(keys)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    sizes = np.diff(np.r_[starts, n])
+    npartners = np.repeat(starts + sizes, sizes) - np.arange(n) - 1
+    first = np.repeat(np.arange(n), npartners)
+    second = first + 1 + np.arange(npartners.sum()) - np.repeat(np.cumsum(npartners) - npartners, npartners)
+    i = np.minimum(obj[first], obj[second])
+    j = np.maximum(obj[first], obj[second])
+    keep = i != j
+    if accept is not None:
+        keep[keep] = accept(i[keep], j[keep])
+    pairs = np.unique(i[keep]*nowners + j[keep])
+    return pairs//max(nowners, 1), pairs % max(nowners, 1)
+
+
+class GeometryReport(object):
+    '''
+    Findings from validate_wires(). Wires are identified by NEC tag and
+    segments by 1-based segment number, as in NEC output:
+
+     intersections: (K, 4) [tag_a, seg_a, tag_b, seg_b] segment pairs
+     that touch, cross or overlap (closer than the sum of their radii)
+     without a junction, with distances in intersection_distances
+
+     near_misses: same for pairs closer than near_factor times the sum
+     of their radii, like almost-coincident end points, with distances in
+     near_miss_distances
+
+     dangling_ends: (K, 2) [tag, end] wire ends (1 or 2) connected to
+     nothing. Often intended, like dipole tips, so they don't count
+     against ok.
+
+     short_segments: (K, 2) [tag, seg] segments shorter than
+     min_length_ratio radii, or shorter than wavelength/1000
+
+     long_segments: (K, 2) [tag, seg] segments longer than wavelength/10
+
+     bad_junctions: (K, 4) [tag_short, seg_short, tag_long, seg_long]
+     shortest and longest segments at junctions whose length ratio
+     exceeds max_junction_ratio, with ratios in junction_ratios
+    '''
+    findings = ['intersections', 'near_misses', 'dangling_ends',
+                'short_segments', 'long_segments', 'bad_junctions']
+
+    def __init__(self, **results):
+        for name, value in results.items():
+            setattr(self, name, value)
+
+    @property
+    def ok(self):
+        '''
+        True if nothing but dangling ends was found.
+        '''
+        return all(len(getattr(self, name)) == 0 for name in self.findings
+                   if name != 'dangling_ends')
+
+    def summary(self):
+        '''
+        Returns a one line per finding type summary string.
+        '''
+        return '\n'.join(f'{name}: {len(getattr(self, name))}'
+                         for name in self.findings)
+
+    def __repr__(self):
+        return f'GeometryReport(ok={self.ok})\n{self.summary()}'
+
+
+def validate_wires(wires, tol=None, near_factor=3.0, min_length_ratio=2.0,
+                   max_junction_ratio=5.0, wavelength=None, ground_z=None):
+    '''
+    Checks a wire model for geometry NEC handles badly. Segments are
+    placed in a uniform grid spatial index, so only segments sharing a
+    grid cell are compared and the cost grows about as N log N in the
+    number of segments N, not N^2.
+
+     wires: WireTable, list of wire dicts as from
+     WireInput.return_wire_dicts(), or (N, 2, 3) end point array
+
+     tol: end point snapping distance for junctions, see snap_points()
+
+     near_factor: segment pairs closer than near_factor times the sum
+     of their radii are near misses
+
+     min_length_ratio: minimum segment length in wire radii
+
+     max_junction_ratio: maximum length ratio of segments at a junction
+
+     wavelength: optional, enables the wavelength/10 and wavelength/1000
+     segment length rules
+
+     ground_z: optional ground height, wire ends within tol of it are
+     grounded rather than dangling
+
+    Returns a GeometryReport.
+    '''
+    table = _as_wire_table(wires)
+    segs = table.segments()
+    tags = table['tag_id'][segs['wire']]
+    segnums = segs['index'] + 1
+    ends = np.stack([segs['start'], segs['end']], axis=1)
+    if tol is None:
+        tol = _default_tol(ends)
+    nodes = snap_points(ends, tol)[0]
+    lengths = segs['length']
+    radii = segs['radius']
+    nsegs = len(lengths)
+
+    def segment_ids(index):
+        return np.stack([tags[index], segnums[index]], axis=-1).reshape(-1, 2)
+
+    # --- segmentation rules ---
+    short = lengths < min_length_ratio*radii
+    long = np.zeros(nsegs, dtype=bool)
+    if wavelength is not None:
+        short |= lengths < wavelength/1000
+        long = lengths > wavelength/10
+
+    # --- dangling wire ends: the only segment end at their node ---
+    degree = np.bincount(nodes.ravel(), minlength=1)
+    wire_start = segs['index'] == 0
+    wire_end = segs['index'] == table['segment_count'][segs['wire']] - 1
+    dangling = []
+    for end, at_end in [(0, wire_start), (1, wire_end)]:
+        free = at_end & (degree[nodes[:, end]] == 1)
+        if ground_z is not None:
+            free &= np.abs(ends[:, end, 2] - ground_z) > tol
+        index = np.flatnonzero(free)
+        dangling.append(np.stack([tags[index], np.full(len(index), end + 1)], axis=-1))
+    dangling = np.concatenate(dangling).reshape(-1, 2)
+
+    # --- junction length ratios: shortest and longest segment at each node ---
+    end_nodes = nodes.ravel()
+    end_segs = np.repeat(np.arange(nsegs), 2)
+    order = np.lexsort((lengths[end_segs], end_nodes))
+    end_nodes = end_nodes[order]
+    end_segs = end_segs[order]
+    starts = np.flatnonzero(np.r_[True, end_nodes[1:] != end_nodes[:-1]])
+    stops = np.r_[starts[1:], len(end_nodes)] - 1
+    shortest = end_segs[starts]
+    longest = end_segs[stops]
+    ratios = lengths[longest]/np.maximum(lengths[shortest], 1e-300)
+    bad = (stops > starts) & (ratios > max_junction_ratio)
+
+    # --- candidate segment pairs from the spatial index ---
+    # --- long segments are split into cell-sized pieces, ~8 per segment ---
+    margin = near_factor*np.max(radii, initial=0.0)
+    cell = max(np.sum(lengths)/(8*max(nsegs, 1)), 2*margin, tol)
+    npieces = np.maximum(1, np.ceil(lengths/cell)).astype(np.int64)
+    owner = np.repeat(np.arange(nsegs), npieces)
+    k = np.arange(npieces.sum()) - np.repeat(np.cumsum(npieces) - npieces, npieces)
+    span = (segs['end'] - segs['start'])[owner]
+    a = segs['start'][owner] + span*(k/npieces[owner])[:, np.newaxis]
+    b = segs['start'][owner] + span*((k + 1)/npieces[owner])[:, np.newaxis]
+
+    def accept(i, j):
+        # --- same-wire pairs and pairs meeting at a junction are fine ---
+        keep = segs['wire'][i] != segs['wire'][j]
+        for ei in range(2):
+            for ej in range(2):
+                keep &= nodes[i, ei] != nodes[j, ej]
+        return keep
+
+    i, j = _grid_candidate_pairs(np.minimum(a, b) - margin,
+                                 np.maximum(a, b) + margin, cell, owner,
+                                 accept)
+    dist = segment_distances(segs['start'][i], segs['end'][i],
+                             segs['start'][j], segs['end'][j])
+    rsum = radii[i] + radii[j]
+    hit = dist < rsum
+    near = ~hit & (dist < near_factor*rsum)
+
+    def pair_ids(mask):
+        return np.hstack([segment_ids(i[mask]), segment_ids(j[mask])])
+
+    return GeometryReport(intersections=pair_ids(hit),
+                          intersection_distances=dist[hit],
+                          near_misses=pair_ids(near),
+                          near_miss_distances=dist[near],
+                          dangling_ends=dangling,
+                          short_segments=segment_ids(np.flatnonzero(short)),
+                          long_segments=segment_ids(np.flatnonzero(long)),
+                          bad_junctions=np.hstack([segment_ids(shortest[bad]),
+                                                   segment_ids(longest[bad])]),
+                          junction_ratios=ratios[bad])
+
+
+# === Wire connectivity graph ===
+
+class WireGraph(object):
+    '''
+    Connectivity of a wire model, built by wire_graph().
+
+    Nodes are snapped wire end points and every wire is an edge between
+    its two end nodes. Everything is stored in flat arrays:
+
+     nodes: (K, 3) node points
+
+     wire_nodes: (N, 2) node number of each wire's ends
+
+     degree: (K,) number of wire ends at each node
+
+     indptr, node_wires: compressed adjacency, the row indices of the
+     wires with an end at node k are node_wires[indptr[k]:indptr[k+1]]
+
+     ground_nodes: boolean (K,) mask of nodes on the ground plane
+
+     component: (N,) connected component number of each wire, numbered
+     0, 1, 2, ... in order of first appearance
+
+    Only wire ends are connected. Ends touching another wire between
+    its ends are not joined, as in NEC, see validate_wires().
+    '''
+
+    def __init__(self, tags, nodes, wire_nodes, ground_nodes,
+                 ground_connects=False):
+        self.tags = tags
+        self.nodes = nodes
+        self.wire_nodes = wire_nodes
+        self.ground_nodes = ground_nodes
+        nnodes = len(nodes)
+        ends = wire_nodes.ravel()
+        self.degree = np.bincount(ends, minlength=nnodes)
+        self.indptr = np.r_[0, np.cumsum(self.degree)]
+        self.node_wires = np.argsort(ends, kind='stable')//2
+
+        # --- components of the node graph, optionally joined through ground ---
+        a, b = wire_nodes[:, 0], wire_nodes[:, 1]
+        grounded = np.flatnonzero(ground_nodes)
+        if ground_connects and len(grounded) > 1:
+            a = np.r_[a, np.full(len(grounded) - 1, grounded[0])]
+            b = np.r_[b, grounded[1:]]
+        labels = _component_labels(nnodes, a, b)[wire_nodes[:, 0]]
+        first = np.unique(labels, return_index=True)[1]
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first)] = np.arange(len(first))
+        self.component = rank[np.unique(labels, return_inverse=True)[1].ravel()]
+
+    @property
+    def ncomponents(self):
+        '''
+        Number of connected components.
+        '''
+        return int(self.component.max()) + 1 if len(self.component) else 0
+
+    def wires_at(self, node):
+        '''
+        Row indices of the wires with an end at node.
+        '''
+        return self.node_wires[self.indptr[node]:self.indptr[node + 1]]
+
+    @property
+    def junctions(self):
+        '''
+        Node numbers where two or more wire ends meet.
+        '''
+        return np.flatnonzero(self.degree >= 2)
+
+    @property
+    def free_ends(self):
+        '''
+        Node numbers of unconnected wire ends that aren't grounded.
+        '''
+        return np.flatnonzero((self.degree == 1) & ~self.ground_nodes)
+
+    @property
+    def grounded_wires(self):
+        '''
+        Row indices of wires with an end on the ground plane.
+        '''
+        return np.flatnonzero(np.any(self.ground_nodes[self.wire_nodes], axis=1))
+
+    def neighbors(self, wire):
+        '''
+        Row indices of the wires sharing an end node with wire.
+        '''
+        touching = np.concatenate([self.wires_at(node)
+                                   for node in self.wire_nodes[wire]])
+        return np.setdiff1d(touching, [wire])
+
+    def connections(self):
+        '''
+        (M, 2) array of row index pairs of wires that share a node.
+        '''
+        pairs = []
+        for size in np.unique(self.degree[self.degree >= 2]):
+            nodes = np.flatnonzero(self.degree == size)
+            groups = self.node_wires[self.indptr[nodes][:, np.newaxis] + np.arange(size)]
+            i, j = np.triu_indices(size, 1)
+            pairs.append(np.stack([groups[:, i].ravel(), groups[:, j].ravel()], axis=-1))
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.unique(np.sort(np.concatenate(pairs), axis=1), axis=0)
+
+    def component_tags(self):
+        '''
+        Returns a list with the tags of the wires in each component.
+        '''
+        order = np.argsort(self.component, kind='stable')
+        splits = np.flatnonzero(np.diff(self.component[order])) + 1
+        return np.split(self.tags[order], splits)
+
+
+def wire_graph(wires, tol=None, ground_z=None, ground_connects=False):
+    '''
+    Builds the connectivity graph of a wire model by snapping wire end
+    points together on a hashed grid, see snap_points(). Ends join a
+    junction only within tol of its first end, so a row of close but
+    separate ends doesn't merge into one junction. The cost is near
+    linear in the number of wires, so it can run after every edit.
+
+     wires: WireTable, list of wire dicts or (N, 2, 3) end point array
+
+     tol: snapping distance, defaults to 1e-6 of the model size
+
+     ground_z: optional ground height, ends within tol of it are grounded
+
+     ground_connects: if True, wires grounded at different points are
+     in the same component
+
+    Returns a WireGraph.
+    '''
+    table = _as_wire_table(wires)
+    P = table.endpoints
+    wire_nodes, nodes = snap_points(P, tol)
+    if tol is None:
+        tol = _default_tol(P)
+    ground_nodes = np.zeros(len(nodes), dtype=bool)
+    if ground_z is not None:
+        ground_nodes = np.abs(nodes[:, 2] - ground_z) <= tol
+    return WireGraph(table['tag_id'].copy(), nodes, wire_nodes.reshape(-1, 2),
+                     ground_nodes, ground_connects)
+
+
+# === EZNEC and NEC-2 file input and output ===
+
+# --- meters per EZNEC length unit, wavelengths are handled separately ---
+_EZNEC_units = {'m': 1.0, 'mm': 1e-3, 'cm': 1e-2, 'ft': 0.3048, 'in': 0.0254,
+                'wl': None}
+_EZNEC_unit_names = {'meters': 'm', 'meter': 'm', 'millimeters': 'mm',
+                     'centimeters': 'cm', 'feet': 'ft', 'foot': 'ft',
+                     'inches': 'in', 'inch': 'in', 'wavelengths': 'wl',
+                     'wavelength': 'wl', 'w': 'wl'}
+_EZNEC_alpha_token = re.compile(r'(?<![\w.#+-])[A-Za-z][A-Za-z0-9]*')
+_EZNEC_gauge_token = re.compile(r'#\s*(\d+)')
+_EZNEC_wavelength = re.compile(r'Wavelength\s*=\s*([0-9.eE+-]+)\s*(\w+)')
+
+
+def _read_source(source):
+    '''
+    Text of a path, file object (text or binary), bytes or str content.
+    A str is a path unless it contains a line break.
+    '''
+    if hasattr(source, 'read'):
+        data = source.read()
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    elif isinstance(source, str) and '\n' in source:
+        data = source
+    else:
+        with open(source, 'rb') as srcf:
+            data = srcf.read()
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', errors='replace')
+    return data
+
+
+def _EZNEC_unit(token):
+    '''
+    Normalized EZNEC unit name for a units token like 'm', 'ft' or 'Wavelengths'.
+    '''
+    unit = token.strip().lower().rstrip('.')
+    unit = _EZNEC_unit_names.get(unit, unit)
+    if unit not in _EZNEC_units:
+        emsg = f'Unknown EZNEC units "{token}". Supported: {list(_EZNEC_units)}'
+        raise UserWarning(emsg)
+    return unit
+
+
+def _unit_scale(unit, wavelength):
+    '''
+    Meters per unit, using wavelength (m) for 'wl'.
+    '''
+    if unit == 'wl':
+        if not wavelength:
+            raise UserWarning('EZNEC file is in wavelengths, supply wavelength in meters')
+        return wavelength
+    return _EZNEC_units[unit]
+
+
+def _EZNEC_number_rows(lines, dia_unit):
+    '''
+    Tokenizes EZNEC wire data lines into a 2D float array, one row per
+    line, padded with NaN. Connection tokens like W2E1 or GND are
+    dropped and #12 style AWG wire gauges become diameters in dia_unit.
+    '''
+    block = '\n'.join(lines)
+    block = _EZNEC_alpha_token.sub(' ', block)
+    if '#' in block:
+        mm_per_unit = _unit_scale(dia_unit, 1.0)*1000
+        block = _EZNEC_gauge_token.sub(
+            lambda match: repr(0.127*92**((36 - int(match.group(1)))/39)/mm_per_unit),
+            block)
+    rows = block.replace(',', ' ').split('\n')
+    counts = np.array([len(row.split()) for row in rows])
+    values = np.array(' '.join(rows).split(), dtype=np.float64)
+    ncols = counts.max(initial=0)
+    if np.all(counts == ncols):
+        return values.reshape(len(rows), ncols)
+
+    # --- ragged rows: scatter into a NaN padded array ---
+    table = np.full((len(rows), ncols), np.nan)
+    rowix = np.repeat(np.arange(len(rows)), counts)
+    colix = np.arange(len(values)) - np.repeat(np.cumsum(counts) - counts, counts)
+    table[rowix, colix] = values
+    return table
+
+
+def read_EZNEC_wires(source, wavelength=None, round=None):
+    '''
+    Parses EZNEC wires from a path, file object, bytes or str, without
+    any widgets, and returns a WireTable in meters.
+
+    Two layouts are understood:
+
+     * EZNEC's wire description text, with a header line like
+       'Wire Conn.--- End 1 (x,y,z : ft) ... Dia(in) Segs ...' followed by
+       rows of wire number, end 1, end 2, diameter, segments and optional
+       insulation. Connection tokens (W2E1, GND) are ignored, see
+       wire_graph() for connectivity.
+
+     * EZNEC's ASCII wire import format, as written by
+       WireInput.get_EZNEC_wirestr(): a first line of length and
+       optional diameter units (like 'm mm' or 'ft in'), then rows of
+       x1, y1, z1, x2, y2, z2, diameter and optional segments.
+
+    Units may be m, mm, cm, ft, in or wl (wavelengths). Files in
+    wavelengths need wavelength in meters, unless the description
+    text states it.
+
+     round: optional number of decimals to round coordinates to
+    '''
+    text = _read_source(source)
+    lines = text.splitlines()
+    header = next((n for n, line in enumerate(lines)
+                   if 'end 1' in line.lower() and ':' in line), None)
+
+    if header is not None:
+        # --- wire description text ---
+        units = re.findall(r':\s*([A-Za-z]+)\s*\)', lines[header])
+        unit = _EZNEC_unit(units[0]) if units else 'm'
+        dia = re.search(r'Dia[a-z]*\s*\(\s*([A-Za-z]+)\s*\)', lines[header])
+        dia_unit = _EZNEC_unit(dia.group(1)) if dia else 'mm'
+        stated = _EZNEC_wavelength.search(text)
+        if wavelength is None and stated:
+            wavelength = float(stated.group(1))*_unit_scale(_EZNEC_unit(stated.group(2)), None)
+
+        rows = []
+        for line in lines[header + 1:]:
+            tokens = line.split(None, 1)
+            if not tokens:
+                if rows:
+                    break
+                continue
+            if tokens[0].isdigit():
+                rows.append(line)
+            elif rows:
+                break
+        data = _EZNEC_number_rows(rows, dia_unit)
+        columns = {'tag_id': data[:, 0].astype(np.int64),
+                   'segment_count': data[:, 8].astype(np.int64)}
+        coords = data[:, 1:7]
+        diam = data[:, 7]
+    else:
+        # --- ASCII wire import format ---
+        lines = [line for line in lines if line.strip()]
+        unit_tokens = lines[0].replace(',', ' ').split()
+        unit = _EZNEC_unit(unit_tokens[0])
+        dia_unit = _EZNEC_unit(unit_tokens[1]) if len(unit_tokens) > 1 else unit
+        data = _EZNEC_number_rows(lines[1:], dia_unit)
+        columns = {}
+        if data.shape[1] > 7:
+            segs = data[:, 7]
+            columns['segment_count'] = np.where(np.isnan(segs), WireTable.defaults['segment_count'], segs).astype(np.int64)
+        coords = data[:, :6]
+        diam = data[:, 6]
+
+    coords = coords*_unit_scale(unit, wavelength)
+    rad = diam*_unit_scale(dia_unit, wavelength)/2
+    if round:
+        coords = np.round(coords, decimals=round)
+    endpoints = coords.reshape(-1, 2, 3)
+    return WireTable.from_endpoints(endpoints, rad=rad, **columns)
+
+
+def url_cache(directory, max_bytes=2**28):
+    '''
+    Returns a size-bounded LRU cache of downloaded files in directory
+    for fetch_urls().
+    '''
+    return dkc.DiskLRUCache(directory, max_bytes=max_bytes, suffix='.url')
+
+
+class _ConnectionPool(threading.local):
+    '''
+    Per-thread keep-alive HTTP(S) connections, keyed by scheme and host,
+    so each worker thread reuses its connections across requests.
+    '''
+
+    def __init__(self, timeout, opened):
+        self.timeout = timeout
+        self.opened = opened
+        self.connections = {}
+
+    def connection(self, scheme, netloc, fresh=False):
+        key = (scheme, netloc)
+        if fresh or key not in self.connections:
+            if key in self.connections:
+                self.connections[key].close()
+            conn_class = (http.client.HTTPSConnection if scheme == 'https'
+                          else http.client.HTTPConnection)
+            self.connections[key] = conn_class(netloc, timeout=self.timeout)
+            self.opened.append(self.connections[key])
+        return self.connections[key]
+
+
+def _http_get(pool, url, headers, redirects=5):
+    '''
+    GETs url on a pooled connection, following redirects.
+    Returns (final url, status, response headers, body).
+    '''
+    parts = urlparse.urlsplit(url)
+    if parts.scheme not in ['http', 'https']:
+        with urlrq.urlopen(url, timeout=pool.timeout) as urf:
+            return url, 200, urf.headers, urf.read()
+
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    for fresh in [False, True]:
+        conn = pool.connection(parts.scheme, parts.netloc, fresh=fresh)
+        try:
+            conn.request('GET', path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+            break
+        except (http.client.HTTPException, ConnectionError):
+            # --- the server closed a kept-alive connection, retry on a new one ---
+            if fresh:
+                raise
+
+    if resp.status in [301, 302, 303, 307, 308] and redirects > 0:
+        location = urlparse.urljoin(url, resp.getheader('Location'))
+        return _http_get(pool, location, headers, redirects - 1)
+    return url, resp.status, resp.headers, body
+
+
+def _fetch_cached(pool, url, cache, lock, max_age, offline):
+    '''
+    Returns the body of url for fetch_urls(), from the cache when fresh,
+    revalidated with ETag/Last-Modified when stale, or from the network.
+    '''
+    key = dkc.digest('url', url)
+    meta_key = dkc.digest('url-meta', url)
+    body = meta = None
+    if cache is not None:
+        with lock:
+            body = cache.get(key)
+            meta = cache.get(meta_key) if body is not None else None
+        meta = json.loads(meta) if meta else None
+        if body is not None:
+            fresh = (max_age is not None and meta is not None and
+                     time.time() - meta['fetched'] < max_age)
+            if offline or fresh:
+                return body
+    if offline:
+        raise UserWarning(f'{url} is not in the cache and offline=True')
+
+    headers = {}
+    if body is not None and meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        final_url, status, resp_headers, new_body = _http_get(pool, url, headers)
+    except (OSError, http.client.HTTPException):
+        if body is not None:
+            return body  # --- stale, but the server can't be reached ---
+        raise
+
+    if status == 304 and body is not None:
+        new_body = body
+    elif status >= 400:
+        raise urlrq.HTTPError(url, status, f'HTTP {status}', resp_headers, None)
+
+    if cache is not None:
+        meta = {'url': url, 'fetched': time.time(),
+                'etag': resp_headers.get('ETag') if status != 304 else meta.get('etag'),
+                'last_modified': (resp_headers.get('Last-Modified') if status != 304
+                                  else meta.get('last_modified'))}
+        with lock:
+            if status != 304:
+                cache.put(key, new_body)
+            cache.put(meta_key, json.dumps(meta).encode())
+    return new_body
+
+
+def fetch_urls(urls, cache=None, max_workers=8, max_age=3600.0,
+               offline=False, timeout=30.0):
+    '''
+    Downloads many URLs concurrently on a thread pool, and returns
+    their contents as a list of bytes in the order of urls.
+
+    Each worker thread keeps its HTTP connections alive and reuses them,
+    so fetching many files from one server costs a few connections.
+
+     cache: optional directory or diskcache.DiskLRUCache of downloads,
+     see url_cache(). Cached files younger than max_age seconds are used
+     without contacting the server. Older ones are revalidated with
+     If-None-Match/If-Modified-Since and reused on a 304 reply. When the
+     server can't be reached, cached files are used anyway.
+
+     max_workers: number of concurrent downloads
+
+     max_age: freshness time in seconds, None always revalidates
+
+     offline: only use the cache, never the network
+
+     timeout: connection timeout in seconds
+    '''
+    if cache is not None and not isinstance(cache, dkc.DiskLRUCache):
+        cache = url_cache(cache)
+    urls = list(urls)
+    opened = []
+    pool = _ConnectionPool(timeout, opened)
+    lock = threading.Lock()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda url: _fetch_cached(pool, url, cache, lock,
+                                                               max_age, offline), urls))
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+def read_EZNEC_wires_from_URLs(urls, wavelength=None, round=None,
+                               **fetch_options):
+    '''
+    Fetches EZNEC wire files with fetch_urls() and parses them with
+    read_EZNEC_wires(). Returns a list of WireTables in the order of urls.
+
+    Accepts fetch_urls() keyword options like cache and max_workers.
+    '''
+    return [read_EZNEC_wires(data, wavelength=wavelength, round=round)
+            for data in fetch_urls(urls, **fetch_options)]
+
+
+def _text_target(target):
+    '''
+    Context manager yielding a writable text file object for a path or
+    an already open file object (which is left open).
+    '''
+    if hasattr(target, 'write'):
+        return contextlib.nullcontext(target)
+    return open(target, 'w')
+
+
+def _write_rows(outf, rowfmt, columns, chunk_rows=8192, extra=None):
+    '''
+    Writes one line per row of the equal length arrays in columns,
+    formatted with the printf-style rowfmt. Each chunk of rows is
+    formatted with a single % operation, so memory use stays constant.
+
+    extra: optional (rowfmt, columns, mask) for rows needing a longer
+    line: rows where mask is True use the extra format and values.
+    '''
+    nrows = len(columns[0]) if columns else 0
+    for start in range(0, nrows, chunk_rows):
+        sl = slice(start, start + chunk_rows)
+        values = np.column_stack([np.asarray(col[sl], dtype=float)
+                                  for col in columns])
+        if extra is None or not np.any(extra[2][sl]):
+            outf.write((rowfmt*len(values)) % tuple(values.ravel().tolist()))
+            continue
+        # --- mixed chunk: pad every row to the long format and drop
+        # --- the extra values of the rows that don't use them ---
+        extra_fmt, extra_columns, mask = extra
+        mask = np.asarray(mask[sl], dtype=bool)
+        long_values = np.column_stack([values] + [np.asarray(col[sl], dtype=float)
+                                                  for col in extra_columns])
+        keep = np.ones(long_values.shape, dtype=bool)
+        keep[~mask, values.shape[1]:] = False
+        fmt = ''.join(np.where(mask, rowfmt + extra_fmt, rowfmt).tolist())
+        outf.write(fmt % tuple(long_values[keep].tolist()))
+
+
+def write_EZNEC_wires(target, wires, chunk_rows=8192):
+    '''
+    Streams wires in EZNEC's ASCII wire import format ("m mm" units,
+    end point coordinates and diameter on each line) to a text file
+    object or path.
+
+    wires is a WireTable, a list of wire dicts or an (N, 2, 3) array of
+    end points, see read_EZNEC_wires() for the reverse.
+    '''
+    table = _as_wire_table(wires)
+    columns = [table[col] for col in sum(WireTable.point_columns, [])]
+    columns.append(2000*table['rad'])
+    with _text_target(target) as outf:
+        outf.write('m mm\n')
+        _write_rows(outf, ', '.join(['%14.12f']*7) + '\n', columns,
+                    chunk_rows=chunk_rows)
+
+
+def _card_list(cards, packer):
+    '''
+    List of packed argument lists from one or several packed lists or
+    keyword dicts for packer, like the ones from read_NEC_deck().
+    '''
+    if cards is None:
+        return []
+    if isinstance(cards, dict):
+        cards = [cards]
+    cards = list(cards)
+    if cards and not isinstance(cards[0], (list, tuple, np.ndarray, dict)):
+        cards = [cards]
+    return [packer(**card) if isinstance(card, dict) else card for card in cards]
+
+
+def _card_line(name, ints, floats):
+    '''
+    One NEC-2 card in free format from its integer and float fields.
+    '''
+    fields = [f'{int(i):d}' for i in ints] + [f'{float(f):.10g}' for f in floats]
+    return ' '.join([name] + fields) + '\n'
+
+
+def write_NEC_deck(target, wires, comments=None, gpflag=0, gn=None,
+                   ex=None, ld=None, fr=None, ne=None, nh=None, rp=None,
+                   chunk_rows=8192):
+    '''
+    Streams a NEC-2 card deck to a text file object or path.
+
+    Wires become GW cards (tapered wires are followed by a GC card), and
+    the other cards are given as the argument lists returned by the
+    pack_*_card_args() functions, in the order PyNEC takes them, or as
+    their keyword dicts like read_NEC_deck() returns:
+
+     wires: a WireTable, a list of wire dicts or an (N, 2, 3) array
+
+     comments: string or list of strings for CM cards
+
+     gpflag: the geometry_complete() ground plane flag for the GE card
+
+     gn: pack_gn_card_args() output
+
+     ex, ld: one or a list of pack_ex_card_args() / pack_ld_card_args() outputs
+
+     fr: fr_card() arguments [ifrq, nfrq, freq_mhz, del_freq]
+
+     ne, nh: one or a list of pack_nearfield_card_args() outputs
+
+     rp: one or a list of pack_rp_card_args() outputs
+    '''
+    table = _as_wire_table(wires)
+    if isinstance(comments, str):
+        comments = comments.splitlines()
+    gw_columns = ([table['tag_id'], table['segment_count']] +
+                  [table[col] for col in sum(WireTable.point_columns, [])])
+
+    # --- tapered wires get RAD = 0 on the GW card and a GC card ---
+    tapered = (table['rdel'] != 1.0) | (table['rrad'] != 1.0)
+    gw_rad = np.where(tapered, 0.0, table['rad'])
+    last_rad = table['rad']*table['rrad']**np.maximum(table['segment_count'] - 1, 0)
+    gc_columns = [table['rdel'], table['rad'], last_rad]
+
+    with _text_target(target) as outf:
+        for line in (comments or []):
+            outf.write(f'CM {line}\n')
+        outf.write('CE\n')
+        _write_rows(outf, 'GW %d %d' + ' %.10g'*7 + '\n', gw_columns + [gw_rad],
+                    chunk_rows=chunk_rows,
+                    extra=('GC 0 0' + ' %.10g'*3 + '\n', gc_columns, tapered))
+        outf.write(_card_line('GE', [gpflag], []))
+        for args in _card_list(gn, pack_gn_card_args):
+            outf.write(_card_line('GN', list(args[:2]) + [0, 0], args[2:]))
+        for args in _card_list(ld, pack_ld_card_args):
+            outf.write(_card_line('LD', args[:4], args[4:]))
+        for args in _card_list(ex, pack_ex_card_args):
+            outf.write(_card_line('EX', args[:4], args[4:]))
+        if fr is not None:
+            outf.write(_card_line('FR', list(fr[:2]) + [0, 0], fr[2:]))
+        for name, cards in [('NE', ne), ('NH', nh)]:
+            for args in _card_list(cards, pack_nearfield_card_args):
+                outf.write(_card_line(name, args[:4], args[4:]))
+        for args in _card_list(rp, pack_rp_card_args):
+            xnda = 1000*args[3] + 100*args[4] + 10*args[5] + args[6]
+            outf.write(_card_line('RP', list(args[:3]) + [xnda], args[7:]))
+        outf.write('EN\n')
+
+
+_NEC_separator = re.compile(r'[\s,]+')
+
+_NEC_ex_types = {0: 'voltage', 1: 'linear_wave', 2: 'r_circ_wave',
+                 3: 'l_circ_wave', 4: 'current', 5: 'voltage_disc'}
+_NEC_ld_types = {-1: 'none', 0: 'series_RLC_lump', 1: 'parallel_RLC_lump',
+                 2: 'series_dist', 3: 'parallel_dist', 4: 'load_Z',
+                 5: 'wire_conductivity'}
+_NEC_ld_values = {'series_RLC_lump': ['R', 'L', 'C'],
+                  'parallel_RLC_lump': ['R', 'L', 'C'],
+                  'series_dist': ['R_per_meter', 'L_per_meter', 'C_per_meter'],
+                  'parallel_dist': ['R_per_meter', 'L_per_meter', 'C_per_meter'],
+                  'load_Z': ['R', 'X'],
+                  'wire_conductivity': ['wire_sigma'],
+                  'none': []}
+_NEC_gn_types = {1: 'perfect', -1: 'free_space', 2: 'real_SN', 0: 'real_refl'}
+_NEC_geometry_cards = ['GA', 'GH', 'GM', 'GR', 'GC', 'GS']
+
+
+def _NEC_fields(text, nfields):
+    '''
+    nfields floats from the free-format fields of a card, missing
+    trailing fields are zero.
+    '''
+    tokens = [tok for tok in _NEC_separator.split(text.strip()) if tok]
+    values = [float(tok) for tok in tokens[:nfields]]
+    return values + [0.0]*(nfields - len(values))
+
+
+def _NEC_gw_table(lines):
+    '''
+    WireTable from the field text of a run of GW cards, converted in one
+    NumPy call when every card has the 9 fields ITG NS XW1..ZW2 RAD.
+    '''
+    # --- a ';' after every card checks the field count of each one ---
+    tokens = _NEC_separator.split(' ; '.join(lines).strip() + ' ;')
+    if len(tokens) == 10*len(lines) and tokens[9::10].count(';') == len(lines):
+        del tokens[9::10]
+        values = np.array(tokens, dtype=float).reshape(-1, 9)
+    else:
+        values = np.array([_NEC_fields(line, 9) for line in lines])
+    return WireTable.from_columns(
+        tag_id=values[:, 0].astype(np.int64),
+        segment_count=values[:, 1].astype(np.int64),
+        **{name: values[:, 2 + n] for n, name in
+           enumerate(sum(WireTable.point_columns, []) + ['rad'])})
+
+
+def _NEC_curve_table(tag, points, rad):
+    '''
+    WireTable of one-segment wires sharing tag along a polyline of
+    points, the way NEC segments GA arcs and GH helices.
+    '''
+    endpoints = np.stack([points[:-1], points[1:]], axis=1)
+    return WireTable.from_endpoints(endpoints, tag_id=tag, segment_count=1, rad=rad)
+
+
+def _NEC_arc(fields):
+    '''
+    GA ITG NS RADA ANG1 ANG2 RAD: arc of radius RADA in the XZ plane.
+    '''
+    tag, nseg, rada, ang1, ang2, rad = fields
+    theta = np.deg2rad(np.linspace(ang1, ang2, int(nseg) + 1))
+    points = rada*np.column_stack([np.cos(theta), np.zeros_like(theta), np.sin(theta)])
+    return _NEC_curve_table(int(tag), points, rad)
+
+
+def _NEC_helix(fields):
+    '''
+    GH ITG NS S HL A1 B1 A2 B2 RAD: NEC-2 helix along z with turn spacing
+    S and length HL (negative HL for left-handed), radii A in x and B in
+    y tapering from A1, B1 at z = 0 to A2, B2 at z = |HL|.
+    '''
+    tag, nseg, spacing, hlength, a1, b1, a2, b2, rad = fields
+    frac = np.linspace(0.0, 1.0, int(nseg) + 1)
+    z = abs(hlength)*frac
+    theta = np.sign(hlength or 1.0)*2*np.pi*z/spacing
+    points = np.column_stack([(a1 + (a2 - a1)*frac)*np.cos(theta),
+                              (b1 + (b2 - b1)*frac)*np.sin(theta), z])
+    return _NEC_curve_table(int(tag), points, rad)
+
+
+def _NEC_copies(table, tag_increment, ncopies, matrix, start_tag=0):
+    '''
+    GM and GR: appends ncopies copies of the wires with tag >= start_tag,
+    each transformed by matrix once more than the last, with nonzero
+    tags incremented by tag_increment per copy. ncopies = 0 moves the
+    wires in place instead.
+    '''
+    rows = np.flatnonzero(table['tag_id'] >= start_tag) if start_tag > 0 else slice(None)
+    endpoints = table.endpoints[rows]
+    tags = table['tag_id'][rows]
+    if ncopies == 0:
+        moved = table.endpoints
+        moved[rows] = apply_transform(endpoints, matrix)
+        table.endpoints = moved
+        table['tag_id'][rows] = np.where(tags > 0, tags + tag_increment, 0)
+        return
+    base = WireTable.from_columns(**{name: table[name][rows] for name in table.columns})
+    M = np.eye(4)
+    for k in range(1, ncopies + 1):
+        M = matrix @ M
+        copy = base.copy()
+        copy.endpoints = apply_transform(endpoints, M)
+        copy['tag_id'][:] = np.where(tags > 0, tags + k*tag_increment, 0)
+        table.extend(copy)
+
+
+def _NEC_geometry(table, card, fields):
+    '''
+    Applies a GA, GH, GM, GR, GC or GS card to the wires read so far.
+    '''
+    if card == 'GA':
+        table.extend(_NEC_arc(_NEC_fields(fields, 6)))
+    elif card == 'GH':
+        table.extend(_NEC_helix(_NEC_fields(fields, 9)))
+    elif card == 'GM':
+        itgi, nrpt, rox, roy, roz, xs, ys, zs, its = _NEC_fields(fields, 9)
+        M = compose_transforms(rotation_matrix(rox, 'x'), rotation_matrix(roy, 'y'),
+                               rotation_matrix(roz, 'z'), translation_matrix([xs, ys, zs]))
+        _NEC_copies(table, int(itgi), int(nrpt), M, start_tag=int(its))
+    elif card == 'GR':
+        itgi, nrpt = _NEC_fields(fields, 2)
+        _NEC_copies(table, int(itgi), int(nrpt) - 1, rotation_matrix(360.0/nrpt, 'z'))
+    elif card == 'GC' and len(table):
+        rdel, rad1, rad2 = _NEC_fields(fields, 5)[2:]
+        last = len(table) - 1
+        nseg = table['segment_count'][last]
+        table['rdel'][last] = rdel
+        table['rad'][last] = rad1
+        table['rrad'][last] = (rad2/rad1)**(1.0/(nseg - 1)) if nseg > 1 and rad1 else 1.0
+    elif card == 'GS':
+        scale = _NEC_fields(fields, 3)[2]
+        table.endpoints = scale*table.endpoints
+        table['rad'] *= scale
+
+
+def read_NEC_deck(source):
+    '''
+    Reads a NEC-2 card deck from a path, file object, bytes or str content
+    in one pass over its free-format (space or comma separated) cards.
+
+    Returns a dict whose keys match the arguments of write_NEC_deck():
+
+     wires: WireTable of the GW cards, with GA arcs and GH helices as runs
+     of one-segment wires sharing a tag, GC tapers, GM/GR copies and
+     GS scaling applied
+
+     comments: list of CM/CE card text
+
+     gpflag: GE card ground flag
+
+     gn: pack_gn_card_args() keyword dict, or None
+
+     ex, ld, ne, nh, rp: lists of keyword dicts for pack_ex_card_args(),
+     pack_ld_card_args(), pack_nearfield_card_args() and pack_rp_card_args()
+
+     fr: fr_card() argument list [ifrq, nfrq, freq_mhz, del_freq], or None
+
+    Reading stops at EN. Other cards are skipped with a message.
+    '''
+    deck = {'wires': WireTable(), 'comments': [], 'gpflag': 0, 'gn': None,
+            'ex': [], 'ld': [], 'fr': None, 'ne': [], 'nh': [], 'rp': []}
+    table = deck['wires']
+    gw_lines = []
+    skipped = set()
+    for line in _read_source(source).splitlines():
+        card = line[:2].upper()
+        fields = line[2:]
+        if card == 'GW':
+            gw_lines.append(fields)
+            continue
+        # --- any other card ends a run of GW cards ---
+        if gw_lines:
+            table.extend(_NEC_gw_table(gw_lines))
+            gw_lines = []
+
+        if card in ['CM', 'CE']:
+            if fields.strip():
+                deck['comments'].append(fields.strip())
+        elif card in _NEC_geometry_cards:
+            _NEC_geometry(table, card, fields)
+        elif card == 'GE':
+            deck['gpflag'] = int(_NEC_fields(fields, 1)[0])
+        elif card == 'GN':
+            v = _NEC_fields(fields, 10)
+            gn = {'ground_type': _NEC_gn_types[int(v[0])], 'rad_wire_count': int(v[1]),
+                  'epsilon': v[4], 'sigma': v[5]}
+            if gn['rad_wire_count'] > 0:
+                gn.update(screen_radius=v[6], screen_wire_radius=v[7])
+            elif any(v[6:]):
+                gn.update(medium_two_epsilon=v[6], medium_two_sigma=v[7],
+                          cliff_boundary_distance=v[8], cliff_drop_distance=v[9])
+            deck['gn'] = gn
+        elif card == 'EX':
+            v = _NEC_fields(fields, 10)
+            ex = {'excitation_type': _NEC_ex_types[int(v[0])]}
+            if int(v[0]) in [0, 5]:
+                ex.update(source_tag=int(v[1]), source_seg=int(v[2]),
+                          ereal=v[4], eimag=v[5])
+            else:
+                ex['fields'] = v[1:]  # --- wave and current sources aren't packed yet ---
+            deck['ex'].append(ex)
+        elif card == 'LD':
+            v = _NEC_fields(fields, 7)
+            ld = {'load_type': _NEC_ld_types[int(v[0])]}
+            if ld['load_type'] != 'none':
+                ld.update(load_tag=int(v[1]), load_seg_start=int(v[2]),
+                          load_seg_end=int(v[3]))
+            ld.update(zip(_NEC_ld_values[ld['load_type']], v[4:]))
+            deck['ld'].append(ld)
+        elif card == 'FR':
+            v = _NEC_fields(fields, 6)
+            deck['fr'] = [int(v[0]), int(v[1]), v[4], v[5]]
+        elif card in ['NE', 'NH']:
+            v = _NEC_fields(fields, 10)
+            if int(v[0]) == 0:
+                nf = {'coord_system': 'rectangular'}
+                names = ['nx', 'ny', 'nz', 'x0', 'y0', 'z0', 'delx', 'dely', 'delz']
+            else:
+                nf = {'coord_system': 'spherical'}
+                names = ['nr', 'nphi', 'ntheta', 'r0', 'phi0', 'theta0',
+                         'delr', 'delphi', 'deltheta']
+            nf.update(zip(names, [int(n) for n in v[1:4]] + v[4:]))
+            deck[card.lower()].append(nf)
+        elif card == 'RP':
+            v = _NEC_fields(fields, 10)
+            xnda = int(v[3])
+            deck['rp'].append({'calc_mode': int(v[0]), 'n_theta': int(v[1]),
+                               'n_phi': int(v[2]), 'output_format': xnda//1000,
+                               'normalization': xnda//100 % 10, 'D': xnda//10 % 10,
+                               'A': xnda % 10, 'theta0': v[4], 'phi0': v[5],
+                               'delta_theta': v[6], 'delta_phi': v[7],
+                               'radial_distance': v[8], 'gain_norm': v[9]})
+        elif card == 'EN':
+            break
+        elif card.strip():
+            skipped.add(card)
+    if gw_lines:
+        table.extend(_NEC_gw_table(gw_lines))
+    if skipped:
+        print(f'read_NEC_deck() skipped unsupported cards {sorted(skipped)}')
+    return deck
@@ -0,0 +1,21 @@
+#test_diskcache.py
+
+import os
+import n3ox_utils.diskcache as dkc
+
+
+def test_lru_eviction(tmp_path):
+    cache = dkc.DiskLRUCache(str(tmp_path), max_bytes=250)
+    keys = [dkc.digest(str(n)) for n in range(3)]
+    for n, key in enumerate(keys):
+        cache.put(key, bytes(100))
+        os.utime(cache.path(key), (n, n))  # deterministic use order
+    assert keys[0] not in cache
+    assert cache.get(keys[0]) is None and cache.misses == 1
+
+    assert cache.get(keys[1]) == bytes(100) and cache.hits == 1
+    cache.put(dkc.digest('new'), bytes(100))
+    assert keys[1] in cache and keys[2] not in cache
+
+    reopened = dkc.DiskLRUCache(str(tmp_path), max_bytes=250)
+    assert set(reopened.index) == set(cache.index)
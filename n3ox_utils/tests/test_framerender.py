@@ -0,0 +1,52 @@
+#test_framerender.py
+
+import os
+import subprocess
+import sys
+import numpy as np
+import n3ox_utils.framerender as frr
+import pytest
+
+
+HEADLESS = '''
+import sys
+for name in ['matplotlib', 'ipywidgets', 'IPython']:
+    sys.modules[name] = None  # --- any import of these now fails ---
+import numpy as np
+import n3ox_utils.framewriters as fwr
+import n3ox_utils.framerender as frr
+
+x = np.linspace(-2, 2, 40)
+X, Y = np.meshgrid(x, x[:30]/2)
+frames = frr.PhasorFrames(np.exp(-(X**2 + Y**2))*np.exp(3j*X),
+                          np.linspace(0, 2*np.pi, 6))
+lut = frr.colormap_lut('fire')
+with fwr.PNGSequenceWriter(sys.argv[1]) as writer:
+    frr.render_parallel(frames, X, Y, frames.limits(), writer, processes=2,
+                        renderer=frr.LUTFrameRenderer, lut=lut, width=1.0, dpi=40)
+'''
+
+
+def python(*args):
+    root = os.path.dirname(os.path.dirname(frr.__file__))
+    env = dict(os.environ, PYTHONPATH=root)
+    return subprocess.run([sys.executable, '-c'] + list(args), env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def test_headless_render_without_matplotlib(tmp_path):
+    python(HEADLESS, str(tmp_path/'frames'))
+    assert len(list((tmp_path/'frames').iterdir())) == 6
+
+    imported = python('import sys, n3ox_utils.framewriters, n3ox_utils.framerender; '
+                      'print(sorted(set(sys.modules) & {"matplotlib", "ipywidgets", '
+                      '"IPython", "n3ox_utils.nfanim"}))')
+    assert imported.strip() == '[]'
+
+
+def test_colorcet_lut_matches_matplotlib_colormap():
+    import colorcet as cc
+    lut = frr.colormap_lut('bky')
+    assert lut.shape == (256, 4)
+    assert np.abs(lut.astype(int) - frr.colormap_lut(cc.cm['bky'])).max() <= 1
+    assert frr.colormap_lut('viridis')[0] == pytest.approx([68, 1, 84, 255], abs=1)
@@ -0,0 +1,56 @@
+#test_framewriters.py
+
+import io
+import n3ox_utils.framewriters as fwr
+import numpy as np
+import pytest
+
+
+def test_write_png_roundtrip():
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(7, 11, 4), dtype=np.uint8)
+    buf = io.BytesIO()
+    fwr.write_png(buf, img)
+    buf.seek(0)
+    with Image.open(buf) as im:
+        assert np.array_equal(np.asarray(im), img)
+
+
+def test_stream_frames_propagates_writer_errors():
+    class FailingWriter(object):
+        def write(self, index, image):
+            if index == 3:
+                raise ValueError('disk full')
+
+    images = (np.zeros((2, 2, 3), dtype=np.uint8) for n in range(100))
+    with pytest.raises(ValueError):
+        fwr.stream_frames(images, FailingWriter(), queue_depth=2)
+
+
+@pytest.mark.skipif(not fwr.FFmpegWriter.available(), reason='needs ffmpeg')
+def test_ffmpeg_writer(tmp_path):
+    outfile = str(tmp_path/'out.mp4')
+    images = (np.full((31, 45, 3), n*20, dtype=np.uint8) for n in range(10))
+    with fwr.FFmpegWriter(outfile, fps=10) as writer:
+        assert fwr.stream_frames(images, writer) == 10
+    assert (tmp_path/'out.mp4').stat().st_size > 0
+
+
+def test_gif_lzw_decodes_with_table_resets(tmp_path):
+    from PIL import Image, ImageSequence
+    rng = np.random.default_rng(1)
+    palette = rng.integers(0, 256, size=(200, 3), dtype=np.uint8)
+    frames = [rng.integers(0, 200, size=(90, 120), dtype=np.uint8)]
+    frames.append(frames[0].copy())
+    frames[1][10:20, 30:35] = 7
+    frames.append(frames[1].copy())
+    outname = str(tmp_path/'delta.gif')
+    with fwr.GIFWriter(outname, palette, fps=10) as writer:
+        for n, frame in enumerate(frames):
+            writer.write(n, frame)
+    with Image.open(outname) as im:
+        decoded = [np.asarray(fr.convert('RGB')) for fr in ImageSequence.Iterator(im)]
+    assert len(decoded) == 3
+    for rgb, frame in zip(decoded, frames):
+        assert np.array_equal(rgb, palette[frame])
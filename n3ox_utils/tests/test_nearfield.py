@@ -0,0 +1,163 @@
+#test_nearfield.py
+
+import n3ox_utils.nearfield as nfd
+import n3ox_utils.necsweep as nsw
+import n3ox_utils.nfanim as nfa
+import n3ox_utils.pynec_helpers as pnh
+import numpy as np
+import pytest
+from test_necsweep import dipole_model
+
+XZ_PLANE = dict(coord_system='rectangular', nx=50, ny=1, nz=40, x0=-5, y0=0.3,
+                z0=-6, delx=0.2, dely=0, delz=0.3)
+
+
+def test_dipole_fields_far_zone():
+    k = 2*np.pi
+    r = 200.0
+    theta = np.deg2rad(60)
+    point = np.array([[r*np.sin(theta), 0, r*np.cos(theta)]])
+    E, H = nfd.dipole_fields(point, np.zeros((1, 3)), np.array([[0, 0, 0.01]]),
+                             np.array([2.0 + 0j]), k)
+    Etheta = 1j*nfd._eta0*k*2.0*0.01*np.sin(theta)/(4*np.pi*r)*np.exp(-1j*k*r)
+    thetahat = np.array([np.cos(theta), 0, -np.sin(theta)])
+    assert thetahat @ E[:, 0] == pytest.approx(Etheta, rel=1e-3)
+    assert H[1, 0] == pytest.approx(Etheta/nfd._eta0, rel=1e-3)
+
+
+def test_tiled_grid_matches_one_card(tmp_path):
+    model = dipole_model()
+    opts = dict(backend=nsw.ShortDipoleBackend, **XZ_PLANE)
+    tiles = nfd.nearfield_tiles(300, **XZ_PLANE)
+    assert len(tiles) == 8 and all(t['nx']*t['nz'] <= 300 for s, t in tiles)
+
+    whole = nfd.near_field_grid(model, 7.0, tile_points=10**6, **opts)
+    tiled = nfd.near_field_grid(model, 7.0, tile_points=300, processes=2, **opts)
+    assert tiled['E'].shape == (3, 40, 50) and tiled['x'].shape == (40, 50)
+    X, Z = np.meshgrid(-5 + 0.2*np.arange(50), -6 + 0.3*np.arange(40))
+    assert tiled['x'] == pytest.approx(X) and tiled['z'] == pytest.approx(Z)
+    for field in 'EH':
+        assert tiled[field] == pytest.approx(whole[field], rel=1e-12)
+
+    # --- one point, straight from the segment currents ---
+    solver = nsw.ShortDipoleBackend()
+    solver.load(model)
+    solver.solve(7.0)
+    E, H = nfd.dipole_fields(np.array([[X[7, 9], 0.3, Z[7, 9]]]),
+                             (solver.seg_start + solver.seg_end)/2,
+                             solver.seg_end - solver.seg_start, solver.currents, solver.k)
+    assert tiled['E'][:, 7, 9] == pytest.approx(E[:, 0])
+
+    anim = nfa.PoyntingFieldAnimation(tiled['x'], tiled['z'], tiled['E'], tiled['H'],
+                                      nframes=4, plane='xz')
+    assert anim.frames[0].shape == (40, 50)
+
+    cache = nsw.result_cache(str(tmp_path/'nf'))
+    first = nfd.near_field_grid(model, 7.0, fields='E', cache=cache, **opts)
+    again = nfd.near_field_grid(model, 7.0, fields='E', cache=cache, **opts)
+    assert cache.hits == 1 and 'H' not in again
+    assert np.array_equal(again['E'], first['E'])
+
+
+def sinusoidal_dipole(h=0.25, k=2*np.pi, nseg=21, rad=1e-4):
+    '''
+    Segments and sinusoidal currents of a center-fed dipole, and its
+    exact (E_rho, E_z, H_phi) fields.
+    '''
+    table = pnh.WireTable.from_endpoints([[[0, 0, -h], [0, 0, h]]],
+                                         segment_count=nseg, rad=rad)
+    seg = table.segments()
+    zc = (seg['start'][:, 2] + seg['end'][:, 2])/2
+    currents = np.sin(k*(h - np.abs(zc))) + 0j
+
+    def exact(P):
+        rho, z = np.hypot(P[:, 0], P[:, 1]), P[:, 2]
+        R1, R2, r = np.hypot(rho, z - h), np.hypot(rho, z + h), np.hypot(rho, z)
+        e1, e2, e0 = np.exp(-1j*k*R1), np.exp(-1j*k*R2), 2*np.cos(k*h)*np.exp(-1j*k*r)
+        Ez = -1j*nfd._eta0/(4*np.pi)*(e1/R1 + e2/R2 - e0/r)
+        Erho = 1j*nfd._eta0/(4*np.pi*rho)*((z - h)*e1/R1 + (z + h)*e2/R2 - z*e0/r)
+        return Erho, Ez, 1j/(4*np.pi*rho)*(e1 + e2 - e0)
+    return seg, currents, exact
+
+
+def test_segment_fields_match_sinusoidal_dipole():
+    seg, currents, exact = sinusoidal_dipole()
+    dseg = 0.5/21
+    zs = np.linspace(-0.4, 0.4, 9)
+    for kernel, nearest in [('segment', 1), ('hertzian', 2)]:
+        for dist in [nearest, 5, 20]:
+            P = np.column_stack([dist*dseg + 0*zs, 0*zs, zs])
+            Erho, Ez, Hphi = exact(P)
+            E, H = nfd.segment_fields(P, seg, currents, 2*np.pi, kernel=kernel,
+                                      max_bytes=2**12)
+            Eerr = np.abs(E[0] - Erho) + np.abs(E[2] - Ez)
+            assert np.max(Eerr)/np.max(np.abs(Erho) + np.abs(Ez)) < 0.01
+            assert np.max(np.abs(H[1] - Hphi))/np.max(np.abs(Hphi)) < 0.01
+
+    # --- several current solutions at once ---
+    P = np.array([[0.1, 0.2, 0.05], [1.0, -2.0, 0.5]])
+    E2, H2 = nfd.segment_fields(P, seg, np.column_stack([currents, 2j*currents]), 2*np.pi)
+    E1, H1 = nfd.segment_fields(P, seg, currents, 2*np.pi)
+    assert E2[..., 1] == pytest.approx(2j*E1) and H2[..., 0] == pytest.approx(H1)
+
+
+def test_perfect_ground_image():
+    table = pnh.WireTable.from_endpoints([[[0, 0, 0.3], [0.4, 0, 0.5]]],
+                                         segment_count=9, rad=1e-3)
+    currents = np.linspace(1, 2, 9) + 0.5j
+    x, y = np.meshgrid(np.linspace(-1, 1, 7), np.linspace(-1, 1, 5))
+    P = np.column_stack([x.ravel(), y.ravel(), 0*x.ravel()])
+    E, H = nfd.segment_fields(P, table, currents, 2*np.pi, ground=True)
+    scale = np.max(np.abs(E))
+    assert np.max(np.abs(E[:2]))/scale < 1e-12 and np.max(np.abs(H[2]))/scale < 1e-12
+    Efree, Hfree = nfd.segment_fields(P, table, currents, 2*np.pi)
+    assert E[2] == pytest.approx(2*Efree[2]) and H[:2] == pytest.approx(2*Hfree[:2])
+
+
+def test_native_engine_grid():
+    model = dipole_model()
+    opts = dict(backend=nsw.ShortDipoleBackend, **XZ_PLANE)
+    tiled = nfd.near_field_grid(model, 7.0, **opts)
+    native = nfd.near_field_grid(model, 7.0, engine='native', kernel='hertzian', **opts)
+    for field in 'EH':
+        assert native[field] == pytest.approx(tiled[field], rel=1e-9)
+    with pytest.raises(UserWarning):
+        nfd.near_field_grid(dict(model, gpflag=1, gn={'ground_type': 'real_SN',
+                                                       'rad_wire_count': 0,
+                                                       'epsilon': 13, 'sigma': 0.005}),
+                            7.0, engine='native', **opts)
+
+
+def test_native_engine_matches_nec():
+    pytest.importorskip('PyNEC')
+    model = dipole_model(length=20.0, nseg=21)
+    plane = dict(XZ_PLANE, y0=1.0)
+    nec = nfd.near_field_grid(model, 7.1, **plane)
+    native = nfd.near_field_grid(model, 7.1, engine='native', **plane)
+    for field in 'EH':
+        err = np.abs(native[field] - nec[field])
+        assert np.max(err)/np.max(np.abs(nec[field])) < 0.01
+
+
+def test_adaptive_grid_resamples_native_grid():
+    model = dipole_model()
+    plane = dict(coord_system='rectangular', nx=401, ny=1, nz=401, x0=-5.0, y0=0.3,
+                 z0=-6.0, delx=0.025, dely=0.0, delz=0.03)
+    opts = dict(backend=nsw.ShortDipoleBackend)
+    full = nfd.near_field_grid(model, 7.0, engine='native', **opts, **plane)
+    adaptive = nfd.adaptive_near_field_grid(model, 7.0, tol=0.01, **opts, **plane)
+    assert adaptive['nevaluated'] < 401*401/10
+    for name in ['x', 'z']:
+        assert adaptive[name] == pytest.approx(full[name])
+    for field in 'EH':
+        err = np.linalg.norm(adaptive[field] - full[field], axis=0)
+        assert np.max(err/np.linalg.norm(full[field], axis=0)) < 0.03
+
+    # --- sampled nodes are exact ---
+    sampler = adaptive['sampler']
+    a, b = sampler.keys//sampler.nb, sampler.keys % sampler.nb
+    inside = (a < 401) & (b < 401)
+    assert sampler.lookup(a, b)[0][:, inside] == pytest.approx(
+        full['E'][:, b[inside], a[inside]])
+    with pytest.raises(UserWarning):
+        nfd.adaptive_near_field_grid(model, 7.0, **opts, **dict(XZ_PLANE, ny=2))
@@ -0,0 +1,140 @@
+#test_necsweep.py
+
+import n3ox_utils.necsweep as nsw
+import n3ox_utils.pynec_helpers as pnh
+import numpy as np
+import pytest
+
+
+def dipole_model(length=10.0, height=0.0, nseg=11):
+    wires = pnh.WireTable.from_endpoints(
+        [[[0, 0, height - length/2], [0, 0, height + length/2]],
+         [[3, 0, 0], [3, 0, 4]]], segment_count=nseg, rad=0.001)
+    return {'wires': wires, 'gpflag': 0,
+            'ex': [{'excitation_type': 'voltage', 'source_tag': 1,
+                    'source_seg': nseg//2 + 1, 'ereal': 1.0, 'eimag': 0.0}],
+            'ld': [{'load_type': 'series_RLC_lump', 'load_tag': 1,
+                    'load_seg_start': nseg//2 + 1, 'R': 5.0, 'L': 0.0, 'C': 0.0}],
+            'rp': [pnh.pack_rp_card_args(n_theta=19, n_phi=2, theta0=0, phi0=0,
+                                         delta_theta=10, delta_phi=90)]}
+
+
+def test_sweep_stand_in_serial_and_pool():
+    freqs = np.linspace(3, 10, 5)
+    params = {'ld.0.R': [0.0, 5.0, 20.0]}
+    serial = nsw.run_sweep(dipole_model(), freqs, params=params,
+                           backend=nsw.ShortDipoleBackend)
+    pooled = nsw.run_sweep(dipole_model(), freqs, params=params,
+                           backend=nsw.ShortDipoleBackend, processes=2)
+    assert serial['impedance'].shape == (3, 5, 1)
+    assert serial['currents'].shape == (3, 5, 22)
+    assert serial['gain'].shape == (3, 5, 19, 2)
+    for key in ['impedance', 'currents', 'gain']:
+        assert np.array_equal(pooled[key], serial[key])
+
+    # --- the load parameter adds straight to the feed impedance ---
+    Z = serial['impedance'][..., 0]
+    assert (Z[2] - Z[0]).real == pytest.approx(20.0)
+    k = 2*np.pi*freqs*1e6/nsw._c_mps
+    assert Z[0].real == pytest.approx(20*(10*k)**2)
+    assert serial['currents'][1, :, 4] == pytest.approx(1/Z[1]*9/11)
+    assert np.all(serial['currents'][:, :, 11:] == 0)
+    assert serial['gain'][0, 0, 9, 0] == pytest.approx(10*np.log10(1.5))
+    assert serial['theta'][-1] == 180.0
+
+
+def test_sweep_geometry_function_pads_currents():
+    def model(nseg, height):
+        return dipole_model(height=height, nseg=nseg)
+    result = nsw.run_sweep(model, [7.0], params={'nseg': [5, 9], 'height': [0, 8]},
+                           backend=nsw.ShortDipoleBackend)
+    assert result['shape'] == (2, 2)
+    assert result['currents'].shape == (2, 2, 1, 18)
+    assert np.all(np.isnan(result['currents'][0, :, :, 10:]))
+    assert not np.any(np.isnan(result['currents'][1]))
+
+    models = list(nsw.sweep_models(dipole_model(), {'wires.zw2.1': [4, 6]}))
+    assert [m['wires']['zw2'][1] for m in models] == [4, 6]
+
+
+def test_pynec_backend_matches_dipole():
+    pytest.importorskip('PyNEC')
+    result = nsw.run_sweep(dipole_model(length=20.0), [7.1], backend=nsw.PyNECBackend)
+    Z = result['impedance'][0, 0]
+    assert 60 < Z.real < 90
+
+
+def test_pynec_backend_bookkeeping():
+    pytest.importorskip('PyNEC')
+    # --- horizontal dipole along x: broadside (phi 90) gain beats end-fire (phi 0) ---
+    model = dict(dipole_model(length=20.0), rp=[pnh.pack_rp_card_args(
+        n_theta=7, n_phi=10, theta0=0, phi0=0, delta_theta=15, delta_phi=10)])
+    model['wires'] = pnh.WireTable.from_endpoints([[[-10, 0, 0], [10, 0, 0]]],
+                                                  segment_count=11, rad=0.001)
+    model['ld'] = []
+    nf = pnh.pack_nearfield_card_args(coord_system='rectangular', nx=3, ny=2, nz=1,
+                                      x0=-1, y0=1, z0=0.5, delx=1, dely=1, delz=0)
+    backend = nsw.PyNECBackend()
+    backend.load(model)
+    first = backend.solve(7.1)
+    fields_first = [backend.near_field(field, nf) for field in 'EH']
+    second = backend.solve(3.5)
+    fields_second = [backend.near_field(field, nf) for field in 'EH']
+
+    gain = first['gain']
+    assert gain.shape == (7, 10)
+    assert gain[-1, -1] > gain[-1, 0] + 20
+    assert np.all(np.diff(gain[-1]) > 0)
+    # --- overhead (theta 0) is broadside too, the same for every phi ---
+    assert gain[0] == pytest.approx(gain[0, 0], abs=1e-6)
+
+    # --- later frequencies and field cards match a fresh context ---
+    fresh = nsw.PyNECBackend()
+    fresh.load(model)
+    alone = fresh.solve(3.5)
+    for key in ['impedance', 'currents', 'gain']:
+        assert second[key] == pytest.approx(alone[key])
+    assert not first['impedance'] == pytest.approx(second['impedance'])
+    for field, values in zip('EH', fields_second):
+        assert values.shape == (3, 6)
+        assert values == pytest.approx(fresh.near_field(field, nf))
+    assert not fields_first[0] == pytest.approx(fields_second[0])
+
+
+class CountingBackend(nsw.ShortDipoleBackend):
+    solved = []
+
+    def solve(self, freq_mhz):
+        CountingBackend.solved.append(freq_mhz)
+        return super().solve(freq_mhz)
+
+
+def test_model_key_canonical():
+    model = dipole_model()
+    key = nsw.model_key(model, 7.0)
+    as_dicts = dict(model, wires=model['wires'].to_wire_dicts())
+    as_dicts['ld'] = [pnh.pack_ld_card_args(**model['ld'][0])]
+    assert nsw.model_key(as_dicts, 7.0) == key
+    nudged = dipole_model(length=10.0 + 1e-13)
+    assert nsw.model_key(nudged, 0.1 + 0.2) == nsw.model_key(model, 0.3)
+    assert nsw.model_key(model, 7.0, nsw.ShortDipoleBackend) != key
+    assert nsw.model_key(dipole_model(length=10.001), 7.0) != key
+
+
+def test_sweep_result_cache(tmp_path):
+    cache = nsw.result_cache(str(tmp_path/'results'))
+    opts = dict(params={'ld.0.R': [0.0, 5.0]}, backend=CountingBackend, cache=cache)
+    CountingBackend.solved = []
+    first = nsw.run_sweep(dipole_model(), [5.0, 7.0], **opts)
+    assert len(CountingBackend.solved) == 4 and first['cache_misses'] == 4
+
+    # --- a rerun skips the solver, a new frequency solves only itself ---
+    again = nsw.run_sweep(dipole_model(), [5.0, 7.0], **opts)
+    assert len(CountingBackend.solved) == 4
+    assert again['cache_hits'] == 4 and cache.hits == 4
+    for key in ['impedance', 'currents', 'gain']:
+        assert np.array_equal(again[key], first[key])
+    more = nsw.run_sweep(dipole_model(), [7.0, 9.0], processes=2, **opts)
+    assert (more['cache_hits'], more['cache_misses']) == (2, 2)
+    assert np.array_equal(more['impedance'][:, 0], first['impedance'][:, 1])
+    assert len(cache) == 6
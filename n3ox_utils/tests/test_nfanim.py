@@ -0,0 +1,275 @@
+#test_nfanim.py
+
+import n3ox_utils.nfanim as nfa
+import n3ox_utils.framerender as frr
+import numpy as np
+import pytest
+
+
+def make_field(nx=40, ny=30):
+    x = np.linspace(-2, 2, nx)
+    y = np.linspace(-1, 1, ny)
+    X, Y = np.meshgrid(x, y)
+    A = np.exp(-(X**2 + Y**2))*np.exp(1j*3*X)
+    return X, Y, A
+
+
+def test_lazy_frames_match_cube():
+    X, Y, A = make_field()
+    scl = lambda F: np.sign(F)*np.abs(F)**0.5
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=17, scalefunc=scl)
+    Ff = A[:, :, np.newaxis]*np.exp(-1j*anim.phase)
+    sCf = scl(Ff.real/np.max(np.abs(Ff)))
+    for n in [0, 5, 16, -1]:
+        assert anim.frames[n] == pytest.approx(sCf[:, :, n])
+    assert anim.clims == pytest.approx([np.min(sCf), np.max(sCf)])
+    assert len(anim.frames) == 17
+    assert 'sCf' not in anim.__dict__
+    assert anim.frames[1:3] == pytest.approx(sCf[:, :, 1:3])
+    assert anim.frames[[4, -1]] == pytest.approx(sCf[:, :, [4, -1]])
+    assert anim.frames[5:5].shape == (30, 40, 0)
+
+
+def test_save_anim_png_sequence(tmp_path):
+    from PIL import Image
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=6)
+    outdir = str(tmp_path/'frames')
+    anim.save_anim(outdir, framelist=[0, 2, 4], writer='png', width=2.0, dpi=50)
+    names = sorted(p.name for p in (tmp_path/'frames').iterdir())
+    assert names == ['img00000.png', 'img00001.png', 'img00002.png']
+    with Image.open(tmp_path/'frames'/'img00001.png') as im:
+        assert im.size == (100, 50)
+        assert im.mode == 'RGB'
+
+
+def test_save_anim_video_falls_back_to_png(tmp_path, monkeypatch):
+    monkeypatch.setattr(nfa.fwr.FFmpegWriter, 'available',
+                        staticmethod(lambda ffmpeg='ffmpeg': False))
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=3)
+    outname = anim.save_anim(str(tmp_path/'movie.mp4'), width=1.0, dpi=40)
+    assert outname == str(tmp_path/'movie')
+    assert len(list((tmp_path/'movie').iterdir())) == 3
+
+
+def test_parallel_render_matches_serial(tmp_path):
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=8)
+    opts = dict(writer='png', width=1.5, dpi=40, cmap='fire')
+    anim.save_anim(str(tmp_path/'serial'), **opts)
+    anim.save_anim(str(tmp_path/'parallel'), processes=3, **opts)
+    serial = sorted((tmp_path/'serial').iterdir())
+    parallel = sorted((tmp_path/'parallel').iterdir())
+    assert [p.name for p in parallel] == [p.name for p in serial]
+    for ps, pp in zip(serial, parallel):
+        assert ps.read_bytes() == pp.read_bytes()
+
+
+def test_lut_renderer_matches_matplotlib():
+    X, Y, A = make_field(nx=120, ny=60)
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=5)
+    lut = nfa.colormap_lut('bky')
+    assert np.abs(lut.astype(int) - nfa.colormap_lut(nfa.cc.cm['bky'])).max() <= 1
+    mplr = nfa.MplFrameRenderer(X, Y, anim.clims, width=4.0, dpi=50,
+                                cmap=nfa.cc.cm['bky'])
+    lutr = nfa.LUTFrameRenderer(X, Y, anim.clims, lut=lut, width=4.0, dpi=50)
+    mimg = mplr.render(anim.frames[2])
+    limg = lutr.render(anim.frames[2])
+    assert limg.shape == mimg.shape[:2] + (4,)
+    close = np.abs(mimg.astype(int) - limg[:, :, :3]).max(axis=-1) <= 1
+    assert np.mean(close) > 0.99
+
+
+def test_save_anim_lut_parallel(tmp_path):
+    from PIL import Image
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=4)
+    anim.save_anim(str(tmp_path/'lut'), writer='png', renderer='lut',
+                   processes=2, width=2.0, dpi=50, cmap='fire')
+    with Image.open(tmp_path/'lut'/'img00003.png') as im:
+        assert im.size == (100, 50)
+        assert im.mode == 'RGBA'
+
+
+def test_preview_frames_fast_paths():
+    X, Y, A = make_field(nx=1000, ny=300)
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=10)
+    fig = anim.plot_preview_frames([0, 3, 6])
+    images = [ax.images[0] for ax in fig.axes[:3]]
+    assert len({id(im.norm) for im in images}) == 1
+    # --- 15 inch wide figure, 5 columns at 100 dpi: 300 pixels per axes ---
+    assert np.asarray(images[0].get_array()) == pytest.approx(anim.frames[0][:, ::3])
+
+    Xw, Yw = np.meshgrid(np.linspace(-2, 2, 40)**3, np.linspace(-1, 1, 30))
+    anim = nfa.CartesianFieldAnimation(Xw, Yw, A[:30, :40], nframes=10)
+    fig = anim.plot_preview_frames([0, 1])
+    assert not fig.axa.images
+    assert len(fig.axa.collections) == 1
+    nfa.mplt.close('all')
+
+
+def test_phase_scrubber_updates_artist_data():
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=10)
+    scrubber = anim.phase_scrubber(min_interval=0.0)
+    drawn = []
+    scrubber.update = lambda value: (drawn.append(value),
+                                     nfa.PhaseScrubber.update(scrubber, value))
+    scrubber.slider.value = 1.234
+    assert drawn == [pytest.approx(1.234)]
+    data = np.asarray(scrubber.artist.get_array())
+    assert data == pytest.approx(anim.frames.frame_at(1.234))
+    nfa.mplt.close('all')
+
+
+def test_save_anim_frame_cache(tmp_path, monkeypatch):
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=6)
+    cache = nfa.frame_cache(str(tmp_path/'cache'))
+    nrendered = []
+    render = nfa.LUTFrameRenderer.render
+    monkeypatch.setattr(nfa.LUTFrameRenderer, 'render',
+                        lambda self, frame: nrendered.append(1) or render(self, frame))
+    opts = dict(writer='png', renderer='lut', width=1.0, dpi=40, cache=cache)
+
+    anim.save_anim(str(tmp_path/'a'), cmap='fire', **opts)
+    assert len(nrendered) == 6 and len(cache) == 6
+    anim.save_anim(str(tmp_path/'b'), cmap='fire', **opts)
+    assert len(nrendered) == 6 and cache.hits == 6
+    for name in ['img00000.png', 'img00005.png']:
+        assert (tmp_path/'a'/name).read_bytes() == (tmp_path/'b'/name).read_bytes()
+
+    # --- a new colormap or scalefunc means new keys ---
+    anim.save_anim(str(tmp_path/'c'), cmap='bky', framelist=[0, 1], **opts)
+    assert len(nrendered) == 8
+    anim2 = nfa.CartesianFieldAnimation(X, Y, A, nframes=6,
+                                        scalefunc=lambda F: F**3)
+    anim2.save_anim(str(tmp_path/'d'), cmap='bky', framelist=[0, 1],
+                    processes=2, **opts)
+    assert len(cache) == 10
+
+
+@pytest.mark.parametrize('ext', ['.gif', '.apng'])
+def test_save_anim_paletted_loop(tmp_path, ext):
+    from PIL import Image, ImageSequence
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=9)
+    outname = anim.save_anim(str(tmp_path/('loop' + ext)), width=2.0, dpi=40,
+                             cmap='fire')
+    lutr = nfa.LUTFrameRenderer(X, Y, anim.clims, width=2.0, dpi=40,
+                                lut=nfa.colormap_lut('fire', ncolors=255))
+    with Image.open(outname) as im:
+        # --- phase 2*pi repeats phase 0 and is left out of the loop ---
+        assert im.n_frames == 8
+        for fnum, frame in enumerate(ImageSequence.Iterator(im)):
+            rgb = np.asarray(frame.convert('RGB'))
+            assert np.array_equal(rgb, lutr.render(anim.frames[fnum])[:, :, :3])
+
+
+def make_em_field(nx=40, nz=30):
+    X, Z, A = make_field(nx, nz)
+    E = np.array([A, 0.5j*A, np.conj(A)*X])
+    H = np.array([0.2*A[::-1], np.exp(1j*Z)*A, -1j*A])
+    return X, Z, E, H
+
+
+def test_poynting_frames_match_cross_product():
+    X, Z, E, H = make_em_field()
+    anim = nfa.PoyntingFieldAnimation(X, Z, E, H, nframes=13, plane='xz')
+    frames = anim.frames
+    for phi in [0.0, 0.7, 2.5]:
+        S = np.cross((E*np.exp(-1j*phi)).real, (H*np.exp(-1j*phi)).real, axis=0)
+        assert frames.vector_at(phi)*frames.norm == pytest.approx(S)
+        assert frames.frame_at(phi)*frames.norm == pytest.approx(
+            np.linalg.norm(S, axis=0))
+    assert np.max(np.abs(anim.clims)) <= 1
+    phases = np.linspace(0, 2*np.pi, 64, endpoint=False)
+    Smean = np.mean([frames.vector_at(phi) for phi in phases], axis=0)
+    assert frames.time_average() == pytest.approx(Smean)
+
+    zframes = nfa.PoyntingFrames(E, H, anim.phase, component='z')
+    assert zframes[3] == pytest.approx(frames.vector_at(anim.phase[3])[2])
+    assert zframes[2:4][..., 1] == pytest.approx(zframes[3])
+
+
+def test_poynting_overlays(tmp_path):
+    X, Z, E, H = make_em_field()
+    anim = nfa.PoyntingFieldAnimation(X, Z, E, H, nframes=6, plane='xz')
+    fig = anim.plot_preview_frames([0, 2], overlay_options={'stride': 5})
+    quiver = fig.axes[0].collections[-1]
+    S = anim.frames.vector_at(0.0)
+    assert quiver.U == pytest.approx(S[0][::5, ::5].ravel())
+    assert quiver.V == pytest.approx(S[2][::5, ::5].ravel())
+    anim.plot_time_average(overlay='stream')
+    nfa.mplt.close('all')
+
+    opts = dict(writer='png', width=1.5, dpi=40, overlay='quiver')
+    anim.save_anim(str(tmp_path/'serial'), **opts)
+    anim.save_anim(str(tmp_path/'parallel'), processes=2, **opts)
+    anim.save_anim(str(tmp_path/'plain'), writer='png', width=1.5, dpi=40)
+    for name in ['img00001.png', 'img00004.png']:
+        overlaid = (tmp_path/'serial'/name).read_bytes()
+        assert (tmp_path/'parallel'/name).read_bytes() == overlaid
+        assert (tmp_path/'plain'/name).read_bytes() != overlaid
+
+
+def test_time_domain_frames_match_direct_sum():
+    X, Y, A = make_field()
+    freqs = np.array([1.0, 1.5, 7.25])
+    amps = np.array([A, 0.5j*A[::-1], np.conj(A)])
+    times = np.linspace(0, 3, 50)
+    frames = nfa.TimeDomainFrames(amps, freqs, times, max_block_bytes=8*40*30*7)
+    assert frames.block_size == 7
+    direct = np.sum((amps[:, :, :, np.newaxis] *
+                     np.exp(-2j*np.pi*freqs[:, None, None, None]*times)).real,
+                    axis=0)
+    direct /= np.max(np.abs(direct))
+    assert frames.materialize() == pytest.approx(direct)
+    assert frames[12] == pytest.approx(direct[:, :, 12])
+    assert frames[10:20:3] == pytest.approx(direct[:, :, 10:20:3])
+    assert frames.limits() == pytest.approx([direct.min(), direct.max()])
+
+    anim = nfa.TimeDomainFieldAnimation(X, Y, amps, freqs, nframes=9)
+    assert anim.frames.samples[-1] == pytest.approx(1.0)
+    assert list(nfa._one_period(anim.frames)) == list(range(9))
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_save_anim_empty_framelist(tmp_path, processes):
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=4)
+    anim.save_anim(str(tmp_path/'empty'), framelist=[], writer='png',
+                   processes=processes, width=1.0, dpi=40)
+    assert not list((tmp_path/'empty').iterdir())
+
+
+def test_func_token_hashes_array_contents(tmp_path):
+    import functools
+
+    def make_scale(table):
+        return lambda F: F*table[0]
+
+    table = np.ones(5000)
+    token = frr._func_token(make_scale(table))
+    assert frr._func_token(make_scale(table.copy())) == token
+    changed = table.copy()
+    changed[2500] = 2.0
+    assert frr._func_token(make_scale(changed)) != token
+
+    scale = functools.partial(np.multiply, table)
+    assert frr._func_token(functools.partial(np.multiply, changed)) != frr._func_token(scale)
+    assert frr._func_token(lambda F, t=changed: F*t[0]) != frr._func_token(
+        lambda F, t=table: F*t[0])
+
+    # --- opaque callables can't be keyed, so save_anim skips the cache ---
+    class Scale(object):
+        def __call__(self, F):
+            return F
+    assert frr._func_token(Scale()) is None
+    X, Y, A = make_field()
+    anim = nfa.CartesianFieldAnimation(X, Y, A, nframes=3, scalefunc=Scale())
+    cache = nfa.frame_cache(str(tmp_path/'cache'))
+    anim.save_anim(str(tmp_path/'a'), writer='png', renderer='lut', width=1.0,
+                   dpi=40, cache=cache)
+    assert len(cache) == 0 and len(list((tmp_path/'a').iterdir())) == 3
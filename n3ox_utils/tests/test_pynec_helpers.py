@@ -1,6 +1,7 @@
 #test_pynec_helpers.py
 
 import n3ox_utils.pynec_helpers as pnh
+import numpy as np
 import pytest
 
 def test_url_import():
@@ -10,3 +11,565 @@ def test_url_import():
     wd = wireinput.return_wire_dicts()
     assert wd[0]['zw2'] == pytest.approx(1.9304)
     
+
+
+def test_wire_table_roundtrip_and_edits():
+    wiredicts = [{'tag_id': 1, 'segment_count': 11, 'xw1': 0.0, 'yw1': 0.0,
+                  'zw1': 0.0, 'xw2': 0.0, 'yw2': 0.0, 'zw2': 10.0,
+                  'rad': 0.002, 'rdel': 1.0, 'rrad': 1.0, 'dielc': 0}]
+    table = pnh.WireTable.from_wire_dicts(wiredicts)
+    assert table.to_wire_dicts() == [{k: v for k, v in wiredicts[0].items()
+                                      if k != 'dielc'}]
+    for n in range(40):
+        table.append(xw2=n+1.0)
+    assert len(table) == 41
+    assert table['tag_id'][-1] == 41 and table['segment_count'][-1] == 11
+    table.delete([0, 5])
+    assert list(table['tag_id']) == list(range(1, 40))
+    table.translate(2.5, 'y')
+    assert table.endpoints[:, :, 1] == pytest.approx(2.5)
+    assert table.endpoints.shape == (39, 2, 3)
+
+    calls = []
+    class Geometry(object):
+        def wire(self, *args):
+            calls.append(args)
+    table.to_pynec(Geometry())
+    assert calls[0] == (1, 11, 0.0, 2.5, 0.0, 1.0, 2.5, 0.0, 0.001, 1.0, 1.0)
+
+
+def test_wire_input_pages_over_the_table():
+    wi = pnh.WireInput(page_size=4)
+    wi.add_wire_row({'zw2': 3.0})
+    wi.add_wire_row()
+    wi.refresh()
+    xw1 = wi.cellnames.index('xw1')
+    wi.rows[1].children[xw1].value = 7.0
+    wi.translate_wires(1.0, 'z')
+    wds = wi.return_wire_dicts()
+    assert [wd['tag_id'] for wd in wds] == [1, 2, 3]
+    assert wds[1]['xw1'] == 7.0 and wds[1]['zw2'] == 4.0
+    assert wi.rows[2].children[wi.cellnames.index('zw1')].value == 1.0
+    assert wi.rows[3].layout.display == 'none'
+    assert wi.wires == wi.rows[:3]
+    assert wi.wires[1].children[xw1].value == 7.0
+
+    wi.on_del_wire(wi.rows[0].children[0])
+    assert wi.nwires == 2
+    assert [wd['tag_id'] for wd in wi.return_wire_dicts()] == [1, 2]
+    assert wi.return_wire_dicts()[0]['xw1'] == 7.0
+
+    # --- big models only touch the pooled rows ---
+    table = pnh.WireTable.from_columns(zw2=np.arange(1.0, 1001.0))
+    wi.load_table(table)
+    assert len(wi.frame.children) == 2 + 4 + 1
+    wi.show_page(249)
+    assert wi.rows[3].children[wi.cellnames.index('zw2')].value == 1000.0
+    assert wi.pagelabel.value == 'wires 997-1000 of 1000'
+    wi.rows[0].children[xw1].value = -1.0
+    assert wi.table['xw1'][996] == -1.0
+    wi.on_del_wire(wi.rows[3].children[0])
+    assert wi.offset == 996 and wi.nwires == 999
+    assert len(wi.wires) == 3
+
+
+def test_wire_input_refresh_holds_each_row():
+    wi = pnh.WireInput(page_size=2)
+    wi.load_table(pnh.WireTable.from_columns(zw2=np.arange(1.0, 4.0)))
+    sent = []
+    for row in wi.rows:
+        for widget in [row.layout] + list(row.children[1:]):
+            widget._send = lambda msg, buffers=None, widget=widget: sent.append(
+                (widget._holding_sync, sorted(msg['state'])))
+    wi.show_page(1)
+    # --- only tag_id, zw2 and the emptied row's display change, each sent once after the row is set ---
+    assert sent == [(False, ['value'])]*2 + [(False, ['display'])]
+    wi.show_page(1)
+    assert len(sent) == 3
+
+
+def test_batch_transforms():
+    wd = {'xw1': 1.0, 'yw1': 0.0, 'zw1': 0.5, 'xw2': 2.0, 'yw2': 1.0, 'zw2': 0.5}
+    th = np.deg2rad(30)
+    Ry = np.array([[np.cos(th), 0, np.sin(th)], [0, 1, 0], [-np.sin(th), 0, np.cos(th)]])
+    p1, p2 = pnh.get_wire_points(pnh.rotate_wiredict(wd, 30, 'y'))
+    assert p1 == pytest.approx(Ry @ [1.0, 0.0, 0.5])
+    assert p2 == pytest.approx(Ry @ [2.0, 1.0, 0.5])
+
+    # --- rotation about an off-origin point, then a mirror ---
+    M = pnh.compose_transforms(pnh.rotation_matrix(90, 'z', point=(1, 1, 0)),
+                               pnh.mirror_matrix('x'))
+    assert pnh.apply_transform([[[2.0, 1.0, 0.0]]], M) == pytest.approx(np.array([[[-1, 2, 0]]]))
+    moved = pnh.transform_wiredicts([dict(wd, rad=0.01)], pnh.translation_matrix((0, 0, 1)))
+    assert moved[0]['zw2'] == 1.5 and moved[0]['rad'] == 0.01 and wd['zw2'] == 0.5
+
+    radial = pnh.WireTable.from_endpoints([[[0, 0, 0], [10, 0, 0]]], segment_count=9)
+    radials = pnh.array_instances(radial, pnh.rotation_matrix(np.arange(0, 360, 90), 'z'))
+    assert len(radials) == 4 and list(radials['tag_id']) == [1, 2, 3, 4]
+    assert radials.endpoints[:, 1, :2] == pytest.approx(np.array([[10, 0], [0, 10], [-10, 0], [0, -10]]))
+    assert list(radials['segment_count']) == [9]*4
+
+    P = np.random.default_rng(0).normal(size=(100000, 2, 3))
+    axis = (1.0, 2.0, 2.0)
+    R = pnh.rotation_matrix(40, axis, point=(3, 0, 0))
+    Q = pnh.apply_transform(P, R)
+    assert np.linalg.norm(Q[:, 0] - Q[:, 1], axis=-1) == pytest.approx(
+        np.linalg.norm(P[:, 0] - P[:, 1], axis=-1))
+    assert Q @ np.array(axis) == pytest.approx(P @ np.array(axis))
+    assert pnh.apply_transform([[3.0, 0, 0]], R) == pytest.approx(np.array([[3.0, 0, 0]]))
+
+
+def test_wire_generators():
+    radials = pnh.radial_wires(1000, 20.0, center=(0, 0, 0.1), start_radius=0.5,
+                               max_seg_length=3.0, first_tag=2)
+    assert len(radials) == 1000 and radials['tag_id'][0] == 2
+    assert radials.lengths == pytest.approx(20.0)
+    assert set(radials['segment_count']) == {7}
+    assert np.hypot(radials['xw2'], radials['yw2']) == pytest.approx(20.5)
+
+    helix = pnh.helix_wires(625, 0.1, 0.05, wires_per_turn=16, axis='x')
+    assert len(helix) == 10000
+    P = helix.endpoints
+    assert P[1:, 0] == pytest.approx(P[:-1, 1])
+    assert P[-1, 1, 0] == pytest.approx(625*0.05)
+    assert np.hypot(P[..., 1], P[..., 2]) == pytest.approx(0.1)
+
+    loop = pnh.polygon_loop(4, 1.0, center=(0, 0, 5), normal='y', segment_count=11)
+    P = loop.endpoints
+    assert np.array_equal(P[-1, 1], P[0, 0])
+    assert P[..., 1] == pytest.approx(0.0)
+    assert loop.lengths == pytest.approx(np.sqrt(2))
+
+    dipole = pnh.WireTable.from_endpoints([[[0, -1, 0], [0, 1, 0]]])
+    stack = pnh.linear_array(dipole, 8, 0.5, axis='x')
+    assert list(stack['tag_id']) == list(range(1, 9))
+    assert stack['xw1'] == pytest.approx(0.5*np.arange(8))
+
+
+@pytest.mark.parametrize('axis', ['z', (0, 0, -1), (0, -1, 0), (1, 2, -2)])
+def test_helix_handedness(axis):
+    a = np.array(axis if axis != 'z' else (0, 0, 1), dtype=float)
+    a /= np.linalg.norm(a)
+    for right_handed, sense in [(True, 1), (False, -1)]:
+        P = pnh.helix_wires(1, 0.1, 0.05, center=(1, 2, 3), axis=axis,
+                            right_handed=right_handed).endpoints
+        # --- advances along the axis and turns counterclockwise about it if right handed ---
+        assert (P[-1, 1] - P[0, 0]) @ a == pytest.approx(0.05)
+        r1, r2 = P[0] - (1, 2, 3)
+        assert np.sign(np.cross(r1, r2) @ a) == sense
+
+    loop = pnh.polygon_loop(6, 1.0, normal=axis)
+    P = loop.endpoints
+    assert np.cross(P[0, 0], P[0, 1]) @ a > 0
+
+
+def test_validate_wires_findings():
+    wires = pnh.WireTable.from_endpoints(
+        [[[0, 0, 0], [0, 0, 1]],          # 1: vertical, joined to 2 at the top
+         [[0, 0, 1], [0, 0, 1.2]],        # 2: junction ratio 0.2 vs 0.02
+         [[-1, 0, 0.5], [1, 0, 0.5]],     # 3: crosses 1 without a junction
+         [[0.01, 0, 1.2], [0.5, 0, 1.2]],  # 4: 1 cm gap from the top of 2
+         [[3, 0, 0], [3, 0, 0.001]]],     # 5: segment shorter than 2 radii
+        segment_count=[5, 10, 9, 5, 1], rad=0.001)
+    report = pnh.validate_wires(wires, ground_z=0.0, wavelength=10.0)
+    assert report.intersections.tolist() == [[1, 3, 3, 5]]
+    assert report.intersection_distances == pytest.approx([0.0])
+    assert report.near_misses.tolist() == []
+    assert report.short_segments.tolist() == [[5, 1]]
+    assert report.long_segments.tolist() == []
+    assert report.bad_junctions.tolist() == [[2, 1, 1, 5]]
+    assert report.junction_ratios == pytest.approx([10.0])
+    assert sorted(report.dangling_ends.tolist()) == [[2, 2], [3, 1], [3, 2], [4, 1], [4, 2], [5, 2]]
+    assert not report.ok
+
+    assert len(pnh.validate_wires(wires, wavelength=1.0).long_segments) == 14
+    wires['xw1'][3] = 0.004
+    report = pnh.validate_wires(wires)
+    assert report.near_misses.tolist() == [[2, 10, 4, 1]]
+    assert report.near_miss_distances == pytest.approx([0.004])
+
+
+def test_validate_wires_matches_brute_force():
+    rng = np.random.default_rng(1)
+    P = rng.uniform(0, 10, size=(300, 2, 3))
+    wires = pnh.WireTable.from_endpoints(P, segment_count=3, rad=0.05)
+    report = pnh.validate_wires(wires, near_factor=4.0)
+    segs = wires.segments()
+    n = len(segs['length'])
+    i, j = np.triu_indices(n, 1)
+    keep = segs['wire'][i] != segs['wire'][j]
+    i, j = i[keep], j[keep]
+    d = pnh.segment_distances(segs['start'][i], segs['end'][i],
+                              segs['start'][j], segs['end'][j])
+    assert len(report.intersections) == np.count_nonzero(d < 0.1)
+    assert len(report.near_misses) == np.count_nonzero((d >= 0.1) & (d < 0.4))
+
+    # --- a point-to-segment check of the distance function ---
+    assert pnh.segment_distances(np.array([[0., 0, 0]]), np.array([[1., 0, 0]]),
+                                 np.array([[2., 1, 0]]), np.array([[2., 1, 0]])) == \
+        pytest.approx([np.sqrt(2)])
+
+
+def test_snap_points_does_not_chain():
+    tol = 1e-3
+    row = np.zeros((100, 3))
+    row[:, 0] = 0.9*tol*np.arange(100)
+    node_ids, nodes = pnh.snap_points(row, tol)
+    assert list(node_ids) == list(np.arange(100)//2)
+    assert nodes == pytest.approx(row[::2])
+
+    # --- the greedy result, checked against a direct loop, duplicates kept ---
+    rng = np.random.default_rng(2)
+    P = rng.uniform(0, 0.02, size=(400, 3))
+    P = np.concatenate([P, P[:50]])[rng.permutation(450)]
+    node_ids, nodes = pnh.snap_points(P, tol)
+    leaders = []
+    expected = []
+    for p in P:
+        near = [n for n, q in enumerate(leaders) if np.linalg.norm(p - q) <= tol]
+        if not near:
+            leaders.append(p)
+            near = [len(leaders) - 1]
+        expected.append(near[0])
+    assert list(node_ids) == expected
+    assert nodes == pytest.approx(np.array(leaders))
+
+
+def chain_time(npoints, spacing=0.9e-3, tol=1e-3, function=pnh.snap_points):
+    import time
+    row = np.zeros((npoints, 3))
+    row[:, 0] = spacing*np.arange(npoints)
+    best = np.inf
+    for repeat in range(3):
+        start = time.perf_counter()
+        function(row, tol)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def test_snap_points_scales_linearly_on_chains():
+    # --- 8x the points: about 8x the time, where settling one link per pass took 64x ---
+    assert chain_time(64000) < 20*chain_time(8000)
+
+
+def wire_row(row, tol):
+    # --- a straight run of wires shorter than tol: every end is within tol of the next ---
+    ends = np.stack([row[:-1], row[1:]], axis=1)
+    return pnh.WireTable.from_endpoints(ends, rad=tol/10)
+
+
+def test_wire_checks_scale_linearly_on_close_ends():
+    def graph(row, tol):
+        assert pnh.wire_graph(wire_row(row, tol), tol=tol).ncomponents == 1
+
+    def validate(row, tol):
+        assert len(pnh.validate_wires(wire_row(row, tol), tol=tol).dangling_ends) == 0
+
+    assert chain_time(64000, function=graph) < 20*chain_time(8000, function=graph)
+    assert chain_time(16000, function=validate) < 20*chain_time(2000, function=validate)
+
+
+def test_wire_graph():
+    loop = pnh.polygon_loop(4, 1.0, center=(0, 0, 5))
+    radials = pnh.radial_wires(8, 5.0, first_tag=5)
+    vert = pnh.WireTable.from_endpoints([[[0, 0, 0], [0, 0, 3]]])
+    model = loop.copy()
+    model.extend(radials)
+    model.extend(vert)
+    model.renumber()
+    # --- a 1e-9 m jitter still snaps ---
+    model['zw2'][0] += 1e-9
+    graph = pnh.wire_graph(model, ground_z=0.0)
+    assert graph.ncomponents == 2
+    assert list(graph.component) == [0]*4 + [1]*9
+    assert len(graph.junctions) == 5
+    hub = graph.wire_nodes[4, 0]
+    assert sorted(graph.wires_at(hub)) == list(range(4, 13))
+    assert sorted(graph.neighbors(12)) == list(range(4, 12))
+    assert list(graph.grounded_wires) == list(range(4, 13))
+    assert len(graph.free_ends) == 1  # the top of the vertical, radial tips are on the ground
+    assert len(graph.connections()) == 4 + 36
+    assert [list(tags) for tags in graph.component_tags()] == [[1, 2, 3, 4], list(range(5, 14))]
+
+    # --- end points on a long helix stay one component ---
+    helix = pnh.helix_wires(300, 0.1, 0.05)
+    assert pnh.wire_graph(helix).ncomponents == 1
+
+
+def test_wire_graph_close_ends_stay_apart():
+    tol = 1e-4
+    stubs = np.zeros((10, 2, 3))
+    stubs[:, 0, 0] = 1.5*tol*np.arange(10)
+    stubs[:, 1, 0] = np.arange(10)
+    stubs[:, 1, 2] = 1.0
+    graph = pnh.wire_graph(stubs, tol=tol)
+    assert graph.ncomponents == 10 and len(graph.junctions) == 0
+
+    # --- 0.9*tol apart, ends pair up with the first end of each junction ---
+    stubs[:, 0, 0] = 0.9*tol*np.arange(10)
+    graph = pnh.wire_graph(stubs, tol=tol)
+    assert graph.ncomponents == 5 and len(graph.junctions) == 5
+    assert list(graph.component) == list(np.arange(10)//2)
+
+
+EZNEC_DESCRIPTION = '''EZNEC+ ver. 6.0
+
+N3OX test wires     1/5/2019     9:42:11 PM
+
+--------------- WIRES ---------------
+
+Wire Conn.--- End 1 (x,y,z : {unit})    Conn.--- End 2 (x,y,z : {unit})  Dia({dia}) Segs  Insulation
+                                                                                       Diel C Thk({dia})
+1               0,       0,       0       W2E1        0,       0,  1.9304          #14      14   1   0
+2  W1E2         0,       0,  1.9304                 0.5,       0,  1.9304          1.6e0     5   1   0
+3  GND          1,       0,       0                   1,       0,     0.5           2.0       3   1   0
+
+'''
+
+
+def test_read_EZNEC_wires_offline(tmp_path):
+    path = tmp_path/'wires.txt'
+    path.write_text(EZNEC_DESCRIPTION.format(unit='m', dia='mm'))
+    table = pnh.read_EZNEC_wires(str(path))
+    assert list(table['tag_id']) == [1, 2, 3]
+    assert list(table['segment_count']) == [14, 5, 3]
+    assert table['zw2'][0] == pytest.approx(1.9304)
+    assert table['rad'] == pytest.approx([0.0016277/2, 0.0008, 0.001], rel=1e-4)
+
+    text = EZNEC_DESCRIPTION.format(unit='ft', dia='in').encode()
+    with open(path, 'wb') as ezf:
+        ezf.write(text)
+    with open(path, 'rb') as ezf:
+        table = pnh.read_EZNEC_wires(ezf)
+    assert table['zw2'][0] == pytest.approx(1.9304*0.3048)
+    assert table['rad'][2] == pytest.approx(0.0254)
+
+    # --- ASCII import format round trip, and wavelength units ---
+    wi = pnh.WireInput()
+    wi.load_table(table)
+    again = pnh.read_EZNEC_wires(wi.get_EZNEC_wirestr().encode())
+    assert again.endpoints == pytest.approx(table.endpoints)
+    assert again['rad'] == pytest.approx(table['rad'])
+    table = pnh.read_EZNEC_wires('wl\n0, 0, 0, 0, 0, 0.25, 0.001, 11\n',
+                                 wavelength=40.0)
+    assert table['zw2'][0] == 10.0 and table['rad'][0] == pytest.approx(0.02)
+    assert table['segment_count'][0] == 11
+    with pytest.raises(UserWarning):
+        pnh.read_EZNEC_wires(b'wl\n0, 0, 0, 0, 0, 0.25, 0.001\n')
+
+    wi.import_EZNEC_wires(EZNEC_DESCRIPTION.format(unit='m', dia='mm').encode())
+    assert wi.return_wire_dicts()[1]['xw2'] == 0.5
+
+
+def serve_files(files, delay=0.0):
+    '''
+    Starts a threaded keep-alive HTTP server for files {path: bytes} that
+    honors If-None-Match. Returns the server and its request log. Paths
+    added to log['broken'] get truncated responses.
+    '''
+    import threading
+    import time
+    import http.server
+
+    log = {'requests': [], 'connections': 0, 'broken': set()}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            log['connections'] += 1
+            super().setup()
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = files.get(self.path)
+            etag = f'"{hash(body)}"'
+            log['requests'].append((self.path, self.headers.get('If-None-Match')))
+            if body is not None and self.path in log['broken']:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body) + 100))
+                self.end_headers()
+                self.wfile.write(body[:10])
+                self.close_connection = True
+                return
+            if body is None:
+                self.send_response(404)
+                body = b''
+            elif self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            else:
+                self.send_response(200)
+                self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, log
+
+
+def test_fetch_EZNEC_wires_concurrently_with_cache(tmp_path):
+    import time
+    files = {f'/w{n}.ez': EZNEC_DESCRIPTION.format(unit='ft', dia='in')
+             .replace('0.5,', f'{n},').encode() for n in range(24)}
+    server, log = serve_files(files, delay=0.1)
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    urls = [base + path for path in files]
+    cache = pnh.url_cache(str(tmp_path/'cache'))
+    try:
+        start = time.perf_counter()
+        tables = pnh.read_EZNEC_wires_from_URLs(urls, cache=cache, max_workers=8)
+        assert time.perf_counter() - start < 24*0.1/2
+        assert log['connections'] <= 8 and len(log['requests']) == 24
+        for n, table in enumerate(tables):
+            assert table['xw2'][1] == pytest.approx(n*0.3048)
+
+        # --- warm cache: no round trips at all ---
+        again = pnh.read_EZNEC_wires_from_URLs(urls, cache=cache)
+        assert len(log['requests']) == 24
+        assert np.array_equal(again[5]['xw1'], tables[5]['xw1'])
+
+        # --- stale cache: conditional requests answered with 304 ---
+        pnh.fetch_urls(urls[:4], cache=cache, max_age=0)
+        assert len(log['requests']) == 28
+        assert all(etag is not None for path, etag in log['requests'][24:])
+        with pytest.raises(pnh.urlrq.HTTPError):
+            pnh.fetch_urls([base + '/missing.ez'], cache=cache)
+
+        # --- truncated responses fall back to a cached copy ---
+        log['broken'].update(['/w0.ez', '/w4.ez'])
+        assert pnh.fetch_urls(urls[:1], cache=cache, max_age=0) == [files['/w0.ez']]
+        with pytest.raises(pnh.http.client.HTTPException):
+            pnh.fetch_urls([urls[4]], max_age=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # --- server gone: cached copies are still served ---
+    assert pnh.fetch_urls(urls[:2], cache=cache, max_age=0) == [files['/w0.ez'],
+                                                                files['/w1.ez']]
+    assert pnh.fetch_urls(urls[3:4], cache=cache, offline=True) == [files['/w3.ez']]
+    with pytest.raises(UserWarning):
+        pnh.fetch_urls([base + '/new.ez'], cache=cache, offline=True)
+
+
+def test_streaming_writers(tmp_path):
+    import io
+    rng = np.random.default_rng(3)
+    table = pnh.WireTable.from_endpoints(rng.normal(size=(20, 2, 3)), rad=0.002)
+    table['rrad'][4] = 1.1
+
+    # --- small chunks exercise the chunk boundaries and the tapered row ---
+    ezbuf = io.StringIO()
+    pnh.write_EZNEC_wires(ezbuf, table, chunk_rows=3)
+    wi = pnh.WireInput()
+    wi.load_table(table)
+    assert wi.get_EZNEC_wirestr() == ezbuf.getvalue()
+    assert ezbuf.getvalue().splitlines()[1] == ', '.join(
+        f'{v:14.12f}' for v in list(table.endpoints[0].ravel()) + [4.0])
+    back = pnh.read_EZNEC_wires(ezbuf.getvalue())
+    assert back.endpoints == pytest.approx(table.endpoints, abs=1e-11)
+
+    deckname = str(tmp_path/'test.nec')
+    pnh.write_NEC_deck(
+        deckname, table, comments='test deck', chunk_rows=3,
+        ex=pnh.pack_ex_card_args(excitation_type='voltage', source_tag=1,
+                                 source_seg=3, ereal=1.0, eimag=0),
+        ld=[pnh.pack_ld_card_args(load_type='wire_conductivity', load_tag=0,
+                                  load_seg_start=0, wire_sigma=5.8e7)],
+        fr=[0, 1, 14.1, 0],
+        rp=pnh.pack_rp_card_args(n_theta=91, n_phi=1, theta0=0, phi0=0,
+                                 delta_theta=1, delta_phi=0, normalization=5))
+    with open(deckname) as deckf:
+        lines = deckf.read().splitlines()
+    cards = [line.split()[0] for line in lines]
+    assert cards == ['CM', 'CE'] + ['GW']*5 + ['GC'] + ['GW']*15 + [
+        'GE', 'LD', 'EX', 'FR', 'RP', 'EN']
+    gw = lines[6].split()
+    assert gw[:3] == ['GW', '5', '5'] and float(gw[-1]) == 0.0
+    assert [float(v) for v in lines[7].split()[3:]] == pytest.approx(
+        [1.0, 0.002, 0.002*1.1**4])
+    assert lines[-2] == 'RP 0 91 1 500 0 0 1 0 0 0'
+
+
+NEC_DECK = '''CM two element yagi, inches
+CE
+GW 1 11 0 -110 0 0 110 0 0.5
+GW,2,11,40,-105,0,40,105,0,0.5
+GC 0 0 1.0 0.5 0.25
+GS 0 0 0.0254
+GA 3 8 0.1 0 90 0.001
+GM 0 0 0 0 0 0 0 3 3
+GH 4 40 10 -50 5 5 5 5 0.1
+GR 10 4
+GE 1
+GN 2 0 0 0 13 0.005
+LD 5 0 0 0 5.8e7
+LD 0 1 6 6 10 1e-6
+EX 0 1 6 0 1 0
+FR 0 1 0 0 14.1 0
+NE 0 4 1 2 -1 0 0 0.5 0 0.5
+RP 0 91 1 1500 0 0 1 0 0 0
+XQ
+EN
+GW 99 1 0 0 0 1 1 1 0.1
+'''
+
+
+def test_read_NEC_deck(tmp_path, capsys):
+    deck = pnh.read_NEC_deck(NEC_DECK.encode())
+    assert 'XQ' in capsys.readouterr().out
+    wires = deck['wires']
+    # --- 2 GW + 8 arc + 40 helix wires, repeated 4 times by GR ---
+    assert len(wires) == 4*50
+    assert wires['tag_id'][:3].tolist() == [1, 2, 3]
+    assert wires.endpoints[1] == pytest.approx(0.0254*np.array([[40, -105, 0], [40, 105, 0]]))
+    assert wires['rad'][1] == pytest.approx(0.5*0.0254)
+    assert wires['rrad'][1]**10 == pytest.approx(0.5)
+    # --- GM lifted the arc (tag >= 3), not the yagi, by 3 ---
+    assert wires['zw1'][2] == pytest.approx(3.0)
+    assert wires['zw2'][9] == pytest.approx(3.1)
+    helix = wires.endpoints[10:50]
+    assert helix[-1, 1] == pytest.approx([5, 0, 50])
+    assert helix[0, 1, 1] < 0  # --- negative HL: left-handed ---
+    assert wires.endpoints[50:100] == pytest.approx(
+        pnh.apply_transform(wires.endpoints[:50], pnh.rotation_matrix(90)))
+    assert wires['tag_id'][50] == 11 and wires['tag_id'][-1] == 34
+
+    assert deck['comments'] == ['two element yagi, inches']
+    assert deck['gpflag'] == 1
+    assert deck['gn'] == {'ground_type': 'real_SN', 'rad_wire_count': 0,
+                          'epsilon': 13.0, 'sigma': 0.005}
+    assert deck['ld'][0] == {'load_type': 'wire_conductivity', 'load_tag': 0,
+                             'load_seg_start': 0, 'load_seg_end': 0,
+                             'wire_sigma': 5.8e7}
+    assert pnh.pack_ld_card_args(**deck['ld'][1]) == [0, 1, 6, 6, 10.0, 1e-6, 0.0]
+    assert pnh.pack_ex_card_args(**deck['ex'][0]) == [0, 1, 6, 0, 1.0, 0.0, 0, 0, 0, 0]
+    assert deck['fr'] == [0, 1, 14.1, 0.0]
+    assert pnh.pack_nearfield_card_args(**deck['ne'][0]) == [0, 4, 1, 2, -1, 0, 0, 0.5, 0, 0.5]
+    assert deck['rp'][0]['output_format'] == 1 and deck['rp'][0]['normalization'] == 5
+
+    # --- write and read back: same deck ---
+    pnh.write_NEC_deck(str(tmp_path/'copy.nec'), **deck)
+    again = pnh.read_NEC_deck(str(tmp_path/'copy.nec'))
+    assert again['wires'].endpoints == pytest.approx(wires.endpoints)
+    assert again['wires']['rrad'] == pytest.approx(wires['rrad'])
+    assert {k: v for k, v in again.items() if k != 'wires'} == {
+        k: v for k, v in deck.items() if k != 'wires'}
+
+
+def test_read_NEC_deck_ragged_gw_cards():
+    deck = pnh.read_NEC_deck(b'CE\nGW 1 5 0 0 0 0 0 1\nGW 2 5 1 0 0 1 0 1 0.001 0.5\n'
+                             b'GW,3,5,2,0,0,2,0,1,0.001\nGE 0\nEN\n')
+    wires = deck['wires']
+    assert wires['tag_id'].tolist() == [1, 2, 3]
+    assert wires['rad'].tolist() == [0.0, 0.001, 0.001]
+    assert wires['zw2'].tolist() == [1.0, 1.0, 1.0]